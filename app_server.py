@@ -7,6 +7,7 @@ import os
 import subprocess
 import sys
 import traceback
+import zlib
 from functools import wraps
 from io import BytesIO
 
@@ -27,9 +28,10 @@ from .lane import Facets, Pagination
 from .log import LogConfiguration
 from .model import Complaint, Identifier, Patron, get_one
 from .opds import AcquisitionFeed, LookupAcquisitionFeed
+from .opds2 import OPDS2Feed
 from .problem_details import *
 from .util.flask_util import OPDSFeedResponse, problem
-from .util.opds_writer import OPDSFeed, OPDSMessage
+from .util.opds_writer import AtomFeed, OPDSFeed, OPDSMessage
 from .util.problem_detail import ProblemDetail
 
 
@@ -92,6 +94,45 @@ def load_pagination_from_request(
     return base_class.from_request(get_arg, default_size, **kwargs)
 
 
+def load_conditional_request_headers():
+    """Gather the validators sent with a conditional request.
+
+    :return: A dictionary of keyword arguments suitable for passing into
+        CachedFeed.fetch (or any of the AcquisitionFeed methods that
+        call it).
+    """
+    get_header = flask.request.headers.get
+    return dict(
+        if_none_match=get_header("If-None-Match"),
+        if_modified_since=get_header("If-Modified-Since"),
+    )
+
+
+def load_feed_class_from_request(opds1=AcquisitionFeed, opds2=OPDS2Feed):
+    """Decide whether to serve an OPDS 1 or an OPDS 2.0 feed, based
+    on the client's Accept header.
+
+    Since the response depends on the Accept header, this also
+    arranges for the response to say so in its Vary header.
+
+    :return: `opds2` if the client prefers OPDS 2.0; `opds1` otherwise.
+    """
+
+    @flask.after_this_request
+    def vary_on_accept(response):
+        response.vary.add("Accept")
+        return response
+
+    # The OPDS 1 types come first so they win a tie, e.g. when the
+    # client will accept anything.
+    best = flask.request.accept_mimetypes.best_match(
+        [AtomFeed.ATOM_TYPE, OPDSFeed.ACQUISITION_FEED_TYPE, opds2.MEDIA_TYPE]
+    )
+    if best == opds2.MEDIA_TYPE:
+        return opds2
+    return opds1
+
+
 def returns_problem_detail(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -103,13 +144,37 @@ def returns_problem_detail(f):
     return decorated
 
 
+# When a response has been precompressed in several encodings that the
+# client accepts, use the first one in this list.
+PRECOMPRESSED_ENCODING_PREFERENCE = ["br", "gzip"]
+
+
+def gzip_stream(chunks):
+    """Compress a sequence of bytestrings as a gzip stream.
+
+    :param chunks: An iterable of bytestrings.
+    :yield: A sequence of bytestrings which, put together, make up a
+        gzip file.
+    """
+    # wbits=31 tells zlib to use the gzip container format.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 def compressible(f):
     """Decorate a function to make it transparently handle whatever
     compression the client has announced it supports.
 
     Currently the only form of compression supported is
     representation-level gzip compression requested through the
-    Accept-Encoding header.
+    Accept-Encoding header. If the response carries a precompressed
+    representation the client can accept (see
+    util.flask_util.Response), that representation is sent as-is,
+    with a strong ETag if the response knows its content hash.
 
     This code was modified from
     http://kb.sites.apiit.edu.my/knowledge-base/how-to-gzip-response-in-flask/,
@@ -132,18 +197,51 @@ def compressible(f):
                 return response
 
             accept_encoding = flask.request.headers.get("Accept-Encoding", "")
+            accepted = [
+                x.split(";")[0].strip() for x in accept_encoding.lower().split(",")
+            ]
+            precompressed = getattr(response, "precompressed", None) or {}
+            for encoding in PRECOMPRESSED_ENCODING_PREFERENCE:
+                if encoding in precompressed and encoding in accepted:
+                    response.direct_passthrough = False
+                    response.data = precompressed[encoding]
+                    response.headers["Content-Encoding"] = encoding
+                    response.vary.add("Accept-Encoding")
+                    response.headers["Content-Length"] = len(response.data)
+                    content_hash = getattr(response, "content_hash", None)
+                    if content_hash:
+                        # Each encoding is a different representation,
+                        # so each needs its own strong ETag.
+                        response.set_etag("%s-%s" % (content_hash, encoding))
+                    return response
+
             if not "gzip" in accept_encoding.lower():
                 return response
 
             # At this point we know we're going to be changing the
             # outgoing response.
 
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                # gzip output isn't byte-for-byte reproducible, so
+                # this representation can only have a weak ETag.
+                response.set_etag(etag, weak=True)
+
             # TODO: I understand what direct_passthrough does, but am
             # not sure what it has to do with this, and commenting it
             # out doesn't change the results or cause tests to
             # fail. This is pure copy-and-paste magic.
             response.direct_passthrough = False
 
+            if response.is_streamed:
+                # Compress the response as it's sent, rather than
+                # loading the whole thing into memory.
+                response.response = gzip_stream(response.iter_encoded())
+                response.headers.pop("Content-Length", None)
+                response.headers["Content-Encoding"] = "gzip"
+                response.vary.add("Accept-Encoding")
+                return response
+
             buffer = BytesIO()
             gzipped = gzip.GzipFile(mode="wb", fileobj=buffer)
             gzipped.write(response.data)
@@ -308,8 +406,9 @@ class URNLookupController(object):
             handler.works,
             annotator,
             precomposed_entries=handler.precomposed_entries,
+            defer_entries=True,
         )
-        return OPDSFeedResponse(str(opds_feed))
+        return opds_feed.as_streaming_response()
 
     def process_urns(self, urns, **process_urn_kwargs):
         """Process a number of URNs by instantiating a URNLookupHandler
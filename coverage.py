@@ -1,6 +1,7 @@
 import logging
 import traceback
 
+from sqlalchemy import or_
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql.functions import func
 
@@ -24,7 +25,8 @@ from .model import (
     get_one_or_create,
 )
 from .util.datetime_helpers import utc_now
-from .util.worker_pools import DatabaseJob
+from .util.http import HostThrottle
+from .util.worker_pools import DatabaseJob, Pool
 
 
 class CoverageFailure(object):
@@ -93,6 +95,11 @@ class CoverageProviderProgress(TimestampData):
         # a single run of the CoverageProvider.
         self.offset = 0
 
+        # The highest ID of any item processed so far. The next batch
+        # will start after this item. Like the offset, this is not
+        # written to the database.
+        self.last_id = None
+
         self.successes = 0
         self.transient_failures = 0
         self.persistent_failures = 0
@@ -153,12 +160,19 @@ class BaseCoverageProvider(object):
     # doing this.
     DEFAULT_BATCH_SIZE = 100
 
+    # The class of the items this CoverageProvider covers, and the
+    # class of the coverage records it creates. Set in
+    # IdentifierCoverageProvider and WorkCoverageProvider.
+    ITEM_CLASS = None
+    COVERAGE_RECORD_CLASS = None
+
     def __init__(
         self,
         _db,
         batch_size=None,
         cutoff_time=None,
         registered_only=False,
+        claim_batches=False,
     ):
         """Constructor.
 
@@ -172,6 +186,11 @@ class BaseCoverageProvider(object):
         CoverageProvider will only cover items that already have been
         "preregistered" with a CoverageRecord with a registered or failing
         status. This option is only used on the Metadata Wrangler.
+
+        :param claim_batches: Optional. If this is True, each batch is
+        claimed by locking the items in the database, so several
+        copies of this CoverageProvider can run at once without
+        covering the same item twice. See claim_batch().
         """
         self._db = _db
         if not self.__class__.SERVICE_NAME:
@@ -186,6 +205,7 @@ class BaseCoverageProvider(object):
         self.batch_size = batch_size
         self.cutoff_time = cutoff_time
         self.registered_only = registered_only
+        self.claim_batches = claim_batches
         self.collection_id = None
 
     @property
@@ -240,10 +260,12 @@ class BaseCoverageProvider(object):
             # 'finish' date to guarantee that progress.is_complete
             # starts out False.
             #
-            # Also set the offset to zero to ensure that we always start
-            # at the start of the database table.
+            # Also set the offset to zero and forget the last item
+            # processed, to ensure that we always start at the start
+            # of the database table.
             original_finish = progress.finish = None
             progress.offset = 0
+            progress.last_id = None
 
             # Call run_once() until we get an exception or
             # progress.finish is set.
@@ -339,11 +361,34 @@ class BaseCoverageProvider(object):
             ", ".join(count_as_covered)
         )
 
-        qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
-        self.log.info("%d items need coverage%s", qu.count(), count_as_covered_message)
-        batch = qu.limit(self.batch_size).offset(progress.offset)
+        if self.claim_batches:
+            batch = self.claim_batch(count_as_covered, progress.start)
+            self.log.info(
+                "Claimed %d items that need coverage%s",
+                len(batch),
+                count_as_covered_message,
+            )
+            empty = not batch
+        elif progress.offset:
+            # We've been told to skip a certain number of items,
+            # probably because other workers are covering them.
+            qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
+            self.log.info(
+                "%d items need coverage%s", qu.count(), count_as_covered_message
+            )
+            batch = qu.limit(self.batch_size).offset(progress.offset)
+            empty = not batch.count()
+        else:
+            batch = self.next_batch(progress, count_as_covered)
+            self.log.info(
+                "Found %d items that need coverage%s after ID %s",
+                len(batch),
+                count_as_covered_message,
+                progress.last_id,
+            )
+            empty = not batch
 
-        if not batch.count():
+        if empty:
             # The batch is empty. We're done.
             progress.finish = utc_now()
             return progress
@@ -360,6 +405,18 @@ class BaseCoverageProvider(object):
         progress.transient_failures += transient_failures
         progress.persistent_failures += persistent_failures
 
+        if self.claim_batches:
+            # Every item in this batch now has a coverage record
+            # created during this run, so it won't be claimed
+            # again. There's no offset to keep track of.
+            return progress
+
+        if not progress.offset:
+            # The next batch will pick up after this one, no matter
+            # what happened to the items in this batch.
+            progress.last_id = max(x.id for x in batch)
+            return progress
+
         if BaseCoverageRecord.SUCCESS not in count_as_covered:
             # If any successes happened in this batch, increase the
             # offset to ignore them, or they will just show up again
@@ -380,6 +437,71 @@ class BaseCoverageProvider(object):
 
         return progress
 
+    def next_batch(self, progress, count_as_covered=None):
+        """Find the next batch of items that need coverage.
+
+        Items are taken in order of ID, starting after
+        `progress.last_id`, so finding each batch takes about the
+        same amount of time no matter how far into the table we are.
+
+        :return: A list of items.
+        """
+        qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
+        # This is usually ITEM_CLASS, but a subclass may cover some
+        # other kind of item.
+        item_class = qu.column_descriptions[0]["entity"]
+        if progress.last_id is not None:
+            qu = qu.filter(item_class.id > progress.last_id)
+        return qu.order_by(item_class.id).limit(self.batch_size).all()
+
+    def claim_batch(self, count_as_covered=None, attempted_before=None):
+        """Claim a batch of items that need coverage.
+
+        The items are locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+        any other worker looking for items to cover will pass them
+        over. The locks are released when the database session is
+        committed, which finalize_batch() does once coverage records
+        have been written for the whole batch. By then the items no
+        longer need coverage, so no other worker will claim them.
+
+        :param count_as_covered: Which values for CoverageRecord.status
+            should count as meaning 'already covered'.
+        :param attempted_before: An item whose coverage record was
+            created or updated at or after this time won't be claimed,
+            whatever its status. This keeps an item that fails with a
+            transient error from being claimed over and over in the
+            same run.
+        :return: A list of items.
+        """
+        qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
+        # This is usually ITEM_CLASS, but a subclass may cover some
+        # other kind of item.
+        item_class = qu.column_descriptions[0]["entity"]
+        if attempted_before:
+            record_class = self.COVERAGE_RECORD_CLASS
+            qu = qu.filter(
+                or_(record_class.id == None, record_class.timestamp < attempted_before)
+            )
+        while True:
+            claimed = (
+                qu.limit(self.batch_size)
+                .with_for_update(skip_locked=True, of=item_class)
+                .all()
+            )
+            if not claimed:
+                return claimed
+
+            # Another worker may have covered some of these items and
+            # released its locks after our query started but before
+            # we locked the items. A new query will see that worker's
+            # coverage records.
+            ids = [x.id for x in claimed]
+            batch = qu.filter(item_class.id.in_(ids)).all()
+            if batch:
+                return batch
+            # Every item we claimed had already been covered. Those
+            # items won't show up again, so try another batch.
+
     def process_batch_and_handle_results(self, batch):
         """:return: A 2-tuple (counts, records).
 
@@ -406,24 +528,22 @@ class BaseCoverageProvider(object):
 
         unhandled_items = set(batch)
         success_items = []
+        failures = []
         for item in results:
             if isinstance(item, CoverageFailure):
                 if item.obj in unhandled_items:
                     unhandled_items.remove(item.obj)
-                record = self.record_failure_as_coverage_record(item)
                 if item.transient:
                     self.log.warn(
                         "Transient failure covering %r: %s", item.obj, item.exception
                     )
-                    record.status = BaseCoverageRecord.TRANSIENT_FAILURE
                     transient_failures += 1
                 else:
                     self.log.error(
                         "Persistent failure covering %r: %s", item.obj, item.exception
                     )
-                    record.status = BaseCoverageRecord.PERSISTENT_FAILURE
                     persistent_failures += 1
-                records.append(record)
+                failures.append(item)
             else:
                 # Count this as a success and prepare to add a
                 # coverage record for it. It won't show up anymore, on
@@ -433,8 +553,6 @@ class BaseCoverageProvider(object):
                 successes += 1
                 success_items.append(item)
 
-        records.extend(self.add_coverage_records_for(success_items))
-
         # Perhaps some records were ignored--they neither succeeded nor
         # failed. Treat them as transient failures.
         for item in unhandled_items:
@@ -442,12 +560,12 @@ class BaseCoverageProvider(object):
                 "%r was ignored by a coverage provider that was supposed to cover it.",
                 item,
             )
-            failure = self.failure_for_ignored_item(item)
-            record = self.record_failure_as_coverage_record(failure)
-            record.status = BaseCoverageRecord.TRANSIENT_FAILURE
-            records.append(record)
+            failures.append(self.failure_for_ignored_item(item))
             num_ignored += 1
 
+        records.extend(self.record_failures_as_coverage_records(failures))
+        records.extend(self.add_coverage_records_for(success_items))
+
         self.log.info(
             "Batch processed with %d successes, %d transient failures, %d persistent failures, %d ignored.",
             successes,
@@ -485,6 +603,26 @@ class BaseCoverageProvider(object):
         """
         return [self.add_coverage_record_for(item) for item in items]
 
+    def record_failures_as_coverage_records(self, failures):
+        """Convert a group of CoverageFailures from a batch into
+        coverage records.
+        """
+        records = []
+        for failure in failures:
+            record = self.record_failure_as_coverage_record(failure)
+            record.status = self.coverage_status(failure)
+            records.append(record)
+        return records
+
+    @classmethod
+    def coverage_status(cls, failure):
+        """Which status should a coverage record for the given
+        CoverageFailure have?
+        """
+        if failure.transient:
+            return BaseCoverageRecord.TRANSIENT_FAILURE
+        return BaseCoverageRecord.PERSISTENT_FAILURE
+
     def handle_success(self, item):
         """Do something special to mark the successful coverage of the
         given item.
@@ -604,6 +742,9 @@ class IdentifierCoverageProvider(BaseCoverageProvider):
     # Collections the Identifier belongs to.
     COVERAGE_COUNTS_FOR_EVERY_COLLECTION = True
 
+    ITEM_CLASS = Identifier
+    COVERAGE_RECORD_CLASS = CoverageRecord
+
     def __init__(
         self,
         _db,
@@ -1036,10 +1177,67 @@ class IdentifierCoverageProvider(BaseCoverageProvider):
         record.exception = None
         return record
 
+    def add_coverage_records_for(self, items):
+        """Add CoverageRecords for a group of Editions/Identifiers from
+        a batch, each of which was successful.
+        """
+        statuses = [
+            (self._identifier_for(item).id, CoverageRecord.SUCCESS, None)
+            for item in items
+        ]
+        return CoverageRecord.bulk_upsert(
+            self._db,
+            statuses,
+            self.data_source,
+            operation=self.operation,
+            collection=self.collection_or_not,
+        )
+
     def record_failure_as_coverage_record(self, failure):
         """Turn a CoverageFailure into a CoverageRecord object."""
         return failure.to_coverage_record(operation=self.operation)
 
+    def record_failures_as_coverage_records(self, failures):
+        """Turn a group of CoverageFailures into CoverageRecords, creating
+        or updating them all at once.
+        """
+        # Failures usually share a data source and collection, but
+        # they don't have to.
+        by_source = dict()
+        for failure in failures:
+            if not failure.data_source:
+                raise Exception(
+                    "Cannot convert coverage failure to CoverageRecord because it has no output source."
+                )
+            key = (failure.data_source, failure.collection)
+            by_source.setdefault(key, []).append(
+                (
+                    self._identifier_for(failure.obj).id,
+                    self.coverage_status(failure),
+                    failure.exception,
+                )
+            )
+
+        records = []
+        for (data_source, collection), statuses in by_source.items():
+            records.extend(
+                CoverageRecord.bulk_upsert(
+                    self._db,
+                    statuses,
+                    data_source,
+                    operation=self.operation,
+                    collection=collection,
+                )
+            )
+        return records
+
+    @classmethod
+    def _identifier_for(cls, item):
+        """Find the Identifier for an Edition or Identifier."""
+        if isinstance(item, Edition):
+            return item.primary_identifier
+        return item
+
     def failure_for_ignored_item(self, item):
         """Create a CoverageFailure recording the CoverageProvider's
         failure to even try to process an item.
@@ -1358,7 +1556,12 @@ class CollectionCoverageProviderJob(DatabaseJob):
     def run(self, _db, **kwargs):
         collection = _db.merge(self.collection)
         provider = self.provider_class(collection, **self.provider_kwargs)
-        provider.run_once(self.progress)
+        if provider.claim_batches:
+            # Keep claiming batches until there are none left.
+            while not self.progress.is_complete:
+                provider.run_once(self.progress)
+        else:
+            provider.run_once(self.progress)
         provider.finalize_timestampdata(self.progress)
 
 
@@ -1393,8 +1596,157 @@ class BibliographicCoverageProvider(CollectionCoverageProvider):
     limited to things like formats that don't vary between
     Collections, and you should use a CollectionMonitor to make sure
     your circulation information is up-to-date for each Collection.
+
+    Most of the time spent covering a book is usually spent waiting
+    on a remote service. A subclass can split process_item() into
+    fetch(), which talks to the remote service, and process_fetched(),
+    which uses the database. If it then sets FETCH_THREADS, the
+    fetches for each batch will run concurrently.
     """
 
+    # How many threads to use when fetching data for a batch. If this
+    # is 1, each Identifier in a batch is covered in turn by
+    # process_item().
+    FETCH_THREADS = 1
+
+    # Make no more than this many requests to any one host at once,
+    # no matter how many threads are fetching.
+    MAX_REQUESTS_PER_HOST = 2
+
+    # Wait at least this many seconds between starting requests to
+    # any one host.
+    MIN_REQUEST_INTERVAL = 0
+
+    def __init__(self, collection, **kwargs):
+        super(BibliographicCoverageProvider, self).__init__(collection, **kwargs)
+
+        # fetch() implementations should wrap their requests in
+        # self.throttle.request(url).
+        self.throttle = HostThrottle(
+            self.MAX_REQUESTS_PER_HOST, self.MIN_REQUEST_INTERVAL
+        )
+        self._fetch_pool = None
+
+    def process_batch(self, batch):
+        """Cover a batch of Identifiers.
+
+        If FETCH_THREADS is more than 1, data for the entire batch
+        is fetched concurrently, and then the results are processed
+        one at a time in this thread.
+        """
+        if self.FETCH_THREADS <= 1:
+            return super(BibliographicCoverageProvider, self).process_batch(batch)
+
+        if self.__class__.fetch is BibliographicCoverageProvider.fetch:
+            # Find this out now; an exception raised in a worker
+            # thread would be lost.
+            raise NotImplementedError(
+                "%s sets FETCH_THREADS but doesn't implement fetch()."
+                % self.__class__.__name__
+            )
+
+        fetched = self.fetch_batch(batch)
+        results = []
+        for identifier in batch:
+            if identifier in fetched:
+                result, exception = fetched[identifier]
+                if exception is not None:
+                    result = self._fetch_failure(identifier, exception)
+            else:
+                # The worker died without recording anything.
+                result = self.failure(identifier, "Data was never fetched.")
+            if not isinstance(result, CoverageFailure):
+                result = self.process_fetched(identifier, result)
+            if not isinstance(result, CoverageFailure):
+                self.handle_success(identifier)
+            results.append(result)
+        return results
+
+    def fetch_batch(self, batch):
+        """Call fetch() on every Identifier in a batch, using a pool of
+        FETCH_THREADS threads.
+
+        :return: A dictionary mapping each Identifier to a 2-tuple
+            (result, exception): whatever fetch() returned for it, or
+            the exception it raised.
+        """
+        if not self._fetch_pool:
+            self._fetch_pool = Pool(self.FETCH_THREADS)
+
+        fetched = dict()
+
+        def fetch(identifier):
+            fetched[identifier] = self._fetch(identifier)
+
+        for identifier in batch:
+            # The worker threads can't safely use the database
+            # session, so make sure the Identifier is loaded before
+            # handing it off.
+            identifier.identifier
+            self._fetch_pool.put(lambda identifier=identifier: fetch(identifier))
+        self._fetch_pool.join()
+        return fetched
+
+    def _fetch(self, identifier):
+        """Call fetch(), catching any exception it raises.
+
+        This runs in a worker thread, so it doesn't build a
+        CoverageFailure itself -- that needs the database session.
+
+        :return: A 2-tuple (result, exception).
+        """
+        try:
+            return self.fetch(identifier), None
+        except Exception as e:
+            return None, e
+
+    def _fetch_failure(self, identifier, exception):
+        """Turn an exception raised by fetch() into a transient
+        CoverageFailure.
+        """
+        self.log.error("Error fetching data for %r", identifier, exc_info=exception)
+        return self.failure(identifier, repr(exception), transient=True)
+
+    def process_item(self, identifier):
+        """Cover a single Identifier by fetching its data and then
+        processing it.
+
+        Subclasses that don't implement fetch() and process_fetched()
+        must override this method.
+        """
+        try:
+            result = self.fetch(identifier)
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            return self._fetch_failure(identifier, e)
+        if isinstance(result, CoverageFailure):
+            return result
+        return self.process_fetched(identifier, result)
+
+    def fetch(self, identifier):
+        """Retrieve whatever is needed from a remote service to cover
+        the given Identifier.
+
+        When FETCH_THREADS is more than 1 this is called from a worker
+        thread, so it must not touch the database session -- not even
+        by lazy-loading an attribute of `identifier`.
+
+        :return: Anything; it will be passed into process_fetched().
+            Alternatively, a CoverageFailure.
+        """
+        raise NotImplementedError()
+
+    def process_fetched(self, identifier, data):
+        """Use data obtained by fetch() to cover the given Identifier.
+
+        This is always called from the thread that owns the database
+        session.
+
+        :return: Either the Identifier or a CoverageFailure.
+        """
+        raise NotImplementedError()
+
     def handle_success(self, identifier):
         """Once a book has bibliographic coverage, it can be given a
         work and made presentation ready.
@@ -1406,6 +1758,9 @@ class WorkCoverageProvider(BaseCoverageProvider):
 
     """Perform coverage operations on Works rather than Identifiers."""
 
+    ITEM_CLASS = Work
+    COVERAGE_RECORD_CLASS = WorkCoverageRecord
+
     @classmethod
     def register(cls, work, force=False):
         """Registers a work for future coverage.
@@ -1477,12 +1832,10 @@ class WorkCoverageProvider(BaseCoverageProvider):
         """Add WorkCoverageRecords for a group of works from a batch,
         each of which was successful.
         """
-        WorkCoverageRecord.bulk_add(works, operation=self.operation)
-
-        # We can't return the specific WorkCoverageRecords that were
-        # created, but it doesn't matter because they're not used except
-        # in tests.
-        return []
+        statuses = [(work.id, WorkCoverageRecord.SUCCESS, None) for work in works]
+        return WorkCoverageRecord.bulk_upsert(
+            self._db, statuses, operation=self.operation
+        )
 
     def add_coverage_record_for(self, work):
         """Record this CoverageProvider's coverage for the given
@@ -1494,6 +1847,18 @@ class WorkCoverageProvider(BaseCoverageProvider):
         """Turn a CoverageFailure into a WorkCoverageRecord object."""
         return failure.to_work_coverage_record(operation=self.operation)
 
+    def record_failures_as_coverage_records(self, failures):
+        """Turn a group of CoverageFailures into WorkCoverageRecords,
+        creating or updating them all at once.
+        """
+        statuses = [
+            (failure.obj.id, self.coverage_status(failure), failure.exception)
+            for failure in failures
+        ]
+        return WorkCoverageRecord.bulk_upsert(
+            self._db, statuses, operation=self.operation
+        )
+
 
 class PresentationReadyWorkCoverageProvider(WorkCoverageProvider):
     """A WorkCoverageProvider that only covers presentation-ready works."""
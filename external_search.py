@@ -1,14 +1,25 @@
+import bisect
 import contextlib
+import copy
 import datetime
+import functools
+import hashlib
 import json
 import logging
 import os
 import re
 import time
-from collections import defaultdict
+import uuid
+from collections import defaultdict, deque
+from queue import Empty, Queue
+from threading import RLock
 
 from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import ElasticsearchException, RequestError
+from elasticsearch.exceptions import (
+    ConnectionTimeout,
+    ElasticsearchException,
+    RequestError,
+)
 from elasticsearch.helpers import bulk as elasticsearch_bulk
 from elasticsearch_dsl import SF, Index, MultiSearch, Search
 from elasticsearch_dsl.query import (
@@ -25,8 +36,11 @@ from elasticsearch_dsl.query import (
 )
 from elasticsearch_dsl.query import Query as BaseQuery
 from elasticsearch_dsl.query import SimpleQueryString, Term, Terms
+from elasticsearch_dsl.utils import AttrList
+from expiringdict import ExpiringDict
 from flask_babel import lazy_gettext as _
 from spellchecker import SpellChecker
+from sqlalchemy import func, inspect
 
 from .classifier import (
     AgeClassifier,
@@ -37,7 +51,7 @@ from .classifier import (
 from .config import CannotLoadConfiguration, Configuration
 from .coverage import CoverageFailure, WorkPresentationProvider
 from .facets import FacetConstants
-from .lane import Pagination
+from .lane import Lane, Pagination
 from .metadata_layer import IdentifierData
 from .model import (
     Collection,
@@ -55,10 +69,11 @@ from .model import (
 from .monitor import WorkSweepMonitor
 from .problem_details import INVALID_INPUT
 from .selftest import HasSelfTests, SelfTestResult
-from .util.datetime_helpers import from_timestamp
+from .util.datetime_helpers import from_timestamp, utc_now
 from .util.personal_names import display_name_to_sort_name
 from .util.problem_detail import ProblemDetail
 from .util.stopwords import ENGLISH_STOPWORDS
+from .util.worker_pools import DatabasePool, Pool
 
 
 @contextlib.contextmanager
@@ -88,11 +103,60 @@ class ExternalSearchIndex(HasSelfTests):
     TEST_SEARCH_TERM_KEY = "test_search_term"
     DEFAULT_TEST_SEARCH_TERM = "test"
 
+    RESULT_CACHE_TTL_KEY = "result_cache_ttl"
+    DEFAULT_RESULT_CACHE_TTL = 60
+
+    SEARCH_TIMEOUT_KEY = "search_timeout"
+
+    SLOW_SEARCH_THRESHOLD_KEY = "slow_search_threshold"
+
     work_document_type = "work-type"
     __client = None
 
     CURRENT_ALIAS_SUFFIX = "current"
-    VERSION_RE = re.compile("-v([0-9]+)$")
+
+    # An index name ends with the mapping version, optionally followed
+    # by a timestamp if the index was rebuilt alongside an older
+    # copy of the same version; see rebuild_index_name().
+    VERSION_RE = re.compile("-v([0-9]+)(-[0-9]+)?$")
+
+    # Settings that make it faster to load a new index that isn't
+    # being searched yet. See finish_bulk_load().
+    BULK_LOAD_SETTINGS = dict(refresh_interval="-1", number_of_replicas=0)
+
+    # bulk_update() sends documents in chunks of no more than this
+    # many bytes. The number of documents in a chunk starts at
+    # BULK_CHUNK_SIZE and is adjusted between BULK_MIN_CHUNK_SIZE and
+    # BULK_MAX_CHUNK_SIZE depending on how long each chunk takes to
+    # upload and whether the cluster is rejecting requests.
+    BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+    BULK_CHUNK_SIZE = 500
+    BULK_MIN_CHUNK_SIZE = 10
+    BULK_MAX_CHUNK_SIZE = 5000
+    BULK_TARGET_SECONDS = 5
+
+    # Documents that fail with one of these statuses are retried,
+    # with exponential backoff, up to BULK_MAX_RETRIES times. A status
+    # that isn't a number means no response was received at all.
+    BULK_REJECTED_STATUS = 429
+    BULK_RETRY_STATUSES = [BULK_REJECTED_STATUS, 502, 503, 504]
+    BULK_MAX_RETRIES = 3
+    BULK_INITIAL_BACKOFF = 0.5
+    BULK_MAX_BACKOFF = 30
+
+    # query_works_multi() sends no more than this many searches in a
+    # single request. If there are more, the requests are run in
+    # parallel by a pool of this many threads, shared by every
+    # ExternalSearchIndex in the process.
+    MULTI_SEARCH_BATCH_SIZE = 10
+    MULTI_SEARCH_THREADS = 4
+    _search_pool = None
+    _search_pool_lock = RLock()
+
+    # When a search has a timeout, Elasticsearch returns whatever it
+    # found when the timeout expires. Allow this many more seconds for
+    # those results to arrive before giving up on them.
+    SEARCH_TIMEOUT_GRACE = 1
 
     SETTINGS = [
         {
@@ -116,8 +180,54 @@ class ExternalSearchIndex(HasSelfTests):
             "default": DEFAULT_TEST_SEARCH_TERM,
             "description": _("Self tests will use this value as the search term."),
         },
+        {
+            "key": RESULT_CACHE_TTL_KEY,
+            "label": _("Search result cache lifetime (seconds)"),
+            "type": "number",
+            "default": DEFAULT_RESULT_CACHE_TTL,
+            "description": _(
+                "Results of identical searches will be reused for this many seconds instead of asking Elasticsearch again. Set this to 0 to disable the cache."
+            ),
+        },
+        {
+            "key": SEARCH_TIMEOUT_KEY,
+            "label": _("Search timeout (seconds)"),
+            "type": "number",
+            "description": _(
+                "When a feed needs the results of several searches, any search that takes longer than this will be left out of the feed. By default, there is no timeout."
+            ),
+        },
+        {
+            "key": SLOW_SEARCH_THRESHOLD_KEY,
+            "label": _("Slow search threshold (seconds)"),
+            "type": "number",
+            "description": _(
+                "Any search that takes longer than this will be logged, along with the query that was sent to Elasticsearch. By default, no searches are logged."
+            ),
+        },
     ]
 
+    # A SearchResultCache, used by query_works_multi() to avoid
+    # running identical searches over and over.
+    result_cache = None
+
+    # The SearchResultCache shared by every ExternalSearchIndex in
+    # this process that wasn't given a cache of its own.
+    __result_cache = None
+
+    # How long, in seconds, a process remembers which index the
+    # -current alias points to. Once the alias moves, every process
+    # will be writing to the new index within this much time.
+    CURRENT_INDEX_CACHE_TTL = 60
+    __current_index = ExpiringDict(max_len=100, max_age_seconds=CURRENT_INDEX_CACHE_TTL)
+
+    # How many seconds query_works_multi() gives each search before
+    # giving up on it.
+    search_timeout = None
+
+    # A SearchMetrics object which is told how long each search took.
+    metrics = None
+
     SITEWIDE = True
 
     @classmethod
@@ -128,6 +238,8 @@ class ExternalSearchIndex(HasSelfTests):
         This method is only intended for use in testing.
         """
         cls.__client = None
+        ExternalSearchIndex.__result_cache = None
+        ExternalSearchIndex.__current_index.clear()
 
     @classmethod
     def search_integration(cls, _db):
@@ -182,6 +294,8 @@ class ExternalSearchIndex(HasSelfTests):
         test_search_term=None,
         in_testing=False,
         mapping=None,
+        result_cache=None,
+        metrics=None,
     ):
         """Constructor
 
@@ -192,6 +306,12 @@ class ExternalSearchIndex(HasSelfTests):
 
         :param mapping: A custom Mapping object, for use in unit tests. By
         default, the most recent mapping will be instantiated.
+
+        :param result_cache: A SearchResultCache to use instead of the
+        default in-process cache, e.g. one shared between processes.
+
+        :param metrics: A SearchMetrics to use instead of the default,
+        which keeps its measurements in memory.
         """
         self.log = logging.getLogger("External search index")
         self.works_index = None
@@ -219,6 +339,27 @@ class ExternalSearchIndex(HasSelfTests):
             if not works_index:
                 works_index = self.works_index_name(_db)
             test_search_term = integration.setting(self.TEST_SEARCH_TERM_KEY).value
+        if integration:
+            self.search_timeout = integration.setting(
+                self.SEARCH_TIMEOUT_KEY
+            ).float_value
+        if result_cache is None:
+            ttl = self.DEFAULT_RESULT_CACHE_TTL
+            if integration:
+                value = integration.setting(self.RESULT_CACHE_TTL_KEY).int_value
+                if value is not None:
+                    ttl = value
+            if ttl > 0:
+                result_cache = self.shared_result_cache(ttl)
+        self.result_cache = result_cache
+        if metrics is None:
+            slow_threshold = None
+            if integration:
+                slow_threshold = integration.setting(
+                    self.SLOW_SEARCH_THRESHOLD_KEY
+                ).float_value
+            metrics = SearchMetrics(slow_threshold=slow_threshold)
+        self.metrics = metrics
         if not url:
             raise CannotLoadConfiguration("No URL configured to Elasticsearch server.")
         self.test_search_term = test_search_term or self.DEFAULT_TEST_SEARCH_TERM
@@ -269,6 +410,17 @@ class ExternalSearchIndex(HasSelfTests):
         # The index name to use is the one known to be right for this
         # version.
         self.works_index = self.__client.works_index = self.works_index_name(_db)
+
+        # If the alias was moved to a rebuilt copy of that index, use
+        # the copy instead. Finding that out takes two requests, so the
+        # answer is shared by every object in this process for a while.
+        current = ExternalSearchIndex.__current_index.get(self.works_index)
+        if current is None:
+            current = self.current_alias_index(_db) or ""
+            ExternalSearchIndex.__current_index[self.works_index] = current
+        if current.startswith(self.works_index + "-"):
+            self.works_index = self.__client.works_index = current
+
         if not self.indices.exists(self.works_index):
             # That index doesn't actually exist. Set it up.
             self.setup_index()
@@ -293,6 +445,7 @@ class ExternalSearchIndex(HasSelfTests):
 
         def _use_as_works_alias(name):
             self.works_alias = self.__client.works_alias = name
+            self.clear_result_cache()
 
         if alias_is_set:
             # The alias exists on the Elasticsearch server, so it must
@@ -372,6 +525,7 @@ class ExternalSearchIndex(HasSelfTests):
             )
 
         self.works_index = self.__client.works_index = new_index
+        ExternalSearchIndex.__current_index.clear()
         alias_name = self.works_alias_name(_db)
 
         exists = self.indices.exists_alias(name=alias_name)
@@ -392,14 +546,42 @@ class ExternalSearchIndex(HasSelfTests):
             other_indices.remove(self.works_index)
 
         if other_indices:
-            # The alias exists on one or more other indices.  Remove
-            # the alias altogether, then put it back on the works
-            # index.
-            self.indices.delete_alias(index="_all", name=alias_name)
-            self.indices.put_alias(index=self.works_index, name=alias_name)
+            # The alias exists on one or more other indices. Move it
+            # to the works index in a single request, so there's no
+            # moment when searches run against no index at all.
+            actions = [
+                dict(remove=dict(index=x, alias=alias_name)) for x in other_indices
+            ]
+            actions.append(dict(add=dict(index=self.works_index, alias=alias_name)))
+            self.indices.update_aliases(body=dict(actions=actions))
 
         self.works_alias = self.__client.works_alias = alias_name
 
+        # Results from the old index are no longer valid.
+        self.clear_result_cache()
+
+    @classmethod
+    def shared_result_cache(cls, ttl):
+        """Find the SearchResultCache shared by this process.
+
+        ExternalSearchIndex objects are created for every request that
+        needs one, so a cache that belonged to a single object would
+        never be used twice. Clearing the shared cache through any
+        object clears it for all of them.
+
+        :param ttl: Results expire after this many seconds. If the
+            shared cache has a different lifetime, it's replaced.
+        """
+        cache = ExternalSearchIndex.__result_cache
+        if cache is None or cache.ttl != ttl:
+            cache = ExternalSearchIndex.__result_cache = SearchResultCache(ttl=ttl)
+        return cache
+
+    def clear_result_cache(self):
+        """Forget the results of any searches run so far."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
     def base_index_name(self, index_or_alias):
         """Removes version or current suffix from base index name"""
 
@@ -409,8 +591,116 @@ class ExternalSearchIndex(HasSelfTests):
 
         return base_works_index
 
-    def create_search_doc(self, query_string, filter, pagination, debug):
+    def current_alias_index(self, _db):
+        """Find the index the -current alias points to.
+
+        :return: An index name, or None if the alias doesn't exist or
+            points to more than one index.
+        """
+        alias_name = self.works_alias_name(_db)
+        if not self.indices.exists_alias(name=alias_name):
+            return None
+        indices = list(self.indices.get_alias(name=alias_name).keys())
+        if len(indices) != 1:
+            return None
+        return indices[0]
+
+    def rebuild_index_name(self, _db):
+        """Choose a name for a new copy of the current version's index,
+        which can be built while the existing index is still in use.
+        """
+        return "%s-%s" % (
+            self.works_index_name(_db),
+            utc_now().strftime("%Y%m%d%H%M%S"),
+        )
+
+    def index_settings(self, index, keys):
+        """Look up some of the settings of an index.
+
+        :return: A dictionary containing whichever of `keys` is set.
+        """
+        settings = self.indices.get_settings(index=index)[index]["settings"]["index"]
+        return dict((key, settings[key]) for key in keys if key in settings)
+
+    def finish_bulk_load(self, index, settings):
+        """Make an index created with BULK_LOAD_SETTINGS ready to be
+        searched.
+
+        :param settings: The settings to use in place of
+            BULK_LOAD_SETTINGS, generally taken from the index being
+            replaced.
+        """
+        settings = dict(settings)
+        for key in self.BULK_LOAD_SETTINGS:
+            # Elasticsearch resets a setting that's set to null.
+            settings.setdefault(key, None)
+        self.indices.put_settings(index=index, body=dict(index=settings))
+        self.indices.refresh(index=index)
+
+        # The index won't change much from here on, so merge it
+        # down to as few segments as possible.
+        self.indices.forcemerge(index=index, max_num_segments=1)
+        self.warm_index(index)
+
+    def warm_index(self, index):
+        """Run some searches against an index so that its caches are
+        loaded before it starts serving real searches.
+        """
+        search = Search(using=self.__client, index=index)
+        Query(self.test_search_term).build(search).execute()
+        for order in ("sort_title", "sort_author"):
+            search.sort(order)[:1].execute()
+
+    def compare_indexes(self, new_index, old_index, sample_size=100, tolerance=0):
+        """Check that a new index contains what an older index does.
+
+        :param sample_size: The number of randomly chosen documents from
+            `old_index` to look for in `new_index`.
+        :param tolerance: The fraction by which `new_index` may have
+            fewer documents than `old_index`.
+        :return: A list of strings describing problems with `new_index`.
+        """
+        problems = []
+        new_count = self.__client.count(index=new_index)["count"]
+        old_count = self.__client.count(index=old_index)["count"]
+        if new_count < old_count * (1 - tolerance):
+            problems.append(
+                "%s contains %d documents, but %s contains %d."
+                % (new_index, new_count, old_index, old_count)
+            )
+
+        sample = (
+            Search(using=self.__client, index=old_index)
+            .query(FunctionScore(functions=[SF("random_score")]))
+            .source(["title"])[:sample_size]
+        )
+        for hit in sample.execute():
+            new_doc = self.__client.get(
+                index=new_index,
+                doc_type=self.work_document_type,
+                id=hit.meta.id,
+                _source=["title"],
+                ignore=[404],
+            )
+            if not new_doc.get("found"):
+                problems.append(
+                    "Document %s is missing from %s." % (hit.meta.id, new_index)
+                )
+            elif new_doc["_source"].get("title") != hit.to_dict().get("title"):
+                problems.append(
+                    "Document %s has a different title in %s."
+                    % (hit.meta.id, new_index)
+                )
+        return problems
+
+    def create_search_doc(self, query_string, filter, pagination, debug, fields=None):
+        """Build a Search object for a query.
 
+        :param fields: A list of fields, beyond the work ID, that the
+            caller needs from each search result. These are taken
+            from doc values, so they must be keyword, numeric or date
+            fields, and their values come back as lists.
+        """
         query = Query(query_string, filter)
         search = query.build(self.search, pagination)
         if debug:
@@ -419,27 +709,39 @@ class ExternalSearchIndex(HasSelfTests):
         if filter is not None and filter.min_score is not None:
             search = search.extra(min_score=filter.min_score)
 
-        fields = None
         if debug:
             # Don't restrict the fields at all -- get everything.
             # This makes it easy to investigate everything about the
             # results we do get.
-            fields = ["*"]
-        else:
-            # All we absolutely need is the work ID, which is a
-            # key into the database, plus the values of any script fields,
-            # which represent data not available through the database.
-            fields = ["work_id"]
-            if filter:
-                fields += list(filter.script_fields.keys())
-
-        # Change the Search object so it only retrieves the fields
-        # we're asking for.
-        if fields:
-            search = search.source(fields)
-        return search
+            return search.source(["*"])
+
+        # All we absolutely need is the work ID, which is a key into
+        # the database, plus the values of any script fields, which
+        # represent data not available through the database. Script
+        # fields are added by Query.build, and the work ID can be read
+        # from doc values, so there's no need to load and decode the
+        # source document at all.
+        docvalue_fields = ["work_id"]
+        for field in fields or []:
+            if field not in docvalue_fields:
+                docvalue_fields.append(field)
+        return search.source(False).extra(docvalue_fields=docvalue_fields)
 
-    def query_works(self, query_string, filter=None, pagination=None, debug=False):
+    @classmethod
+    def _unwrap_work_ids(cls, results):
+        """Make each Hit's work_id a single value, as it is when the
+        work ID comes from the source document rather than from doc
+        values.
+        """
+        for hit in results:
+            work_id = getattr(hit, "work_id", None)
+            if isinstance(work_id, (AttrList, list)) and work_id:
+                hit.work_id = work_id[0]
+        return results
+
+    def query_works(
+        self, query_string, filter=None, pagination=None, debug=False, fields=None
+    ):
         """Run a search query.
 
         This works by calling query_works_multi().
@@ -454,6 +756,9 @@ class ExternalSearchIndex(HasSelfTests):
             ElasticSearch for all available fields, not just the
             fields known to be used by the feed generation code.  This
             all comes at a slight performance cost.
+        :param fields: A list of fields, beyond the work ID, that the
+            caller needs from each search result. See
+            create_search_doc().
         :return: A list of Hit objects containing information about
             the search results. This will include the values of any
             script fields calculated by ElasticSearch during the
@@ -466,19 +771,35 @@ class ExternalSearchIndex(HasSelfTests):
 
         pagination = pagination or Pagination.default()
         query_data = (query_string, filter, pagination)
-        [result] = self.query_works_multi([query_data], debug)
+        [result] = self.query_works_multi([query_data], debug, fields=fields)
         return result
 
-    def query_works_multi(self, queries, debug=False):
+    def query_works_multi(
+        self, queries, debug=False, batch_size=None, timeout=None, fields=None
+    ):
         """Run several queries simultaneously and return the results
         as a big list.
 
         :param queries: A list of (query string, Filter, Pagination) 3-tuples,
             each representing an Elasticsearch query to be run.
+        :param batch_size: Send no more than this many queries in a
+            single request. If there are more queries than this, the
+            requests are run in parallel. Defaults to
+            MULTI_SEARCH_BATCH_SIZE.
+        :param timeout: Give up on any query that hasn't finished
+            after this many seconds. Defaults to the search_timeout
+            setting of the search integration.
+        :param fields: A list of fields, beyond the work ID, that the
+            caller needs from each search result. See
+            create_search_doc().
 
         :yield: A sequence of lists, one per item in `queries`,
             each containing the search results from that
-            (query string, Filter, Pagination) 3-tuple.
+            (query string, Filter, Pagination) 3-tuple. If a query
+            ran out of time, its results will have a `timed_out`
+            attribute set to True. They may contain whatever
+            Elasticsearch found before the timeout, or they may be
+            an empty TimedOutSearchResults.
         """
         # If the works alias is not set, all queries return empty.
         #
@@ -489,14 +810,24 @@ class ExternalSearchIndex(HasSelfTests):
             for q in queries:
                 yield []
 
-        # Create a MultiSearch.
-        multi = MultiSearch(using=self.__client)
-
-        # Give it a Search object for every query definition passed in
-        # as part of `queries`.
-        for (query_string, filter, pagination) in queries:
+        batch_size = batch_size or self.MULTI_SEARCH_BATCH_SIZE
+        if timeout is None:
+            timeout = self.search_timeout
+
+        # Build a Search object for every query definition passed in
+        # as part of `queries`. Any search whose results are already
+        # in the cache doesn't need to be sent to Elasticsearch.
+        queries = list(queries)
+        resultset = [None] * len(queries)
+        cache_keys = [None] * len(queries)
+        to_run = []
+        for i, (query_string, filter, pagination) in enumerate(queries):
             search = self.create_search_doc(
-                query_string, filter=filter, pagination=pagination, debug=debug
+                query_string,
+                filter=filter,
+                pagination=pagination,
+                debug=debug,
+                fields=fields,
             )
             function_scores = filter.scoring_functions if filter else None
             if function_scores:
@@ -506,12 +837,50 @@ class ExternalSearchIndex(HasSelfTests):
                     score_mode="sum",
                 )
                 search = search.query(function_score)
-            multi = multi.add(search)
+            if timeout:
+                # Elasticsearch will stop looking for results after
+                # this long and return what it has.
+                search = search.extra(timeout="%dms" % (timeout * 1000))
+            if self.result_cache is not None and not debug:
+                cache_keys[i] = self.result_cache.key(
+                    self.works_alias, search.to_dict()
+                )
+                resultset[i] = self.result_cache.get(cache_keys[i])
+                if resultset[i] is not None:
+                    continue
+            to_run.append((i, search))
 
         a = time.time()
-        # NOTE: This is the code that actually executes the ElasticSearch
-        # request.
-        resultset = [x for x in multi.execute()]
+        batches = [
+            to_run[start : start + batch_size]
+            for start in range(0, len(to_run), batch_size)
+        ]
+        lanes = [getattr(filter, "lane_id", None) for ignore, filter, ignore in queries]
+        for batch, results in zip(
+            batches, self._run_multi_searches(batches, timeout, lanes)
+        ):
+            if results is None:
+                # This batch didn't finish in time.
+                results = [TimedOutSearchResults() for x in batch]
+            for (i, search), result in zip(batch, results):
+                resultset[i] = self._unwrap_work_ids(result)
+                if cache_keys[i] is not None and not getattr(
+                    result, "timed_out", False
+                ):
+                    self.result_cache.set(cache_keys[i], result)
+
+        timed_out = [
+            i
+            for i, results in enumerate(resultset)
+            if getattr(results, "timed_out", False)
+        ]
+        if timed_out:
+            self.log.warning(
+                "%d of %d searches timed out after %.2f seconds.",
+                len(timed_out),
+                len(queries),
+                time.time() - a,
+            )
 
         if debug:
             b = time.time()
@@ -530,7 +899,7 @@ class ExternalSearchIndex(HasSelfTests):
                         result.meta["shard"],
                     )
 
-        for i, results in enumerate(resultset):
+        for (query_string, filter, pagination), results in zip(queries, resultset):
             # Tell the Pagination object about the page that was just
             # 'loaded' so that Pagination.next_page will work.
             #
@@ -539,6 +908,187 @@ class ExternalSearchIndex(HasSelfTests):
             pagination.page_loaded(results)
             yield results
 
+    @classmethod
+    def search_pool(cls):
+        """The pool of threads used to run searches in parallel."""
+        with cls._search_pool_lock:
+            if cls._search_pool is None:
+                cls._search_pool = Pool(cls.MULTI_SEARCH_THREADS)
+            return cls._search_pool
+
+    def _run_multi_searches(self, batches, timeout=None, lanes=None):
+        """Run batches of searches, one request per batch.
+
+        If there's more than one batch, the batches are run in
+        parallel.
+
+        :param batches: A list of lists of (index, Search) 2-tuples.
+        :param timeout: Give up on any batch that hasn't finished
+            after this many seconds (plus SEARCH_TIMEOUT_GRACE).
+        :param lanes: A list of Lane IDs, used to label measurements
+            of each search. The index that goes with a search is used
+            to look up its Lane.
+        :return: A list, parallel to `batches`, of lists of
+            results. A batch that didn't finish in time is
+            represented by None.
+        """
+        if timeout:
+            timeout += self.SEARCH_TIMEOUT_GRACE
+        searches = [[search for i, search in batch] for batch in batches]
+        batch_lanes = [
+            [lanes[i] if lanes else None for i, search in batch] for batch in batches
+        ]
+        if len(searches) < 2:
+            # There's no need to involve any other threads.
+            return [
+                self._multi_search(x, timeout, y) for x, y in zip(searches, batch_lanes)
+            ]
+
+        finished = Queue()
+
+        def job(n, batch):
+            def run():
+                try:
+                    results = self._multi_search(batch, timeout, batch_lanes[n])
+                except Exception as e:
+                    # Let the calling thread deal with the exception.
+                    results = e
+                finished.put((n, results))
+
+            return run
+
+        pool = self.search_pool()
+        for n, batch in enumerate(searches):
+            pool.put(job(n, batch))
+
+        results = [None] * len(searches)
+        if timeout:
+            deadline = time.time() + timeout
+        for ignore in searches:
+            wait = None
+            if timeout:
+                wait = max(deadline - time.time(), 0)
+            try:
+                n, batch_results = finished.get(timeout=wait)
+            except Empty:
+                # We're out of time. Anything that hasn't finished yet
+                # is left out.
+                break
+            if isinstance(batch_results, Exception):
+                raise batch_results
+            results[n] = batch_results
+        return results
+
+    def _multi_search(self, searches, timeout=None, lanes=None):
+        """Run a list of searches in a single request.
+
+        :param lanes: A list of Lane IDs, parallel to `searches`, used
+            to label measurements of each search.
+        :return: A list of results, one per search, or None if the
+            request timed out.
+        """
+        multi = MultiSearch(using=self.__client)
+        for search in searches:
+            multi = multi.add(search)
+        if timeout:
+            multi = multi.params(request_timeout=timeout)
+        a = time.time()
+        try:
+            # NOTE: This is the code that actually executes the
+            # ElasticSearch request.
+            results = list(multi.execute())
+        except ConnectionTimeout as e:
+            if not timeout:
+                raise
+            self.log.warning("Search request timed out: %r", e)
+            return None
+        elapsed = time.time() - a
+        lanes = lanes or [None] * len(searches)
+        for search, result, lane in zip(searches, results, lanes):
+            self._record_search("query_works_multi", elapsed, search, result, lane)
+        return results
+
+    def _record_search(self, call, elapsed, search, results=None, lane=None):
+        """Tell the SearchMetrics object about a search that just
+        finished.
+
+        :param call: The name of the method that ran the search.
+        :param elapsed: How long the request took, in seconds.
+        :param search: The Search that was sent.
+        :param results: The Response that came back, if any.
+        :param lane: The ID of the Lane that was searched, if any.
+        """
+        if self.metrics is None:
+            return
+        took = request_bytes = response_bytes = None
+        if results is not None and getattr(results, "took", None) is not None:
+            took = results.took / 1000.0
+        if self.metrics.measure_sizes:
+            # The request and response have to be serialized all over
+            # again to be measured, so this only happens on request.
+            search = search.to_dict()
+            request_bytes = len(json.dumps(search, default=str))
+            if results is not None:
+                response_bytes = len(json.dumps(results.to_dict(), default=str))
+        self.metrics.search_finished(
+            call,
+            elapsed,
+            search,
+            took=took,
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            lane=lane,
+        )
+
+    def iterate_works(self, filter=None, query_string=None, page_size=500):
+        """Go through every work that matches a search, a page at a time.
+
+        Each page picks up after the last item on the previous page
+        (using search_after), rather than at a numeric offset, so
+        going through all the results takes time proportional to the
+        number of results, no matter how many there are.
+
+        All the requests are routed to the same shard copies, so the
+        results come back in a consistent order even while the index
+        is changing.
+
+        :param filter: A Filter object. If it doesn't specify an
+            order, results are ordered by work ID.
+        :param page_size: The number of results to ask for at once.
+        :yield: A sequence of lists of Hit objects, one per page.
+        """
+        if filter is not None and filter.match_nothing is True:
+            return
+        preference = "iterate-" + uuid.uuid4().hex
+        pagination = SortKeyPagination(size=page_size)
+        while pagination is not None:
+            search = self.create_search_doc(
+                query_string, filter=filter, pagination=pagination, debug=False
+            )
+            if filter is None or not filter.order:
+                # search_after needs an order that ends in a unique
+                # field.
+                search = search.sort({"work_id": "asc"})
+            search = search.params(preference=preference)
+            a = time.time()
+            page = self._unwrap_work_ids(search.execute())
+            self._record_search(
+                "iterate_works",
+                time.time() - a,
+                search,
+                page,
+                getattr(filter, "lane_id", None),
+            )
+            pagination.page_loaded(page)
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                # That was the last page; there's no need to ask for
+                # another one.
+                break
+            pagination = pagination.next_page
+
     def count_works(self, filter):
         """Instead of retrieving works that match `filter`, count the total."""
         if filter is not None and filter.match_nothing is True:
@@ -548,101 +1098,264 @@ class ExternalSearchIndex(HasSelfTests):
         qu = self.create_search_doc(
             query_string=None, filter=filter, pagination=None, debug=False
         )
-        return qu.count()
-
-    def bulk_update(self, works, retry_on_batch_failure=True):
-        """Upload a batch of works to the search index at once."""
+        a = time.time()
+        count = qu.count()
+        self._record_search(
+            "count_works", time.time() - a, qu, lane=getattr(filter, "lane_id", None)
+        )
+        return count
+
+    def bulk_update(self, works, retry_on_batch_failure=True, fragments=None):
+        """Upload a batch of works to the search index.
+
+        Search documents are generated and uploaded a chunk at a time,
+        so a large batch never has to be held in memory all at once.
+        Documents that fail for a reason that might be temporary are
+        retried; see bulk_send().
+
+        :param retry_on_batch_failure: If this is False, documents that
+            fail will not be retried.
+        :param fragments: If this is a list of keys of
+            Work.SEARCH_DOCUMENT_FRAGMENTS, only those parts of each
+            search document will be regenerated, and they will be
+            merged into the documents already in the index. A work
+            with no document in the index will fail.
+        """
 
         if not works:
             # There's nothing to do. Don't bother making any requests
             # to the search index.
             return [], []
 
-        time1 = time.time()
-        needs_add = []
-        successes = []
-        for work in works:
-            needs_add.append(work)
-
-        # Add/update any works that need adding/updating.
-        docs = Work.to_search_documents(needs_add)
+        works = list(works)
+        max_retries = self.BULK_MAX_RETRIES if retry_on_batch_failure else 0
+        indexed = set()
+        errors = {}
+        unidentified_errors = []
+        doc_count = 0
+        create_time = upload_time = 0
+
+        position = 0
+        while position < len(works):
+            time1 = time.time()
+            batch = works[position : position + self.bulk_chunk_size]
+            position += len(batch)
+            docs = [
+                self.bulk_action(doc, fragments)
+                for doc in Work.to_search_documents(batch, fragments=fragments)
+            ]
+            doc_count += len(docs)
+            time2 = time.time()
+            create_time += time2 - time1
+
+            for chunk in self.bulk_chunks(docs):
+                chunk_indexed, chunk_errors = self.bulk_send(chunk, max_retries)
+                indexed.update(chunk_indexed)
+                for error_id, error in chunk_errors.items():
+                    if error_id is None:
+                        unidentified_errors.append(error)
+                    else:
+                        errors[error_id] = error
+            upload_time += time.time() - time2
 
-        for doc in docs:
-            doc["_index"] = self.works_index
-            doc["_type"] = self.work_document_type
-        time2 = time.time()
-
-        success_count, errors = self.bulk(
-            docs,
-            raise_on_error=False,
-            raise_on_exception=False,
+        self.log.info(
+            "Created %i search documents in %.2f seconds" % (doc_count, create_time)
         )
+        self.log.info(
+            "Uploaded %i search documents in  %.2f seconds" % (doc_count, upload_time)
+        )
+
+        # Searches may now turn up different results.
+        self.clear_result_cache()
 
-        # If the entire update failed, try it one more time before
-        # giving up on the batch.
-        if len(errors) == len(docs):
-            if retry_on_batch_failure:
-                self.log.info("Elasticsearch bulk update timed out, trying again.")
-                return self.bulk_update(needs_add, retry_on_batch_failure=False)
+        successes = []
+        failures = []
+        for work in works:
+            doc_id = str(work.id)
+            if doc_id in errors:
+                failures.append((work, self.bulk_error_message(errors[doc_id])))
+            elif doc_id in indexed:
+                successes.append(work)
             else:
-                docs = []
+                # We weren't able to create a search document for
+                # this work, maybe because it doesn't have a
+                # presentation edition yet.
+                failures.append((work, "Work not indexed"))
+        for error in unidentified_errors:
+            failures.append((None, self.bulk_error_message(error)))
 
-        time3 = time.time()
-        self.log.info(
-            "Created %i search documents in %.2f seconds" % (len(docs), time2 - time1)
-        )
         self.log.info(
-            "Uploaded %i search documents in  %.2f seconds" % (len(docs), time3 - time2)
+            "Successfully indexed %i documents, failed to index %i."
+            % (len(successes), len(failures))
         )
 
-        doc_ids = [d["_id"] for d in docs]
+        return successes, failures
 
-        # We weren't able to create search documents for these works, maybe
-        # because they don't have presentation editions yet.
-        def get_error_id(error):
-            return error.get("data", {}).get("_id", None) or error.get("index", {}).get(
-                "_id", None
+    def bulk_action(self, doc, fragments=None):
+        """Turn a search document into a bulk action for the works index."""
+        if fragments:
+            # This is a partial document; turn it into an update
+            # action so it doesn't replace the whole document.
+            doc = dict(_op_type="update", _id=doc.pop("_id"), doc=doc)
+        doc["_index"] = self.works_index
+        doc["_type"] = self.work_document_type
+        return doc
+
+    def bulk_chunks(self, actions):
+        """Split a list of bulk actions into chunks that respect
+        both the current chunk size and BULK_MAX_CHUNK_BYTES.
+        """
+        chunk = []
+        chunk_bytes = 0
+        for action in actions:
+            size = len(json.dumps(action, default=str))
+            if chunk and (
+                len(chunk) >= self.bulk_chunk_size
+                or chunk_bytes + size > self.BULK_MAX_CHUNK_BYTES
+            ):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(action)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def bulk_send(self, actions, max_retries=None):
+        """Send a chunk of bulk actions to the search index.
+
+        Documents that fail with one of BULK_RETRY_STATUSES, or
+        without any response from the server, are sent again after an
+        exponentially increasing delay. Documents that were indexed
+        are not sent again.
+
+        :return: A 2-tuple (indexed, errors). `indexed` is a set of the
+            IDs of the documents that were indexed; `errors` maps the
+            ID of each document that wasn't to the error reported for
+            it. Elasticsearch reports document IDs as strings, so all
+            of these IDs are strings.
+        """
+        if max_retries is None:
+            max_retries = self.BULK_MAX_RETRIES
+        pending = dict((str(action["_id"]), action) for action in actions)
+        indexed = set()
+        errors = {}
+        attempt = 0
+        while pending:
+            started = time.time()
+            success_count, attempt_errors = self.bulk(
+                list(pending.values()),
+                raise_on_error=False,
+                raise_on_exception=False,
             )
+            elapsed = time.time() - started
 
-        error_ids = [get_error_id(error) for error in errors]
-
-        missing_works = [
-            work
-            for work in works
-            if work.id not in doc_ids
-            and work.id not in error_ids
-            and work not in successes
-        ]
+            attempt_errors = dict(
+                (self.bulk_error_id(error), error) for error in attempt_errors
+            )
+            for doc_id in pending:
+                if doc_id not in attempt_errors:
+                    indexed.add(doc_id)
+                    errors.pop(doc_id, None)
+            errors.update(attempt_errors)
+
+            statuses = set(
+                self.bulk_error_status(error) for error in attempt_errors.values()
+            )
+            self.adapt_bulk_chunk_size(elapsed, self.BULK_REJECTED_STATUS in statuses)
 
-        successes.extend(
-            [work for work in works if work.id in doc_ids and work.id not in error_ids]
-        )
+            retry = dict(
+                (doc_id, pending[doc_id])
+                for doc_id, error in attempt_errors.items()
+                if doc_id in pending
+                and self.bulk_error_is_temporary(self.bulk_error_status(error))
+            )
+            if not retry or attempt >= max_retries:
+                break
+            backoff = min(
+                self.BULK_INITIAL_BACKOFF * (2 ** attempt), self.BULK_MAX_BACKOFF
+            )
+            attempt += 1
+            self.log.info(
+                "%i of %i search documents failed to upload, trying again in %.1f seconds.",
+                len(retry),
+                len(pending),
+                backoff,
+            )
+            time.sleep(backoff)
+            pending = retry
+        return indexed, errors
 
-        failures = []
-        for missing in missing_works:
-            failures.append((work, "Work not indexed"))
+    @property
+    def bulk_chunk_size(self):
+        """How many documents to send in a single bulk request."""
+        return getattr(self, "_bulk_chunk_size", self.BULK_CHUNK_SIZE)
 
-        for error in errors:
+    def adapt_bulk_chunk_size(self, elapsed, rejected=False):
+        """Adjust the bulk chunk size in response to the most recent
+        bulk request.
 
-            error_id = get_error_id(error)
-            work = None
-            works_with_error = [work for work in works if work.id == error_id]
-            if works_with_error:
-                work = works_with_error[0]
+        :param elapsed: How long the request took, in seconds.
+        :param rejected: Whether the cluster rejected any documents
+            because it was too busy to handle them.
+        """
+        size = self.bulk_chunk_size
+        if rejected or elapsed > self.BULK_TARGET_SECONDS:
+            size = size // 2
+        elif elapsed < self.BULK_TARGET_SECONDS / 2:
+            size = int(size * 1.5)
+        self._bulk_chunk_size = max(
+            self.BULK_MIN_CHUNK_SIZE, min(size, self.BULK_MAX_CHUNK_SIZE)
+        )
+        return self._bulk_chunk_size
 
-            exception = error.get("exception", None)
-            error_message = error.get("error", None)
-            if not error_message:
-                error_message = error.get("index", {}).get("error", None)
+    def bulk_error_is_temporary(self, status):
+        """Is a document that failed with the given status worth
+        sending again?
+        """
+        if status is None:
+            return False
+        if not isinstance(status, int):
+            # There was no HTTP response at all; e.g. the connection
+            # timed out.
+            return True
+        return status in self.BULK_RETRY_STATUSES
 
-            failures.append((work, error_message))
+    @classmethod
+    def bulk_error_id(cls, error):
+        """Find the ID of the document that caused an error reported
+        by a bulk upload.
 
-        self.log.info(
-            "Successfully indexed %i documents, failed to index %i."
-            % (success_count, len(failures))
+        :return: The ID as a string, since that's how Elasticsearch
+            reports it, or None if the error doesn't identify a document.
+        """
+        doc_id = (
+            error.get("data", {}).get("_id", None)
+            or error.get("index", {}).get("_id", None)
+            or error.get("update", {}).get("_id", None)
         )
+        if doc_id is None:
+            return None
+        return str(doc_id)
 
-        return successes, failures
+    @classmethod
+    def bulk_error_status(cls, error):
+        """Find the status code of an error reported by a bulk upload."""
+        for key in ("index", "update"):
+            if key in error:
+                return error[key].get("status", None)
+        return error.get("status", None)
+
+    @classmethod
+    def bulk_error_message(cls, error):
+        """Find the human-readable part of an error reported by a bulk
+        upload.
+        """
+        return (
+            error.get("error", None)
+            or error.get("index", {}).get("error", None)
+            or error.get("update", {}).get("error", None)
+        )
 
     def remove_work(self, work):
         """Remove the search document for `work` from the search index."""
@@ -651,6 +1364,7 @@ class ExternalSearchIndex(HasSelfTests):
         )
         if self.exists(**args):
             self.delete(**args)
+            self.clear_result_cache()
 
     def _run_self_tests(self, _db, in_testing=False):
         # Helper methods for setting up the self-tests:
@@ -725,6 +1439,223 @@ class ExternalSearchIndex(HasSelfTests):
         yield self.run_test("Total number of documents per collection:", _collections)
 
 
+class TimedOutSearchResults(list):
+    """An empty list of search results, standing in for the results of
+    a search that didn't finish in time.
+    """
+
+    timed_out = True
+
+
+class SearchResultCache(object):
+    """A bounded cache of search results, kept in memory.
+
+    Entries expire after `ttl` seconds, so that changes to the index
+    eventually show up in search results, and the oldest entry is
+    dropped when the cache is full. To share a cache between
+    processes, subclass this and override get(), set() and clear().
+    """
+
+    def __init__(self, size=1000, ttl=60):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = ExpiringDict(max_len=size, max_age_seconds=ttl)
+
+    @classmethod
+    def key(cls, index, search):
+        """Turn a search into a cache key.
+
+        :param index: The name of the index or alias being searched.
+        :param search: The search request as a dictionary. This covers
+            the query string, the filter and the pagination.
+        """
+        canonical = json.dumps([index, search], sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """Look up cached results.
+
+        :return: A list of results, or None if nothing usable is cached.
+        """
+        results = self._entries.get(key)
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return results
+
+    def set(self, key, results):
+        self._entries[key] = results
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SearchHistogram(object):
+    """Counts how many measurements fell into each of a number of
+    buckets.
+    """
+
+    def __init__(self, buckets):
+        """Constructor.
+
+        :param buckets: A sorted list of upper bounds. A measurement
+            goes into the first bucket whose bound is at least as large
+            as the measurement. Anything larger than the last bound
+            goes into an extra, unbounded bucket.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+
+class SearchMetrics(object):
+    """Measurements of how searches perform, kept in memory.
+
+    Every search is timed, both by the clock and by Elasticsearch
+    itself, and the sizes of the request and response may be noted. Each
+    measurement goes into a histogram labeled with the kind of call
+    that ran the search and the Lane being searched. A search that
+    takes longer than `slow_threshold` seconds is logged along with the
+    query that was sent.
+
+    To send measurements somewhere else, such as a statsd server,
+    subclass this and override record() and slow_search().
+    """
+
+    # The names of the measurements.
+    WALL_TIME = "wall_time"
+    TOOK = "took"
+    REQUEST_BYTES = "request_bytes"
+    RESPONSE_BYTES = "response_bytes"
+
+    # Bucket bounds for timings, in seconds.
+    TIME_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    # Bucket bounds for sizes, in bytes: 1 KiB, 4 KiB, ... 16 MiB.
+    SIZE_BUCKETS = [1024 * 4 ** x for x in range(8)]
+
+    def __init__(
+        self, slow_threshold=None, slow_search_log_size=100, measure_sizes=None
+    ):
+        """Constructor.
+
+        :param slow_threshold: A search that takes at least this
+            many seconds is logged as a slow search. By default, no
+            search is considered slow.
+        :param slow_search_log_size: Keep this many of the most recent
+            slow searches in `slow_searches`.
+        :param measure_sizes: Whether to measure the size of each
+            request and response. This means serializing them to JSON,
+            so by default it's only done if `slow_threshold` is set.
+        """
+        self.log = logging.getLogger("Search metrics")
+        self.slow_threshold = slow_threshold
+        if measure_sizes is None:
+            measure_sizes = slow_threshold is not None
+        self.measure_sizes = measure_sizes
+        self.histograms = {}
+        self.slow_searches = deque(maxlen=slow_search_log_size)
+        # Searches may finish in several threads at once.
+        self._lock = RLock()
+
+    @classmethod
+    def key(cls, metric, **labels):
+        return (metric, tuple(sorted(labels.items())))
+
+    def histogram(self, metric, **labels):
+        """Find the histogram for a measurement with certain labels.
+
+        :return: A SearchHistogram, or None if nothing has been
+            recorded.
+        """
+        return self.histograms.get(self.key(metric, **labels))
+
+    def record(self, metric, value, **labels):
+        """Add a single measurement to the appropriate histogram."""
+        key = self.key(metric, **labels)
+        if metric in (self.REQUEST_BYTES, self.RESPONSE_BYTES):
+            buckets = self.SIZE_BUCKETS
+        else:
+            buckets = self.TIME_BUCKETS
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = SearchHistogram(buckets)
+            histogram.add(value)
+
+    def search_finished(
+        self,
+        call,
+        elapsed,
+        search,
+        took=None,
+        request_bytes=None,
+        response_bytes=None,
+        lane=None,
+    ):
+        """Record everything that's known about a search that just
+        finished.
+
+        :param call: The name of the method that ran the search,
+            e.g. "query_works_multi".
+        :param elapsed: The number of seconds between sending the
+            request and getting the response. If several searches were
+            sent in one request, this is the time taken by the whole
+            request.
+        :param search: The search that was sent, either as a
+            dictionary or as a Search object. A Search is only turned
+            into a dictionary if the search turns out to be slow.
+        :param took: The number of seconds Elasticsearch says it spent
+            running the search.
+        :param request_bytes: The size of the search request.
+        :param response_bytes: The size of the search response.
+        :param lane: The ID of the Lane that was searched, if any.
+        """
+        labels = dict(call=call, lane=lane)
+        self.record(self.WALL_TIME, elapsed, **labels)
+        if took is not None:
+            self.record(self.TOOK, took, **labels)
+        if request_bytes is not None:
+            self.record(self.REQUEST_BYTES, request_bytes, **labels)
+        if response_bytes is not None:
+            self.record(self.RESPONSE_BYTES, response_bytes, **labels)
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            self.slow_search(call, elapsed, search, took=took, lane=lane)
+
+    def slow_search(self, call, elapsed, search, took=None, lane=None):
+        """Make a note of a search that took too long."""
+        if hasattr(search, "to_dict"):
+            search = search.to_dict()
+        self.slow_searches.append(
+            dict(call=call, elapsed=elapsed, took=took, lane=lane, search=search)
+        )
+        self.log.warning(
+            "Slow search by %s for lane %s: %.2fsec (%ssec in Elasticsearch): %s",
+            call,
+            lane,
+            elapsed,
+            took,
+            json.dumps(search, default=str),
+        )
+
+
 class MappingDocument(object):
     """This class knows a lot about how the 'properties' section of an
     Elasticsearch mapping document (or one of its subdocuments) is
@@ -2097,6 +3028,10 @@ class Filter(SearchBase):
     # the useful information from the search engine isn't lost.
     KNOWN_SCRIPT_FIELDS = ["last_update"]
 
+    # The restrictions a Lane and its parentage impose on a Filter,
+    # keyed by the Lane's ID. See lane_restrictions().
+    _lane_restrictions_cache = ExpiringDict(max_len=1000, max_age_seconds=600)
+
     # In general, someone looking for things "by this person" is
     # probably looking for one of these roles.
     AUTHOR_MATCH_ROLES = list(Contributor.AUTHOR_ROLES) + [
@@ -2115,24 +3050,8 @@ class Filter(SearchBase):
         :param facets: A SearchFacets object.
         """
         library = worklist.get_library(_db)
-        # For most configuration settings there is a single value --
-        # either defined on the WorkList or defined by its parent.
-        inherit_one = worklist.inherited_value
-        media = inherit_one("media")
-        languages = inherit_one("languages")
-        fiction = inherit_one("fiction")
-        audiences = inherit_one("audiences")
-        target_age = inherit_one("target_age")
-        collections = inherit_one("collection_ids") or library
-
-        license_datasource_id = inherit_one("license_datasource_id")
-
-        # For genre IDs and CustomList IDs, we might get a separate
-        # set of restrictions from every item in the WorkList hierarchy.
-        # _All_ restrictions must be met for a work to match the filter.
-        inherit_some = worklist.inherited_values
-        genre_id_restrictions = inherit_some("genre_ids")
-        customlist_id_restrictions = inherit_some("customlist_ids")
+        restrictions = cls.lane_restrictions(worklist)
+        collections = worklist.inherited_value("collection_ids") or library
 
         # See if there are any excluded audiobook sources on this
         # site.
@@ -2144,19 +3063,63 @@ class Filter(SearchBase):
             allow_holds = library.allow_holds
         return cls(
             collections,
-            media,
-            languages,
-            fiction,
-            audiences,
-            target_age,
-            genre_id_restrictions,
-            customlist_id_restrictions,
-            facets,
+            facets=facets,
             excluded_audiobook_data_sources=excluded_audiobook_data_sources,
             allow_holds=allow_holds,
-            license_datasource=license_datasource_id,
+            lane_id=worklist.id if isinstance(worklist, Lane) else None,
+            **restrictions
         )
 
+    @classmethod
+    def lane_restrictions(cls, worklist):
+        """Find the restrictions a WorkList and its parentage place on
+        which works belong in it.
+
+        Finding these means walking up the lane hierarchy and looking
+        up genre and custom list IDs, so the result for a Lane is
+        cached until the Lane or the site configuration changes.
+
+        :return: A dictionary of keyword arguments to the Filter
+            constructor.
+        """
+        key = None
+        if (
+            isinstance(worklist, Lane)
+            and worklist.id is not None
+            and not inspect(worklist).modified
+        ):
+            key = (worklist.id, Configuration._site_configuration_last_update())
+            cached = cls._lane_restrictions_cache.get(key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
+        # For most configuration settings there is a single value --
+        # either defined on the WorkList or defined by its parent.
+        inherit_one = worklist.inherited_value
+
+        # For genre IDs and CustomList IDs, we might get a separate
+        # set of restrictions from every item in the WorkList hierarchy.
+        # _All_ restrictions must be met for a work to match the filter.
+        inherit_some = worklist.inherited_values
+
+        restrictions = dict(
+            media=inherit_one("media"),
+            languages=inherit_one("languages"),
+            fiction=inherit_one("fiction"),
+            audiences=inherit_one("audiences"),
+            target_age=inherit_one("target_age"),
+            genre_restriction_sets=inherit_some("genre_ids"),
+            customlist_restriction_sets=inherit_some("customlist_ids"),
+            license_datasource=inherit_one("license_datasource_id"),
+        )
+        if key is not None:
+            cls._lane_restrictions_cache[key] = copy.deepcopy(restrictions)
+        return restrictions
+
+    @classmethod
+    def clear_lane_restrictions_cache(cls):
+        cls._lane_restrictions_cache.clear()
+
     def __init__(
         self,
         collections=None,
@@ -2244,6 +3207,10 @@ class Filter(SearchBase):
         :param match_nothing: If this is set to True, the search will
         not even be performed -- we know for some other reason that an
         empty set of search results should be returned.
+
+        :param lane_id: The ID of the Lane this Filter was created
+        for. This doesn't change the search; it's used to label
+        measurements of how the search performed.
         """
 
         if isinstance(collections, Library):
@@ -2301,6 +3268,8 @@ class Filter(SearchBase):
 
         self.match_nothing = kwargs.pop("match_nothing", False)
 
+        self.lane_id = kwargs.pop("lane_id", None)
+
         license_datasources = kwargs.pop("license_datasource", None)
         self.license_datasources = self._filter_ids(license_datasources)
 
@@ -3124,11 +4093,11 @@ class MockExternalSearchIndex(ExternalSearchIndex):
         return self._key(index, doc_type, id) in self.docs
 
     def create_search_doc(
-        self, query_string, filter=None, pagination=None, debug=False
+        self, query_string, filter=None, pagination=None, debug=False, fields=None
     ):
         return list(self.docs.values())
 
-    def query_works(self, query_string, filter, pagination, debug=False):
+    def query_works(self, query_string, filter, pagination, debug=False, fields=None):
         self.queries.append((query_string, filter, pagination, debug))
         # During a test we always sort works by the order in which the
         # work was created.
@@ -3169,7 +4138,16 @@ class MockExternalSearchIndex(ExternalSearchIndex):
             pagination.page_loaded(results)
         return results
 
-    def query_works_multi(self, queries, debug=False):
+    def iterate_works(self, filter=None, query_string=None, page_size=500):
+        pagination = SortKeyPagination(size=page_size)
+        while pagination is not None:
+            page = self.query_works(query_string, filter, pagination)
+            if not page:
+                break
+            yield page
+            pagination = pagination.next_page
+
+    def query_works_multi(self, queries, debug=False, **kwargs):
         # Implement query_works_multi by calling query_works several
         # times. This is the opposite of what happens in the
         # non-mocked ExternalSearchIndex, because it's easier to mock
@@ -3181,9 +4159,23 @@ class MockExternalSearchIndex(ExternalSearchIndex):
         return len(self.docs)
 
     def bulk(self, docs, **kwargs):
+        errors = []
         for doc in docs:
-            self.index(doc["_index"], doc["_type"], doc["_id"], doc)
-        return len(docs), []
+            if doc.get("_op_type") == "update":
+                key = self._key(doc["_index"], doc["_type"], doc["_id"])
+                if key not in self.docs:
+                    errors.append(
+                        dict(
+                            update=dict(
+                                _id=doc["_id"], error="document_missing_exception"
+                            )
+                        )
+                    )
+                    continue
+                self.docs[key].update(doc["doc"])
+            else:
+                self.index(doc["_index"], doc["_type"], doc["_id"], doc)
+        return len(docs) - len(errors), errors
 
 
 class MockMeta(dict):
@@ -3229,11 +4221,27 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
 
     OPERATION = WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
 
+    # Many changes only register a fragment of a Work's search
+    # document for regeneration. Unless this is False, the fragments
+    # are taken care of whenever this provider runs, so they're never
+    # left waiting on a separate script.
+    INCLUDE_FRAGMENTS = True
+
     def __init__(self, *args, **kwargs):
         search_index_client = kwargs.pop("search_index_client", None)
         super(SearchIndexCoverageProvider, self).__init__(*args, **kwargs)
         self.search_index_client = search_index_client or ExternalSearchIndex(self._db)
 
+    def run(self):
+        if self.INCLUDE_FRAGMENTS:
+            # Fragments go first: a fragment that can't be updated
+            # schedules a full reindex, which will happen below.
+            for provider in SearchIndexFragmentCoverageProvider.all(
+                self._db, search_index_client=self.search_index_client
+            ):
+                provider.run()
+        return super(SearchIndexCoverageProvider, self).run()
+
     def process_batch(self, works):
         """
         :return: a mixed list of Works and CoverageFailure objects.
@@ -3247,3 +4255,272 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
             records.append(CoverageFailure(work, error))
 
         return records
+
+
+class SearchIndexFragmentCoverageProvider(SearchIndexCoverageProvider):
+    """Regenerate one fragment of the search document for Works that
+    were registered as needing it (see
+    Work.search_index_fragment_needs_updating), and merge it into the
+    document already in the search index.
+    """
+
+    SERVICE_NAME = "Search index fragment coverage provider"
+
+    INCLUDE_FRAGMENTS = False
+
+    def __init__(self, *args, **kwargs):
+        fragment = kwargs.pop("fragment")
+        if fragment not in Work.SEARCH_DOCUMENT_FRAGMENTS:
+            raise ValueError("Unknown search document fragment: %s" % fragment)
+        self.fragment = fragment
+
+        # A Work with no record of this operation doesn't need
+        # anything done.
+        kwargs["registered_only"] = True
+        super(SearchIndexFragmentCoverageProvider, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def all(cls, _db, **kwargs):
+        """Yield one SearchIndexFragmentCoverageProvider per fragment."""
+        for fragment in Work.SEARCH_DOCUMENT_FRAGMENTS:
+            yield cls(_db, fragment=fragment, **kwargs)
+
+    @property
+    def operation(self):
+        return WorkCoverageRecord.search_index_fragment_operation(self.fragment)
+
+    def process_batch(self, works):
+        """
+        :return: a list of Works.
+        """
+        successes, failures = self.search_index_client.bulk_update(
+            works, fragments=[self.fragment]
+        )
+
+        records = list(successes)
+        for (work, error) in failures:
+            if work is None:
+                continue
+            # The most likely problem is that the work isn't in the
+            # search index yet, so there's nothing to update. Either
+            # way, regenerating the whole document will fix it.
+            self.log.info(
+                "Could not update %s for %r, scheduling a full reindex: %s",
+                self.fragment,
+                work,
+                error,
+            )
+            WorkCoverageRecord.add_for(
+                work,
+                WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION,
+                status=WorkCoverageRecord.REGISTERED,
+            )
+            records.append(work)
+        return records
+
+
+class SearchIndexPipeline(object):
+    """Generate search documents for presentation-ready Works and send
+    them to the search index, using several threads for each job.
+
+    Producer threads generate documents for disjoint ranges of Work
+    IDs and put them on a bounded queue. Sender threads take documents
+    off the queue, upload them, and record coverage for the Works that
+    were indexed. If the senders fall behind, the producers block
+    until there's room on the queue.
+    """
+
+    DEFAULT_PRODUCERS = 4
+    DEFAULT_SENDERS = 2
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        search_index_client,
+        session_factory,
+        producers=None,
+        senders=None,
+        batch_size=None,
+        queue_size=None,
+        checkpoint=None,
+        record_coverage=True,
+    ):
+        """Constructor.
+
+        :param search_index_client: An ExternalSearchIndex.
+        :param session_factory: Creates a database session for each
+            worker thread.
+        :param producers: The number of threads generating documents.
+        :param senders: The number of threads uploading documents.
+        :param batch_size: The size of each range of Work IDs.
+        :param queue_size: The number of batches of documents that can
+            wait to be uploaded. Defaults to twice the number of senders.
+        :param checkpoint: A function called with a database session
+            and a Work ID, whenever every range of Work IDs below that
+            ID has been indexed. It's called from a sender thread.
+        :param record_coverage: If this is False, no coverage records
+            are written for the Works that were indexed. Use this when
+            loading an index that isn't serving searches yet.
+        """
+        self.search_index_client = search_index_client
+        self.session_factory = session_factory
+        self.producer_count = producers or self.DEFAULT_PRODUCERS
+        self.sender_count = senders or self.DEFAULT_SENDERS
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.queue_size = queue_size or self.sender_count * 2
+        self.checkpoint = checkpoint
+        self.record_coverage = record_coverage
+        self.log = logging.getLogger("Search index pipeline")
+
+        self.lock = RLock()
+        self.generated = 0
+        self.sent = 0
+        self.failed = 0
+        self.generate_time = 0
+        self.send_time = 0
+        self.start_time = None
+        self.senders = None
+
+    def ranges(self, _db, start_id=None):
+        """Divide the presentation-ready Works into ranges of IDs.
+
+        :param start_id: Ignore Works with IDs lower than this.
+        :return: A list of (start, end) 2-tuples. Each range includes
+            its start ID but not its end ID.
+        """
+        qu = _db.query(func.min(Work.id), func.max(Work.id)).filter(
+            Work.presentation_ready == True
+        )
+        if start_id:
+            qu = qu.filter(Work.id >= start_id)
+        low, high = qu.one()
+        if low is None:
+            return []
+        return [
+            (start, min(start + self.batch_size, high + 1))
+            for start in range(low, high + 1, self.batch_size)
+        ]
+
+    def run(self, _db, start_id=None):
+        """Index every presentation-ready Work, starting at `start_id`.
+
+        :return: This object, which keeps track of what happened.
+        """
+        ranges = self.ranges(_db, start_id)
+
+        # Without a commit, the query to find the ranges hangs in the
+        # database, blocking the threads.
+        _db.commit()
+
+        self._unfinished = deque(start for start, end in ranges)
+        self._finished = set()
+        self._end = ranges[-1][1] if ranges else None
+        self.start_time = time.time()
+
+        self.senders = DatabasePool(
+            self.sender_count, self.session_factory, queue_size=self.queue_size
+        )
+        with DatabasePool(self.producer_count, self.session_factory) as producers:
+            for start, end in ranges:
+                producers.put(functools.partial(self.produce, start, end))
+        self.senders.join()
+        self.log.info(self.achievements)
+        return self
+
+    def produce(self, start, end, _db):
+        """Generate search documents for Works in a range of IDs and
+        queue them up to be sent.
+        """
+        before = time.time()
+        works = (
+            _db.query(Work)
+            .filter(Work.id >= start)
+            .filter(Work.id < end)
+            .filter(Work.presentation_ready == True)
+            .all()
+        )
+        work_ids = [work.id for work in works]
+        docs = Work.to_search_documents(works) or []
+        for doc in docs:
+            doc["_index"] = self.search_index_client.works_index
+            doc["_type"] = self.search_index_client.work_document_type
+        _db.commit()
+
+        with self.lock:
+            self.generated += len(docs)
+            self.generate_time += time.time() - before
+
+        # This blocks if the queue is full.
+        self.senders.put(functools.partial(self.send, start, work_ids, docs))
+
+    def send(self, start, work_ids, docs, _db):
+        """Upload search documents and record coverage for the Works
+        that were indexed. Documents that fail for a reason that might
+        be temporary are retried; see ExternalSearchIndex.bulk_send().
+        """
+        before = time.time()
+        client = self.search_index_client
+        indexed_ids = set()
+        for chunk in client.bulk_chunks(docs):
+            chunk_indexed, chunk_errors = client.bulk_send(chunk)
+            indexed_ids.update(chunk_indexed)
+        indexed = [x for x in work_ids if str(x) in indexed_ids]
+
+        # Works that weren't indexed are left without coverage, so
+        # SearchIndexCoverageProvider will try them again.
+        if indexed and self.record_coverage:
+            works = _db.query(Work).filter(Work.id.in_(indexed)).all()
+            WorkCoverageRecord.bulk_add(
+                works, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            )
+        _db.commit()
+
+        with self.lock:
+            self.sent += len(indexed)
+            self.failed += len(work_ids) - len(indexed)
+            self.send_time += time.time() - before
+            checkpoint = self._finish(start)
+        if checkpoint is not None and self.checkpoint:
+            self.checkpoint(_db, checkpoint)
+        self.log.info(self.achievements)
+
+    def _finish(self, start):
+        """Mark the range of IDs beginning with `start` as finished.
+
+        :return: The ID below which every range is finished, if that
+            ID has changed; otherwise None.
+        """
+        self._finished.add(start)
+        checkpoint = None
+        while self._unfinished and self._unfinished[0] in self._finished:
+            self._finished.remove(self._unfinished.popleft())
+            if self._unfinished:
+                checkpoint = self._unfinished[0]
+            else:
+                checkpoint = self._end
+        return checkpoint
+
+    @property
+    def rate(self):
+        """The number of Works indexed per second, so far."""
+        if not self.start_time:
+            return 0
+        elapsed = time.time() - self.start_time
+        if not elapsed:
+            return 0
+        return self.sent / elapsed
+
+    @property
+    def achievements(self):
+        return (
+            "Documents generated: %d (%.2f sec), sent: %d (%.2f sec), "
+            "failed: %d. %.1f works/sec."
+            % (
+                self.generated,
+                self.generate_time,
+                self.sent,
+                self.send_time,
+                self.failed,
+                self.rate,
+            )
+        )
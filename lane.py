@@ -885,6 +885,11 @@ class FeaturedFacets(FacetsWithEntryPoint):
         self.minimum_featured_quality = minimum_featured_quality
         self.random_seed = random_seed
 
+        # This is set to True if any of the searches run to find
+        # featured works didn't finish in time, meaning that a feed
+        # built from the results is missing some of its works.
+        self.search_timed_out = False
+
     @classmethod
     def default(cls, lane, **kwargs):
         library = None
@@ -1711,6 +1716,26 @@ class WorkList(object):
         """
         return facets
 
+    def featured_search_query(self, _db, facets, pagination):
+        """Describe the search query that finds this WorkList's featured
+        works, so it can be sent to the search engine alongside the
+        queries for other WorkLists in a grouped feed.
+
+        :param facets: A FeaturedFacets object, not yet adapted with
+            overview_facets().
+        :param pagination: A Pagination object.
+        :return: A 2-tuple ((query string, Filter, Pagination), facets),
+            where `facets` is the faceting object to use when loading
+            the Works from the database; or None if this WorkList's
+            featured works can't be found with a single search query.
+        """
+        cls = self.__class__
+        if cls.groups is not WorkList.groups or cls.works is not WorkList.works:
+            # This WorkList has its own idea of how to find works.
+            return None
+        adapted = self.overview_facets(_db, facets)
+        return (None, self.filter(_db, adapted), pagination), adapted
+
     def groups(
         self,
         _db,
@@ -1818,6 +1843,24 @@ class WorkList(object):
         )
         return self.works_for_hits(_db, hits, facets=facets)
 
+    def iterate_works(self, _db, facets=None, search_engine=None, page_size=500):
+        """Go through every Work in this WorkList, a page at a time.
+
+        This is the way to get _all_ of a WorkList's works, e.g. for
+        an export: unlike calling works() with ever-larger offsets,
+        it doesn't get slower as it goes.
+
+        :param page_size: The number of works to get from the search
+            engine at once.
+        :yield: A sequence of lists of Work objects.
+        """
+        from .external_search import ExternalSearchIndex
+
+        search_engine = search_engine or ExternalSearchIndex.load(_db)
+        filter = self.filter(_db, facets)
+        for hits in search_engine.iterate_works(filter, page_size=page_size):
+            yield self.works_for_hits(_db, hits, facets=facets)
+
     def filter(self, _db, facets):
         """Helper method to instantiate a Filter object for this WorkList.
 
@@ -2014,16 +2057,37 @@ class WorkList(object):
             parent_lane = None
 
         queryable_lane_set = set(queryable_lanes)
-        works_and_lanes = list(
-            self._featured_works_with_lanes(
-                _db,
-                queryable_lanes,
-                pagination=pagination,
-                facets=facets,
-                search_engine=search_engine,
-                debug=debug,
-            )
-        )
+
+        # Lanes that aren't queryable may still be able to describe
+        # their featured works with a single search query. If so, that
+        # query is sent along with the queries for the queryable lanes,
+        # rather than in a separate request.
+        batched_queries = dict()
+        for lane in relevant_lanes:
+            if lane in queryable_lane_set:
+                continue
+            batched = lane.featured_search_query(_db, facets, pagination)
+            if batched is not None:
+                batched_queries[lane] = batched
+
+        kwargs = dict()
+        if batched_queries:
+            kwargs["batched_queries"] = batched_queries
+        works_and_lanes = []
+        batched_results = defaultdict(list)
+        for work, lane in self._featured_works_with_lanes(
+            _db,
+            queryable_lanes,
+            pagination=pagination,
+            facets=facets,
+            search_engine=search_engine,
+            debug=debug,
+            **kwargs
+        ):
+            if lane in batched_queries:
+                batched_results[lane].append(work)
+            else:
+                works_and_lanes.append((work, lane))
 
         def _done_with_lane(lane):
             """Called when we're done with a Lane, either because
@@ -2072,6 +2136,12 @@ class WorkList(object):
                 # Yield those results.
                 for work in by_lane.get(lane, []):
                     yield (work, lane)
+            elif lane in batched_queries:
+                # We found results for this lane through a query that
+                # was batched with the main query, but they weren't
+                # deduplicated against the other lanes.
+                for work in batched_results.get(lane, []):
+                    yield (work, lane)
             else:
                 # We didn't try to use the main query to find results
                 # for this lane because we knew the results, if there
@@ -2088,7 +2158,14 @@ class WorkList(object):
                     yield x
 
     def _featured_works_with_lanes(
-        self, _db, lanes, pagination, facets, search_engine, debug=False
+        self,
+        _db,
+        lanes,
+        pagination,
+        facets,
+        search_engine,
+        debug=False,
+        batched_queries=None,
     ):
         """Find a sequence of works that can be used to
         populate this lane's grouped acquisition feed.
@@ -2105,10 +2182,16 @@ class WorkList(object):
            asking for the featured works in a given WorkList.
         :param debug: A debug argument passed into `search_engine` when
            running the search.
+        :param batched_queries: A dictionary mapping additional
+           WorkLists to the values returned by their
+           featured_search_query() methods. These queries will be run
+           in the same request as the queries for `lanes`, and their
+           Works will be yielded after the Works for `lanes`.
 
         :yield: A sequence of (Work, Lane) 2-tuples.
         """
-        if not lanes:
+        batched_queries = batched_queries or dict()
+        if not lanes and not batched_queries:
             # We can't run this query at all.
             return
 
@@ -2123,21 +2206,99 @@ class WorkList(object):
         # The simplest change would probably be to return a dictionary
         # mapping WorkList to Works and let the caller figure out the
         # ordering. In fact, we could start doing that now.
+        from .external_search import Filter
+
         queries = []
         for lane in lanes:
             overview_facets = lane.overview_facets(_db, facets)
-            from .external_search import Filter
-
             filter = Filter.from_worklist(_db, lane, overview_facets)
             queries.append((None, filter, pagination))
-        resultsets = list(search_engine.query_works_multi(queries))
-        works = self.works_for_resultsets(_db, resultsets, facets=facets)
 
-        for i, lane in enumerate(lanes):
+        all_lanes = list(lanes)
+        if not batched_queries:
+            resultsets = list(search_engine.query_works_multi(queries))
+            self._note_timed_out_searches(facets, resultsets)
+            works = self.works_for_resultsets(_db, resultsets, facets=facets)
+        else:
+            # Each resultset will be turned into Works using the
+            # faceting object associated with its query.
+            load_facets = [facets] * len(lanes)
+            for lane, (query, lane_facets) in batched_queries.items():
+                all_lanes.append(lane)
+                load_facets.append(lane_facets)
+                queries.append(query)
+            works = self._works_for_batched_queries(
+                _db, search_engine, queries, load_facets, len(lanes), facets=facets
+            )
+
+        for i, lane in enumerate(all_lanes):
             results = works[i]
             for work in results:
                 yield work, lane
 
+    def _works_for_batched_queries(
+        self, _db, search_engine, queries, load_facets, always_send, facets=None
+    ):
+        """Run a number of search queries in a single request, and load
+        the corresponding Works with as few database queries as
+        possible.
+
+        :param queries: A list of (query string, Filter, Pagination)
+            3-tuples.
+        :param load_facets: A list, parallel to `queries`, of the
+            faceting objects to use when loading each query's Works
+            from the database.
+        :param always_send: The first this-many queries are sent to
+            the search engine even if they are known to match nothing.
+        :param facets: The faceting object for the feed as a whole. It
+            will be told if any of the queries timed out.
+        :return: A list, parallel to `queries`, of lists of Works.
+        """
+        # Queries that we know will match nothing don't need to be
+        # sent to the search engine.
+        to_send = [
+            i
+            for i, (query_string, filter, pagination) in enumerate(queries)
+            if i < always_send or not getattr(filter, "match_nothing", False)
+        ]
+        resultsets = [[] for query in queries]
+        sent = search_engine.query_works_multi([queries[i] for i in to_send])
+        for i, results in zip(to_send, sent):
+            resultsets[i] = results
+        self._note_timed_out_searches(facets, resultsets)
+
+        # Load the Works from the database, in one query per distinct
+        # faceting object -- usually just one query in total.
+        groups = []
+        for i, facets in enumerate(load_facets):
+            for group_facets, indexes in groups:
+                if group_facets is facets:
+                    indexes.append(i)
+                    break
+            else:
+                groups.append((facets, [i]))
+
+        works = [[] for query in queries]
+        for group_facets, indexes in groups:
+            loaded = self.works_for_resultsets(
+                _db, [resultsets[i] for i in indexes], facets=group_facets
+            )
+            for i, results in zip(indexes, loaded):
+                works[i] = results
+        return works
+
+    @classmethod
+    def _note_timed_out_searches(cls, facets, resultsets):
+        """If any of the given search results are incomplete because
+        the search timed out, make a note of it on `facets`, so the
+        feed built from those results isn't cached as though it were
+        complete.
+        """
+        if facets is None:
+            return
+        if any(getattr(results, "timed_out", False) for results in resultsets):
+            facets.search_timed_out = True
+
 
 class HierarchyWorkList(WorkList):
     """A WorkList representing part of a hierarchical view of a a
@@ -3077,6 +3238,22 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
             size = self.size_by_entrypoint[entrypoint_name]
         return size
 
+    def featured_search_query(self, _db, facets, pagination):
+        """Describe the search query that finds this Lane's featured
+        works when it's shown as one group in its parent's grouped feed.
+
+        This mirrors what happens when groups() is called with
+        include_sublanes=False.
+        """
+        cls = self.__class__
+        if cls.groups is not Lane.groups or not self.include_self_in_grouped_feed:
+            return None
+        from .external_search import Filter
+
+        adapted = self.overview_facets(_db, facets)
+        filter = Filter.from_worklist(_db, self, adapted)
+        return (None, filter, pagination), facets
+
     def groups(
         self,
         _db,
@@ -3212,3 +3389,60 @@ def receive_modified(target, value, oldvalue, initiator):
     # Remove this information whenever the Lane configuration
     # changes. This will force it to be recalculated.
     Library._has_root_lane_cache.clear()
+
+
+@event.listens_for(Lane.media, "set")
+@event.listens_for(Lane.languages, "set")
+@event.listens_for(Lane.fiction, "set")
+@event.listens_for(Lane._audiences, "set")
+@event.listens_for(Lane._target_age, "set")
+@event.listens_for(Lane.license_datasource_id, "set")
+@event.listens_for(Lane._list_datasource_id, "set")
+@event.listens_for(Lane.inherit_parent_restrictions, "set")
+@event.listens_for(Lane.parent_id, "set")
+@event.listens_for(Lane.sublanes, "append")
+@event.listens_for(Lane.sublanes, "remove")
+@event.listens_for(Lane.lane_genres, "append")
+@event.listens_for(Lane.lane_genres, "remove")
+@event.listens_for(LaneGenre.inclusive, "set")
+@event.listens_for(LaneGenre.recursive, "set")
+def lane_restrictions_changed(*args):
+    # A Lane's restrictions, or those of its parent, may have changed.
+    from .external_search import Filter
+
+    Filter.clear_lane_restrictions_cache()
+
+
+@event.listens_for(Lane.customlists, "append")
+@event.listens_for(Lane.customlists, "remove")
+def lane_customlists_changed(target, value, initiator):
+    # The lists a Lane draws from are stored in a separate table, so
+    # this change doesn't trigger the Lane's after_update listener.
+    # Other processes only find out about it through the site
+    # configuration timestamp.
+    from .external_search import Filter
+
+    Filter.clear_lane_restrictions_cache()
+    _db = Session.object_session(target)
+    if _db is not None:
+        site_configuration_has_changed(_db)
+
+
+@event.listens_for(CustomList, "after_insert")
+@event.listens_for(CustomList, "after_delete")
+def customlist_lifecycle_event(mapper, connection, target):
+    from .external_search import Filter
+
+    Filter.clear_lane_restrictions_cache()
+
+    # A new or deleted CustomList only changes what a Lane contains
+    # if the Lane draws from every list with the same DataSource.
+    if target.data_source_id is None:
+        return
+    qu = (
+        select([Lane.id])
+        .where(Lane._list_datasource_id == target.data_source_id)
+        .limit(1)
+    )
+    if connection.execute(qu).first() is not None:
+        site_configuration_has_changed(target)
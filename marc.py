@@ -6,7 +6,7 @@ from pymarc import Field, MARCWriter, Record
 
 from .classifier import Classifier
 from .config import CannotLoadConfiguration, Configuration
-from .external_search import ExternalSearchIndex, SortKeyPagination
+from .external_search import ExternalSearchIndex
 from .lane import BaseFacets, Lane
 from .mirror import MirrorUploader
 from .model import (
@@ -741,7 +741,6 @@ class MARCExporter(object):
         end_time = utc_now()
 
         facets = MARCExporterFacets(start_time=start_time)
-        pagination = SortKeyPagination(size=query_batch_size)
 
         url = mirror.marc_file_url(self.library, lane, end_time, start_time)
         representation, ignore = get_one_or_create(
@@ -751,14 +750,14 @@ class MARCExporter(object):
         with mirror.multipart_upload(representation, url) as upload:
             this_batch = BytesIO()
             this_batch_size = 0
-            while pagination is not None:
-                # Retrieve one 'page' of works from the search index.
-                works = lane.works(
-                    self._db,
-                    pagination=pagination,
-                    facets=facets,
-                    search_engine=search_engine,
-                )
+            # Retrieve the works from the search index one 'page' at
+            # a time.
+            for works in lane.iterate_works(
+                self._db,
+                facets=facets,
+                search_engine=search_engine,
+                page_size=query_batch_size,
+            ):
                 for work in works:
                     # Create a record for each work and add it to the
                     # MARC file in progress.
@@ -767,14 +766,13 @@ class MARCExporter(object):
                     )
                     if record:
                         this_batch.write(record.as_marc())
-                this_batch_size += pagination.this_page_size
+                this_batch_size += len(works)
                 if this_batch_size >= upload_batch_size:
                     # We've reached or exceeded the upload threshold.
                     # Upload one part of the multi-part document.
                     self._upload_batch(this_batch, upload)
                     this_batch = BytesIO()
                     this_batch_size = 0
-                pagination = pagination.next_page
 
             # Upload the final part of the multi-document, if
             # necessary.
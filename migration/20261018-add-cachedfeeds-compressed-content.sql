@@ -0,0 +1,23 @@
+DO $$
+ BEGIN
+  -- Add the 'content_hash' column, used to build ETags.
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN content_hash VARCHAR;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.content_hash already exists, not creating it.';
+  END;
+
+  -- Add columns for precompressed feed content.
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN gzip_content BYTEA;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.gzip_content already exists, not creating it.';
+  END;
+
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN brotli_content BYTEA;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.brotli_content already exists, not creating it.';
+  END;
+ END;
+$$;
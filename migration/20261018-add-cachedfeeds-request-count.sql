@@ -0,0 +1,12 @@
+DO $$
+ BEGIN
+  -- Add the 'request_count' column, used to find the most popular feeds.
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN request_count INTEGER NOT NULL DEFAULT 0;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.request_count already exists, not creating it.';
+  END;
+ END;
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_cachedfeeds_request_count ON cachedfeeds (request_count);
@@ -1,17 +1,167 @@
 # encoding: utf-8
-# CachedFeed, WillNotGenerateExpensiveFeed
+# CachedFeed, CachedFeedMemoryCache, CachedFeedRefreshJob, CachedFeedRequestCountJob, WillNotGenerateExpensiveFeed
 
 import datetime
+import gzip
 import logging
-from collections import namedtuple
+import struct
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from hashlib import md5, sha256
+from threading import Lock
 
-from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, Unicode
-from sqlalchemy.sql.expression import and_
+from sqlalchemy import Binary, Column, DateTime, ForeignKey, Index, Integer, Unicode
+from sqlalchemy.sql.expression import and_, func, select
 
 from ..util.datetime_helpers import utc_now
-from ..util.flask_util import OPDSFeedResponse
+from ..util.flask_util import OPDSFeedResponse, is_not_modified
+from ..util.worker_pools import DatabaseJob
 from . import Base, flush, get_one, get_one_or_create
 
+# Brotli compression is optional; gzip is always available.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedFeedMemoryCache(object):
+    """An in-process LRU cache that sits in front of the cachedfeeds table.
+
+    The cache is bounded by the approximate number of bytes of feed
+    content it holds. When adding a feed would push it over that
+    limit, the least recently used feeds are evicted.
+
+    Entries are stored along with the time the feed was generated, so
+    that CachedFeed.fetch can apply the same staleness rules it
+    applies to feeds found in the database.
+    """
+
+    # An entry in the cache looks enough like a CachedFeed that it
+    # can be passed into CachedFeed._should_refresh.
+    Entry = namedtuple(
+        "Entry",
+        ["content", "timestamp", "size", "feed_id", "content_hash", "precompressed"],
+    )
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """Constructor.
+
+        :param max_bytes: The cache will never hold more than
+            approximately this many bytes of feed content.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @classmethod
+    def _size(cls, content):
+        """Estimate the memory used by a piece of feed content."""
+        return sys.getsizeof(content)
+
+    def get(self, key):
+        """Look up a cache entry, marking it as recently used.
+
+        :return: An Entry, or None if nothing is cached under `key`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(
+        self,
+        key,
+        content,
+        timestamp,
+        feed_id=None,
+        content_hash=None,
+        precompressed=None,
+    ):
+        """Store a feed in the cache, evicting older feeds if necessary.
+
+        :param feed_id: The database ID of the corresponding CachedFeed,
+            if known.
+        :param content_hash: The hash of `content`, if known.
+        :param precompressed: A dictionary mapping HTTP content codings
+            to compressed versions of `content`, so they don't have to
+            be compressed again every time the feed is served.
+
+        :return: The Entry that was stored, or None if the feed was
+            too large to be cached at all.
+        """
+        if content is None:
+            return None
+        precompressed = precompressed or {}
+        size = self._size(content)
+        for compressed in precompressed.values():
+            size += self._size(compressed)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                # This feed would push everything else out of the
+                # cache, and still wouldn't fit.
+                return None
+            entry = self.Entry(
+                content=content,
+                timestamp=timestamp,
+                size=size,
+                feed_id=feed_id,
+                content_hash=content_hash,
+                precompressed=precompressed,
+            )
+            self._entries[key] = entry
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                ignore, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+            return entry
+
+    def remove(self, key):
+        """Remove a feed from the cache, if it's present."""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def clear(self):
+        """Remove every feed from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    @property
+    def stats(self):
+        """Summarize the cache's performance since it was created."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            bytes=self.current_bytes,
+        )
+
 
 class CachedFeed(Base):
 
@@ -43,12 +193,26 @@ class CachedFeed(Base):
     # The content of the feed.
     content = Column(Unicode, nullable=True)
 
+    # A hash of the content of the feed, suitable for use as an ETag.
+    content_hash = Column(Unicode, nullable=True)
+
+    # The content of the feed, compressed ahead of time so it can be
+    # sent to clients that accept these encodings without being
+    # compressed again for every request.
+    gzip_content = Column(Binary, nullable=True)
+    brotli_content = Column(Binary, nullable=True)
+
     # Every feed is associated with a Library.
     library_id = Column(Integer, ForeignKey("libraries.id"), index=True)
 
     # A feed may be associated with a Work.
     work_id = Column(Integer, ForeignKey("works.id"), nullable=True, index=True)
 
+    # An approximate count of the number of times this feed has been
+    # served, used to find the feeds most worth regenerating ahead of
+    # time.
+    request_count = Column(Integer, nullable=False, default=0, index=True)
+
     # Distinct types of feeds that might be cached.
     GROUPS_TYPE = "groups"
     PAGE_TYPE = "page"
@@ -63,8 +227,52 @@ class CachedFeed(Base):
     CACHE_FOREVER = object()
     IGNORE_CACHE = object()
 
+    # A feed that's missing some of its content (because a search
+    # timed out while it was being generated) is never stored, and
+    # clients are told to cache it for no more than this many seconds.
+    INCOMPLETE_FEED_MAX_AGE = 60
+
     log = logging.getLogger("CachedFeed")
 
+    # HTTP content codings.
+    GZIP = "gzip"
+    BROTLI = "br"
+
+    # Newly generated feeds will be stored pre-compressed in each of
+    # these encodings. Brotli is ignored if the brotli package is not
+    # installed.
+    precompress_encodings = ()
+
+    # If this is set to a CachedFeedMemoryCache, it will be checked
+    # before the database is consulted, and it will be populated
+    # whenever a feed is loaded from the database or regenerated.
+    memory_cache = None
+
+    # If this is True, only one process at a time will regenerate a
+    # given feed. Everyone else will serve the stale content until the
+    # new feed is committed, or, if there's no stale content, wait for
+    # it. Coordination happens through a Postgres advisory lock
+    # derived from the feed's keys.
+    single_flight = False
+
+    # If this is set to a DatabasePool, a stale feed may be served
+    # immediately while a fresh one is generated by one of the pool's
+    # workers. See the `stale_while_revalidate` argument to fetch().
+    refresh_pool = None
+
+    # Keys of the feeds currently queued up for a background refresh
+    # in this process, so the same feed isn't queued twice.
+    _pending_refreshes = set()
+    _pending_refreshes_lock = Lock()
+
+    # Requests for feeds are counted in memory, and the counts for
+    # every feed are written to the database at most once in this
+    # many seconds.
+    REQUEST_COUNT_FLUSH_INTERVAL = 60
+    _request_counts = Counter()
+    _request_counts_lock = Lock()
+    _request_counts_flushed_at = None
+
     @classmethod
     def fetch(
         cls,
@@ -75,6 +283,11 @@ class CachedFeed(Base):
         refresher_method,
         max_age=None,
         raw=False,
+        stale_while_revalidate=None,
+        background_refresher=None,
+        if_none_match=None,
+        if_modified_since=None,
+        feed_format=None,
         **response_kwargs
     ):
         """Retrieve a cached feed from the database if possible.
@@ -104,6 +317,24 @@ class CachedFeed(Base):
             converted into a Flask Response object will be returned. If this
             is True, the CachedFeed object itself will be returned. In most
             non-test situations the default is better.
+        :param stale_while_revalidate: If a cached feed is stale, but
+            by no more than this number of seconds (or timedelta), serve
+            it anyway and regenerate it in the background. This only
+            happens if CachedFeed.refresh_pool is set and a
+            `background_refresher` is provided.
+        :param background_refresher: A function that takes a database
+            session and regenerates the feed. Unlike `refresher_method`,
+            this function will be run in a worker thread, so it must
+            not use any objects associated with the caller's session.
+        :param if_none_match: The If-None-Match header of a conditional
+            request for this feed.
+        :param if_modified_since: The If-Modified-Since header of a
+            conditional request for this feed. If the client's copy of
+            the feed is up to date, a 304 response will be returned,
+            without loading the feed content if possible.
+        :param feed_format: The name of the format the feed is
+            serialized in, if it's not OPDS 1 (e.g. "opds2"). Feeds in
+            different formats are cached separately.
 
         :return: A Response or CachedFeed containing up-to-date content.
         """
@@ -116,6 +347,11 @@ class CachedFeed(Base):
         # to seconds if necessary.
         max_age = cls.max_cache_age(worklist, keys.feed_type, facets, max_age)
 
+        if feed_format:
+            # The format doesn't change how long the feed can be
+            # cached, but it does mean this is a different feed.
+            keys = keys._replace(feed_type="%s-%s" % (keys.feed_type, feed_format))
+
         # These arguments will probably be passed into get_one, and
         # will be passed into get_one_or_create in the event of a cache
         # miss.
@@ -136,7 +372,62 @@ class CachedFeed(Base):
             pagination=keys.pagination_key,
         )
         feed_data = None
-        if max_age is cls.IGNORE_CACHE or isinstance(max_age, int) and max_age <= 0:
+        feed_obj = None
+        memory_cache = cls.memory_cache
+        memory_key = None
+        if memory_cache is not None:
+            memory_key = cls._memory_cache_key(keys)
+        ignore_cache = (
+            max_age is cls.IGNORE_CACHE or isinstance(max_age, int) and max_age <= 0
+        )
+
+        conditional = dict(
+            if_none_match=if_none_match, if_modified_since=if_modified_since
+        )
+
+        if not ignore_cache and memory_key is not None and not raw:
+            # The in-process cache can't give us a CachedFeed object,
+            # but if the caller just wants a response, a fresh feed
+            # in memory saves a trip to the database.
+            entry = memory_cache.get(memory_key)
+            if entry is not None and not cls._should_refresh(entry, max_age):
+                if entry.feed_id is not None:
+                    cls._record_request(_db, entry.feed_id)
+                if entry.precompressed:
+                    response_kwargs.setdefault("precompressed", entry.precompressed)
+                return cls._response(
+                    keys,
+                    entry.content,
+                    max_age,
+                    response_kwargs,
+                    content_hash=entry.content_hash,
+                    last_modified=entry.timestamp,
+                    **conditional
+                )
+
+        if not ignore_cache and not raw and (if_none_match or if_modified_since):
+            # Before loading the whole feed, see whether the client
+            # already has an up-to-date copy.
+            validators = cls._validators(_db, kwargs)
+            if (
+                validators is not None
+                and not cls._should_refresh(validators, max_age)
+                and is_not_modified(
+                    validators.content_hash, validators.timestamp, **conditional
+                )
+            ):
+                cls._record_request(_db, validators.id)
+                return cls._response(
+                    keys,
+                    None,
+                    max_age,
+                    response_kwargs,
+                    content_hash=validators.content_hash,
+                    last_modified=validators.timestamp,
+                    not_modified=True,
+                )
+
+        if ignore_cache:
             # Don't even bother checking for a CachedFeed: we're
             # just going to replace it.
             feed_obj = None
@@ -144,10 +435,55 @@ class CachedFeed(Base):
             feed_obj = get_one(_db, cls, **kwargs)
 
         should_refresh = cls._should_refresh(feed_obj, max_age)
+        if (
+            should_refresh
+            and background_refresher is not None
+            and cls._can_revalidate_in_background(
+                feed_obj, max_age, stale_while_revalidate
+            )
+        ):
+            # Serve the stale feed now and let a worker replace it.
+            cls._enqueue_refresh(keys, background_refresher)
+            should_refresh = False
+
+        if should_refresh and cls.single_flight and not ignore_cache:
+            if feed_obj is not None and feed_obj.content is not None:
+                # There's a stale feed we could serve. Regenerate it
+                # only if nobody else is already doing so.
+                if not cls._acquire_refresh_lock(_db, keys):
+                    cls.log.debug(
+                        "Another process is refreshing %r; serving stale feed.",
+                        feed_obj,
+                    )
+                    should_refresh = False
+            else:
+                # There's nothing to serve, so wait for whoever is
+                # generating the feed to finish.
+                cls._acquire_refresh_lock(_db, keys, wait=True)
+
+            if should_refresh:
+                # Whoever held the lock before us may have just stored
+                # a fresh feed.
+                if feed_obj is not None:
+                    _db.expire(feed_obj)
+                feed_obj = get_one(_db, cls, **kwargs)
+                should_refresh = cls._should_refresh(feed_obj, max_age)
+
         if should_refresh:
             # This is a cache miss. Either feed_obj is None or
             # it's no good. We need to generate a new feed.
-            feed_data = str(refresher_method())
+            feed = refresher_method()
+            if getattr(feed, "incomplete", False):
+                return cls._incomplete_response(
+                    _db, keys, feed, feed_obj, raw, response_kwargs
+                )
+            if max_age is cls.IGNORE_CACHE and not raw and hasattr(feed, "stream"):
+                # This feed won't be stored anywhere, so there's no
+                # need to hold the whole serialized document in
+                # memory; it can be serialized as it's sent out.
+                feed_data = feed.stream()
+            else:
+                feed_data = str(feed)
             generation_time = utc_now()
 
             if max_age is not cls.IGNORE_CACHE:
@@ -162,19 +498,159 @@ class CachedFeed(Base):
                 # To avoid a database error, fetch the feed _again_ from the
                 # database rather than assuming we have the up-to-date
                 # object.
-                feed_obj, is_new = get_one_or_create(_db, cls, **kwargs)
-                if feed_obj.timestamp is None or feed_obj.timestamp < generation_time:
-                    # Either there was no contention for this object, or there
-                    # was contention but our feed is more up-to-date than
-                    # the other thread(s). Our feed takes priority.
-                    feed_obj.content = feed_data
-                    feed_obj.timestamp = generation_time
+                feed_obj = cls._store(_db, feed_data, generation_time, **kwargs)
+                if memory_key is not None:
+                    cls._put_in_memory_cache(memory_key, feed_obj)
         elif feed_obj:
             feed_data = feed_obj.content
+            if memory_key is not None:
+                cls._put_in_memory_cache(memory_key, feed_obj)
+
+        if feed_obj is not None and feed_obj.id is not None:
+            cls._record_request(_db, feed_obj.id)
 
         if raw and feed_obj:
             return feed_obj
 
+        content_hash = last_modified = None
+        if feed_obj is not None and feed_data == feed_obj.content:
+            # Pass along the precompressed representations of this
+            # feed, so they can be sent out as-is.
+            precompressed = feed_obj.precompressed
+            if precompressed:
+                response_kwargs.setdefault("precompressed", precompressed)
+            content_hash = feed_obj.content_hash
+            last_modified = feed_obj.timestamp
+
+        return cls._response(
+            keys,
+            feed_data,
+            max_age,
+            response_kwargs,
+            content_hash=content_hash,
+            last_modified=last_modified,
+            **conditional
+        )
+
+    @classmethod
+    def _incomplete_response(cls, _db, keys, feed, feed_obj, raw, response_kwargs):
+        """Handle a newly generated feed that's missing some of its
+        content.
+
+        The feed isn't stored. If there's an older version of the feed
+        in the database, that version is served instead; otherwise the
+        incomplete feed is served. Either way, the client is told to
+        check back soon.
+
+        :param feed: The incomplete feed.
+        :param feed_obj: The stale CachedFeed, if there is one.
+        :return: A Response or CachedFeed, as in fetch().
+        """
+        if feed_obj is not None and feed_obj.content is not None:
+            cls.log.warning(
+                "Regenerated %r was incomplete; serving the old version.", feed_obj
+            )
+            if feed_obj.id is not None:
+                cls._record_request(_db, feed_obj.id)
+            if raw:
+                return feed_obj
+            precompressed = feed_obj.precompressed
+            if precompressed:
+                response_kwargs.setdefault("precompressed", precompressed)
+            response_kwargs["max_age"] = cls.INCOMPLETE_FEED_MAX_AGE
+            return cls._response(
+                keys,
+                feed_obj.content,
+                cls.INCOMPLETE_FEED_MAX_AGE,
+                response_kwargs,
+                content_hash=feed_obj.content_hash,
+                last_modified=feed_obj.timestamp,
+            )
+
+        cls.log.warning("Serving an incomplete feed without caching it.")
+        response_kwargs["max_age"] = cls.INCOMPLETE_FEED_MAX_AGE
+        return cls._response(
+            keys, str(feed), cls.INCOMPLETE_FEED_MAX_AGE, response_kwargs
+        )
+
+    @classmethod
+    def _validators(cls, _db, kwargs):
+        """Look up just enough information about a CachedFeed to
+        answer a conditional request, without loading its content.
+
+        :param kwargs: The arguments that would be passed into get_one
+            to find the CachedFeed.
+        :return: A row with `id`, `timestamp` and `content_hash`, or None.
+        """
+        lookup = dict(kwargs)
+        lookup.pop("on_multiple", None)
+        constraint = lookup.pop("constraint", None)
+        qu = _db.query(cls.id, cls.timestamp, cls.content_hash).filter_by(**lookup)
+        if constraint is not None:
+            qu = qu.filter(constraint)
+        return qu.order_by(cls.timestamp.desc()).first()
+
+    @classmethod
+    def _store(cls, _db, feed_data, generation_time, **kwargs):
+        """Store newly generated feed content in the database.
+
+        :param kwargs: Arguments to get_one_or_create that identify
+            the CachedFeed.
+        :return: The CachedFeed.
+        """
+        feed_obj, is_new = get_one_or_create(_db, cls, **kwargs)
+        if feed_obj.timestamp is None or feed_obj.timestamp < generation_time:
+            # Either there was no contention for this object, or there
+            # was contention but our feed is more up-to-date than
+            # the other thread(s). Our feed takes priority.
+            feed_obj._set_content(feed_data, generation_time)
+        return feed_obj
+
+    @classmethod
+    def _response(
+        cls,
+        keys,
+        feed_data,
+        max_age,
+        response_kwargs,
+        content_hash=None,
+        last_modified=None,
+        if_none_match=None,
+        if_modified_since=None,
+        not_modified=False,
+    ):
+        """Turn feed content into a response-type object.
+
+        :param keys: A CachedFeedKeys object.
+        :param feed_data: The content of the feed.
+        :param max_age: The value calculated by max_cache_age().
+        :param response_kwargs: Extra arguments to pass into the
+            OPDSFeedResponse constructor.
+        :param content_hash: The hash of the feed content, used as
+            its ETag.
+        :param last_modified: The time the feed was generated.
+        :param if_none_match: The If-None-Match header sent by the client.
+        :param if_modified_since: The If-Modified-Since header sent by
+            the client.
+        :param not_modified: If this is True, the client is already
+            known to have an up-to-date copy of the feed.
+        """
+        if content_hash:
+            response_kwargs.setdefault("content_hash", content_hash)
+        if last_modified:
+            response_kwargs.setdefault("last_modified", last_modified)
+        if not_modified or is_not_modified(
+            response_kwargs.get("content_hash"),
+            response_kwargs.get("last_modified"),
+            if_none_match,
+            if_modified_since,
+        ):
+            # The client's copy is up to date; there's no need to
+            # send the feed again.
+            response_kwargs["status"] = 304
+            response_kwargs.pop("precompressed", None)
+            feed_data = ""
+
         # We have the information necessary to create a useful
         # response-type object.
         #
@@ -300,6 +776,165 @@ class CachedFeed(Base):
         ],
     )
 
+    @classmethod
+    def _memory_cache_key(cls, keys):
+        """Turn a CachedFeedKeys into a key for the in-process cache.
+
+        Database objects are replaced with their IDs, so the cache
+        doesn't hold on to objects from a session that may be gone.
+        """
+        library = keys.library
+        work = keys.work
+        return keys._replace(
+            library=getattr(library, "id", library),
+            work=getattr(work, "id", work),
+        )
+
+    @classmethod
+    def _put_in_memory_cache(cls, key, feed_obj):
+        """Copy a CachedFeed, including its precompressed
+        representations, into the in-process cache.
+
+        :param key: A key returned by _memory_cache_key().
+        :return: The new cache entry, or None if nothing was cached.
+        """
+        memory_cache = cls.memory_cache
+        if memory_cache is None:
+            return None
+        return memory_cache.put(
+            key,
+            feed_obj.content,
+            feed_obj.timestamp,
+            feed_obj.id,
+            feed_obj.content_hash,
+            feed_obj.precompressed,
+        )
+
+    @classmethod
+    def _can_revalidate_in_background(cls, feed_obj, max_age, stale_while_revalidate):
+        """Is `feed_obj` stale, but recent enough that it can be served
+        while a new version is generated in the background?
+        """
+        if cls.refresh_pool is None or not stale_while_revalidate:
+            return False
+        if feed_obj is None or feed_obj.content is None or feed_obj.timestamp is None:
+            return False
+        if max_age in (cls.CACHE_FOREVER, cls.IGNORE_CACHE) or max_age <= 0:
+            return False
+        if isinstance(stale_while_revalidate, datetime.timedelta):
+            stale_while_revalidate = stale_while_revalidate.total_seconds()
+        window = datetime.timedelta(seconds=max_age + stale_while_revalidate)
+        return feed_obj.timestamp + window > utc_now()
+
+    @classmethod
+    def _enqueue_refresh(cls, keys, background_refresher):
+        """Ask a worker in the refresh pool to regenerate a feed,
+        unless a refresh of that feed is already queued.
+
+        :return: True if a job was queued; False otherwise.
+        """
+        key = cls._memory_cache_key(keys)
+        with cls._pending_refreshes_lock:
+            if key in cls._pending_refreshes:
+                return False
+            cls._pending_refreshes.add(key)
+        cls.refresh_pool.put(CachedFeedRefreshJob(key, background_refresher))
+        return True
+
+    @classmethod
+    def _refresh_finished(cls, key):
+        with cls._pending_refreshes_lock:
+            cls._pending_refreshes.discard(key)
+
+    @classmethod
+    def _record_request(cls, _db, feed_id):
+        """Note that the CachedFeed with the given ID was served.
+
+        Counts are kept in memory and periodically added to
+        CachedFeed.request_count, so that serving a feed almost never
+        requires a database write. If there's a refresh_pool, the
+        write happens in one of its workers rather than in `_db`.
+        """
+        now = time.monotonic()
+        with cls._request_counts_lock:
+            cls._request_counts[feed_id] += 1
+            if cls._request_counts_flushed_at is None:
+                cls._request_counts_flushed_at = now
+            if now - cls._request_counts_flushed_at < cls.REQUEST_COUNT_FLUSH_INTERVAL:
+                return
+            counts = cls._take_request_counts(now)
+
+        if cls.refresh_pool is not None:
+            cls.refresh_pool.put(CachedFeedRequestCountJob(counts))
+        else:
+            cls.write_request_counts(_db, counts)
+
+    @classmethod
+    def _take_request_counts(cls, now=None):
+        """Remove and return the request counts kept in memory.
+
+        The caller must hold _request_counts_lock.
+        """
+        counts = cls._request_counts
+        cls._request_counts = Counter()
+        cls._request_counts_flushed_at = time.monotonic() if now is None else now
+        return counts
+
+    @classmethod
+    def flush_request_counts(cls, _db):
+        """Write all the request counts kept in memory to the database."""
+        with cls._request_counts_lock:
+            counts = cls._take_request_counts()
+        cls.write_request_counts(_db, counts)
+
+    @classmethod
+    def write_request_counts(cls, _db, counts):
+        """Add request counts to CachedFeed.request_count.
+
+        :param counts: A Counter mapping CachedFeed IDs to the number
+            of times each feed was served.
+        """
+        # Feeds that were requested the same number of times can be
+        # updated with a single statement.
+        by_count = defaultdict(list)
+        for feed_id, count in counts.items():
+            by_count[count].append(feed_id)
+        for count, feed_ids in sorted(by_count.items()):
+            _db.query(CachedFeed).filter(CachedFeed.id.in_(sorted(feed_ids))).update(
+                {CachedFeed.request_count: CachedFeed.request_count + count},
+                synchronize_session=False,
+            )
+
+    @classmethod
+    def _refresh_lock_id(cls, keys):
+        """Derive a Postgres advisory lock ID from a CachedFeedKeys.
+
+        :return: A signed 64-bit integer.
+        """
+        key = repr(tuple(cls._memory_cache_key(keys)))
+        digest = md5(key.encode("utf8")).digest()
+        return struct.unpack(">q", digest[:8])[0]
+
+    @classmethod
+    def _acquire_refresh_lock(cls, _db, keys, wait=False):
+        """Try to claim the right to regenerate the feed identified
+        by `keys`.
+
+        The lock is scoped to the current transaction, so it's released
+        at the moment the regenerated feed becomes visible to other
+        processes.
+
+        :param wait: If this is True, and some other process holds the
+            lock, wait until it's released rather than giving up.
+        :return: True if the lock was acquired; False if some other
+            process holds it.
+        """
+        lock_id = cls._refresh_lock_id(keys)
+        if wait:
+            _db.execute(select([func.pg_advisory_xact_lock(lock_id)]))
+            return True
+        return _db.execute(select([func.pg_try_advisory_xact_lock(lock_id)])).scalar()
+
     @classmethod
     def _prepare_keys(cls, _db, worklist, facets, pagination):
         """Prepare various unique keys that will go into the database
@@ -359,10 +994,75 @@ class CachedFeed(Base):
             pagination_key=pagination_key,
         )
 
-    def update(self, _db, content):
+    @classmethod
+    def hash_content(cls, content):
+        """Calculate a hash of feed content, suitable for use as an ETag."""
+        if content is None:
+            return None
+        if isinstance(content, str):
+            content = content.encode("utf8")
+        return sha256(content).hexdigest()
+
+    @classmethod
+    def compress(cls, content, encoding):
+        """Compress feed content with the given HTTP content coding.
+
+        :return: A bytestring, or None if the encoding isn't supported.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf8")
+        if encoding == cls.GZIP:
+            return gzip.compress(content)
+        if encoding == cls.BROTLI and brotli is not None:
+            return brotli.compress(content)
+        return None
+
+    @property
+    def precompressed(self):
+        """The precompressed representations of this feed.
+
+        :return: A dictionary mapping HTTP content codings to
+            bytestrings.
+        """
+        representations = {}
+        if self.gzip_content is not None:
+            representations[self.GZIP] = self.gzip_content
+        if self.brotli_content is not None:
+            representations[self.BROTLI] = self.brotli_content
+        return representations
+
+    def _set_content(self, content, timestamp):
+        """Set the content of this feed, along with everything derived
+        from it.
+        """
         self.content = content
-        self.timestamp = utc_now()
+        self.timestamp = timestamp
+        self.content_hash = self.hash_content(content)
+        self.gzip_content = None
+        self.brotli_content = None
+        if content is None:
+            return
+        encodings = self.precompress_encodings
+        if self.GZIP in encodings:
+            self.gzip_content = self.compress(content, self.GZIP)
+        if self.BROTLI in encodings:
+            self.brotli_content = self.compress(content, self.BROTLI)
+
+    def update(self, _db, content):
+        self._set_content(content, utc_now())
         flush(_db)
+        memory_cache = self.memory_cache
+        if memory_cache is not None:
+            keys = self.CachedFeedKeys(
+                feed_type=self.type,
+                library=self.library_id,
+                work=self.work_id,
+                lane_id=self.lane_id,
+                unique_key=self.unique_key,
+                facets_key=self.facets,
+                pagination_key=self.pagination,
+            )
+            self._put_in_memory_cache(keys, self)
 
     def __repr__(self):
         if self.content:
@@ -390,6 +1090,68 @@ Index(
 )
 
 
+class CachedFeedRefreshJob(DatabaseJob):
+    """Regenerate a CachedFeed in a worker thread, on behalf of a
+    request that was served a stale version of the feed.
+    """
+
+    def __init__(self, keys, refresher):
+        """Constructor.
+
+        :param keys: A CachedFeedKeys in which `library` and `work`
+            are database IDs rather than objects, as returned by
+            CachedFeed._memory_cache_key.
+        :param refresher: A function that takes a database session
+            and returns the new feed.
+        """
+        self.keys = keys
+        self.refresher = refresher
+
+    def do_run(self, _db):
+        try:
+            feed = self.refresher(_db)
+            if getattr(feed, "incomplete", False):
+                # Keep serving the old version rather than replace
+                # it with one that's missing content.
+                return
+            feed_data = str(feed)
+            generation_time = utc_now()
+            keys = self.keys
+            feed_obj = CachedFeed._store(
+                _db,
+                feed_data,
+                generation_time,
+                on_multiple="interchangeable",
+                type=keys.feed_type,
+                library_id=keys.library,
+                work_id=keys.work,
+                lane_id=keys.lane_id,
+                unique_key=keys.unique_key,
+                facets=keys.facets_key,
+                pagination=keys.pagination_key,
+            )
+            CachedFeed._put_in_memory_cache(keys, feed_obj)
+        finally:
+            CachedFeed._refresh_finished(self.keys)
+
+
+class CachedFeedRequestCountJob(DatabaseJob):
+    """Write request counts to the database in a worker thread, so
+    that a request for a feed doesn't have to.
+    """
+
+    def __init__(self, counts):
+        """Constructor.
+
+        :param counts: A Counter mapping CachedFeed IDs to the number
+            of times each feed was served.
+        """
+        self.counts = counts
+
+    def do_run(self, _db):
+        CachedFeed.write_request_counts(_db, self.counts)
+
+
 class WillNotGenerateExpensiveFeed(Exception):
     """This exception is raised when a feed is not cached, but it's too
     expensive to generate.
@@ -10,9 +10,13 @@ from sqlalchemy import (
     String,
     Unicode,
     UniqueConstraint,
+    cast,
+    select,
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql.expression import and_, literal, literal_column, or_
+from sqlalchemy.sql.functions import func
 
 from ..util.datetime_helpers import utc_now
 from . import Base, get_one, get_one_or_create
@@ -83,6 +87,113 @@ class BaseCoverageRecord(object):
 
         return missing
 
+    @classmethod
+    def _bulk_upsert(cls, _db, key, statuses, equivalent_record, timestamp, **values):
+        """Create or update one coverage record for each item in a batch,
+        using two statements no matter how big the batch is.
+
+        :param key: Name of the column that identifies the item being
+            covered, e.g. "identifier_id".
+        :param statuses: A list of (item ID, status, exception) 3-tuples.
+        :param equivalent_record: A clause matching the records that
+            would be considered the same as a record we're about to
+            create.
+        :param timestamp: The timestamp to give every record.
+        :param values: Values for the remaining columns of any newly
+            created records.
+        :return: A list of the coverage records that were created or
+            updated.
+        """
+        if not statuses:
+            return []
+
+        # If an item shows up more than once, the last status wins.
+        # Sorting by item ID means rows are always locked in the same
+        # order, which avoids deadlocks between concurrent batches.
+        by_id = dict(
+            (item_id, (status, exception)) for item_id, status, exception in statuses
+        )
+        item_ids = sorted(by_id)
+        status_values = [by_id[i][0] for i in item_ids]
+        exceptions = [by_id[i][1] for i in item_ids]
+
+        # Records created or modified through the ORM have to reach the
+        # database before we go looking for existing records.
+        _db.flush()
+
+        # Pass in the batch as parallel arrays and turn them back
+        # into rows on the database side.
+        data = select(
+            [
+                func.unnest(
+                    cast(literal(item_ids, ARRAY(Integer)), ARRAY(Integer))
+                ).label("item_id"),
+                func.unnest(
+                    cast(literal(status_values, ARRAY(Unicode)), ARRAY(Unicode))
+                ).label("status"),
+                func.unnest(
+                    cast(literal(exceptions, ARRAY(Unicode)), ARRAY(Unicode))
+                ).label("exception"),
+            ]
+        ).alias("data")
+
+        table = cls.__table__
+        key_column = table.c[key]
+
+        # Update the records that already exist. As in bulk_add, the
+        # rows are locked in ascending order before being updated.
+        locked = (
+            select([table.c.id])
+            .where(and_(key_column.in_(item_ids), equivalent_record))
+            .order_by(table.c.id)
+            .with_for_update()
+            .correlate(None)
+        )
+        update = (
+            table.update()
+            .where(
+                and_(
+                    table.c.id.in_(locked),
+                    key_column == data.c.item_id,
+                )
+            )
+            .values(
+                timestamp=timestamp,
+                status=cast(data.c.status, cls.status_enum),
+                exception=data.c.exception,
+            )
+            .returning(table.c.id, key_column)
+        )
+        results = _db.execute(update).fetchall()
+        updated_item_ids = [r[1] for r in results]
+
+        # Create records for everything else.
+        new_records = select(
+            [
+                data.c.item_id,
+                literal(timestamp, type_=DateTime),
+                cast(data.c.status, cls.status_enum),
+                data.c.exception,
+            ]
+            + [literal(v, type_=table.c[k].type) for k, v in values.items()]
+        ).order_by(data.c.item_id)
+        if updated_item_ids:
+            new_records = new_records.where(~data.c.item_id.in_(updated_item_ids))
+        insert = (
+            table.insert()
+            .from_select(
+                [key, "timestamp", "status", "exception"] + list(values.keys()),
+                new_records,
+            )
+            .returning(table.c.id, key_column)
+        )
+        results.extend(_db.execute(insert).fetchall())
+
+        # Any of these records that were already loaded into the session
+        # are now out of date, so make sure they get refreshed.
+        record_ids = [r[0] for r in results]
+        return _db.query(cls).filter(cls.id.in_(record_ids)).populate_existing().all()
+
 
 class Timestamp(Base):
     """Tracks the activities of Monitors, CoverageProviders,
@@ -559,6 +670,49 @@ class CoverageRecord(Base, BaseCoverageRecord):
 
         return new_records, ignored_identifiers
 
+    @classmethod
+    def bulk_upsert(
+        cls,
+        _db,
+        statuses,
+        data_source,
+        operation=None,
+        collection=None,
+        timestamp=None,
+    ):
+        """Create or update CoverageRecords for a batch of Identifiers,
+        each of which may have a different outcome.
+
+        Unlike bulk_add, this doesn't commit the session.
+
+        :param statuses: A list of (Identifier ID, status, exception)
+            3-tuples.
+        :return: A list of CoverageRecords.
+        """
+        timestamp = timestamp or utc_now()
+        collection_id = None
+        if collection:
+            collection_id = collection.id
+
+        # An INSERT ... ON CONFLICT won't work here: `operation` and
+        # `collection_id` are frequently NULL, and NULLs never conflict
+        # in a unique index.
+        equivalent_record = and_(
+            cls.operation == operation,
+            cls.data_source_id == data_source.id,
+            cls.collection_id == collection_id,
+        )
+        return cls._bulk_upsert(
+            _db,
+            "identifier_id",
+            statuses,
+            equivalent_record,
+            timestamp,
+            operation=operation,
+            data_source_id=data_source.id,
+            collection_id=collection_id,
+        )
+
 
 Index(
     "ix_coveragerecords_data_source_id_operation_identifier_id",
@@ -610,6 +764,25 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
             exception,
         )
 
+    @classmethod
+    def search_index_fragment_operation(cls, fragment):
+        """The operation used to record that one fragment of a Work's
+        search document needs to be regenerated.
+        """
+        return "%s-%s" % (cls.UPDATE_SEARCH_INDEX_OPERATION, fragment)
+
+    @classmethod
+    def search_index_operations(cls):
+        """Every operation that keeps track of the state of a Work's
+        search document.
+        """
+        from .work import Work
+
+        return [cls.UPDATE_SEARCH_INDEX_OPERATION] + [
+            cls.search_index_fragment_operation(fragment)
+            for fragment in Work.SEARCH_DOCUMENT_FRAGMENTS
+        ]
+
     @classmethod
     def lookup(self, work, operation):
         _db = Session.object_session(work)
@@ -717,6 +890,24 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
         )
         _db.execute(insert)
 
+    @classmethod
+    def bulk_upsert(cls, _db, statuses, operation, timestamp=None):
+        """Create or update WorkCoverageRecords for a batch of Works,
+        each of which may have a different outcome.
+
+        :param statuses: A list of (Work ID, status, exception) 3-tuples.
+        :return: A list of WorkCoverageRecords.
+        """
+        timestamp = timestamp or utc_now()
+        return cls._bulk_upsert(
+            _db,
+            "work_id",
+            statuses,
+            cls.operation == operation,
+            timestamp,
+            operation=operation,
+        )
+
 
 Index(
     "ix_workcoveragerecords_operation_work_id",
@@ -231,7 +231,7 @@ class CustomList(Base):
         # Make sure the Work's search document is updated to reflect its new
         # list membership.
         if work and update_external_index:
-            work.external_index_needs_updating()
+            work.search_index_fragment_needs_updating(Work.CUSTOMLISTS_FRAGMENT)
 
         return entry, was_new
 
@@ -246,7 +246,9 @@ class CustomList(Base):
             if entry.work:
                 # Make sure the Work's search document is updated to
                 # reflect its new list membership.
-                entry.work.external_index_needs_updating()
+                entry.work.search_index_fragment_needs_updating(
+                    Work.CUSTOMLISTS_FRAGMENT
+                )
 
             _db.delete(entry)
 
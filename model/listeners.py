@@ -12,13 +12,15 @@ from ..config import Configuration
 from ..util.datetime_helpers import to_utc, utc_now
 from . import Base
 from .admin import Admin, AdminRole
-from .classification import Genre
+from .classification import Classification, Genre
 from .collection import Collection
 from .configuration import ConfigurationSetting, ExternalIntegration
 from .datasource import DataSource
+from .edition import Edition
+from .identifier import Identifier
 from .library import Library
 from .licensing import DeliveryMechanism, LicensePool
-from .work import Work
+from .work import Work, WorkGenre
 
 site_configuration_has_changed_lock = RLock()
 
@@ -192,9 +194,11 @@ def add_work_to_customlists_for_collection(pool_or_work, value, oldvalue, initia
 @event.listens_for(Work.license_pools, "append")
 @event.listens_for(Work.license_pools, "remove")
 def licensepool_removed_from_work(target, value, initiator):
-    """When a Work gains or loses a LicensePool, it needs to be reindexed."""
+    """When a Work gains or loses a LicensePool, the licensepools part of
+    its search document needs to be regenerated.
+    """
     if target:
-        target.external_index_needs_updating()
+        target.search_index_fragment_needs_updating(Work.LICENSEPOOLS_FRAGMENT)
 
 
 @event.listens_for(LicensePool, "after_delete")
@@ -217,7 +221,7 @@ def licensepool_collection_change(target, value, oldvalue, initiator):
         return
     if value == oldvalue:
         return
-    work.external_index_needs_updating()
+    work.search_index_fragment_needs_updating(Work.LICENSEPOOLS_FRAGMENT)
 
 
 @event.listens_for(LicensePool.open_access, "set")
@@ -233,7 +237,90 @@ def licensepool_storage_status_change(target, value, oldvalue, initiator):
         return
     if value == oldvalue:
         return
-    work.external_index_needs_updating()
+    work.search_index_fragment_needs_updating(Work.LICENSEPOOLS_FRAGMENT)
+
+
+def _search_index_fragment_needs_updating(target, get_works, fragment):
+    """Register `fragment` for regeneration on every Work returned by
+    `get_works(target)`.
+
+    Finding the Works may mean lazy-loading a relationship while
+    `target` is still being constructed, so this is done without
+    autoflush.
+    """
+    _db = Session.object_session(target)
+    if not _db:
+        return
+    with _db.no_autoflush:
+        for work in get_works(target):
+            if work:
+                work.search_index_fragment_needs_updating(fragment)
+
+
+@event.listens_for(Work.work_genres, "append")
+@event.listens_for(Work.work_genres, "remove")
+def work_genres_change(target, value, initiator):
+    """When a Work gains or loses a genre, the genres part of its
+    search document needs to be regenerated.
+    """
+    _search_index_fragment_needs_updating(
+        target, lambda work: [work], Work.GENRES_FRAGMENT
+    )
+
+
+@event.listens_for(WorkGenre.affinity, "set")
+def work_genre_affinity_change(target, value, oldvalue, initiator):
+    """The genres part of a Work's search document includes the
+    affinity of each genre.
+    """
+    if value == oldvalue:
+        return
+    _search_index_fragment_needs_updating(
+        target, lambda wg: [wg.work], Work.GENRES_FRAGMENT
+    )
+
+
+@event.listens_for(Edition.contributions, "append")
+@event.listens_for(Edition.contributions, "remove")
+def edition_contributions_change(target, value, initiator):
+    """When the presentation edition of a Work gains or loses a
+    contributor, the contributors part of the Work's search document
+    needs to be regenerated.
+    """
+    _search_index_fragment_needs_updating(
+        target, lambda edition: [edition.work], Work.CONTRIBUTORS_FRAGMENT
+    )
+
+
+def _works_for_identifier(identifier):
+    if not identifier:
+        return []
+    return [pool.work for pool in identifier.licensed_through]
+
+
+@event.listens_for(Identifier.classifications, "append")
+@event.listens_for(Identifier.classifications, "remove")
+def identifier_classifications_change(target, value, initiator):
+    """When an Identifier is classified, the identifiers part of the
+    search document for each Work licensed through that Identifier
+    needs to be regenerated, since that's where the classifications
+    are found.
+    """
+    _search_index_fragment_needs_updating(
+        target, _works_for_identifier, Work.IDENTIFIERS_FRAGMENT
+    )
+
+
+@event.listens_for(Classification.weight, "set")
+def classification_weight_change(target, value, oldvalue, initiator):
+    """The search document includes the weight of each classification."""
+    if value == oldvalue:
+        return
+    _search_index_fragment_needs_updating(
+        target,
+        lambda classification: _works_for_identifier(classification.identifier),
+        Work.IDENTIFIERS_FRAGMENT,
+    )
 
 
 @event.listens_for(Work.last_update_time, "set")
@@ -241,7 +328,10 @@ def last_update_time_change(target, value, oldvalue, initator):
     """A Work needs to have its search document re-indexed whenever its
     last_update_time changes.
 
-    Among other things, this happens whenever the LicensePool's availability
-    information changes.
+    Most of the time this happens because the LicensePool's availability
+    information changed, so only the licensepools part of the document
+    is regenerated. Changes that affect the rest of the document
+    (e.g. in Work.calculate_presentation) schedule a full reindex
+    themselves.
     """
-    target.external_index_needs_updating()
+    target.search_index_fragment_needs_updating(Work.LICENSEPOOLS_FRAGMENT)
@@ -78,6 +78,27 @@ class Work(Base):
     CURRENTLY_AVAILABLE = "currently_available"
     ALL = "all"
 
+    # Some parts of a Work's search document change much more often
+    # than the rest. Each of these fragments can be regenerated and
+    # sent to the search index on its own, without rebuilding the
+    # whole document.
+    LICENSEPOOLS_FRAGMENT = "licensepools"
+    CONTRIBUTORS_FRAGMENT = "contributors"
+    GENRES_FRAGMENT = "genres"
+    CUSTOMLISTS_FRAGMENT = "customlists"
+    IDENTIFIERS_FRAGMENT = "identifiers"
+
+    # Maps each fragment to the search document fields it covers.
+    SEARCH_DOCUMENT_FRAGMENTS = {
+        # last_update_time changes whenever availability changes.
+        LICENSEPOOLS_FRAGMENT: ["licensepools", "last_update_time"],
+        CONTRIBUTORS_FRAGMENT: ["contributors"],
+        GENRES_FRAGMENT: ["genres"],
+        CUSTOMLISTS_FRAGMENT: ["customlists"],
+        # Classifications are found through the equivalent identifiers.
+        IDENTIFIERS_FRAGMENT: ["identifiers", "classifications"],
+    }
+
     # If no quality data is available for a work, it will be assigned
     # a default quality based on where we got it.
     #
@@ -1219,7 +1240,67 @@ class Work(Base):
         This is a more efficient alternative to reindexing immediately,
         since these WorkCoverageRecords are handled in large batches.
         """
-        return self._reset_coverage(WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION)
+        record = self._reset_coverage(WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION)
+
+        # Regenerating the whole document takes care of any fragments
+        # that were waiting to be regenerated.
+        fragment_operations = [
+            WorkCoverageRecord.search_index_fragment_operation(fragment)
+            for fragment in self.SEARCH_DOCUMENT_FRAGMENTS
+        ]
+        for fragment_record in list(self.coverage_records):
+            if (
+                fragment_record.operation in fragment_operations
+                and fragment_record.status == CoverageRecord.REGISTERED
+            ):
+                self.coverage_records.remove(fragment_record)
+        return record
+
+    def _search_index_update_registered(self):
+        """Is this work's whole search document already waiting to be
+        regenerated?
+        """
+        operation = WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        if "coverage_records" in self.__dict__:
+            # The records are already loaded, and may have changes
+            # that haven't been flushed.
+            records = [x for x in self.coverage_records if x.operation == operation]
+        else:
+            # This is called from event listeners, so look up the
+            # one relevant record rather than loading them all, and
+            # don't flush objects that may be half-constructed.
+            _db = Session.object_session(self)
+            if not _db or self.id is None:
+                return False
+            with _db.no_autoflush:
+                records = (
+                    _db.query(WorkCoverageRecord)
+                    .filter(WorkCoverageRecord.work_id == self.id)
+                    .filter(WorkCoverageRecord.operation == operation)
+                    .all()
+                )
+        return any(x.status == CoverageRecord.REGISTERED for x in records)
+
+    def search_index_fragment_needs_updating(self, *fragments):
+        """Mark some fragments of this work's search document as needing
+        to be regenerated.
+
+        This is much cheaper than external_index_needs_updating() for
+        changes, such as availability changes, that only affect a small
+        part of the document. If the whole document is already waiting
+        to be regenerated, nothing happens.
+
+        :param fragments: Keys of SEARCH_DOCUMENT_FRAGMENTS.
+        :return: A list of WorkCoverageRecords.
+        """
+        if self._search_index_update_registered():
+            return []
+        return [
+            self._reset_coverage(
+                WorkCoverageRecord.search_index_fragment_operation(fragment)
+            )
+            for fragment in fragments
+        ]
 
     def update_external_index(self, client, add_coverage_record=True):
         """Create a WorkCoverageRecord so that this work's
@@ -1429,7 +1510,7 @@ class Work(Base):
     ELASTICSEARCH_TIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS"."MS'
 
     @classmethod
-    def to_search_documents(cls, works, policy=None):
+    def to_search_documents(cls, works, policy=None, fragments=None):
         """Generate search documents for these Works.
         This is done by constructing an extremely complicated
         SQL query. The code is ugly, but it's about 100 times
@@ -1440,6 +1521,11 @@ class Work(Base):
         :param policy: A PresentationCalculationPolicy to use when
            deciding how deep to go to find Identifiers equivalent to
            these works.
+
+        :param fragments: If this is a list of keys of
+           SEARCH_DOCUMENT_FRAGMENTS, only the fields covered by those
+           fragments will be generated, and the subqueries for the
+           other fields won't be run at all.
         """
 
         if not works:
@@ -1754,48 +1840,51 @@ class Work(Base):
 
         # Now, create a query that brings together everything we need for the final
         # search document.
+        columns = [
+            works_alias.c.work_id.label("_id"),
+            works_alias.c.work_id.label("work_id"),
+            works_alias.c.title,
+            works_alias.c.sort_title,
+            works_alias.c.subtitle,
+            works_alias.c.series,
+            works_alias.c.series_position,
+            works_alias.c.language,
+            works_alias.c.author,
+            works_alias.c.sort_author,
+            works_alias.c.medium,
+            works_alias.c.publisher,
+            works_alias.c.imprint,
+            works_alias.c.permanent_work_id,
+            works_alias.c.presentation_ready,
+            works_alias.c.last_update_time,
+            # Convert true/false to "Fiction"/"Nonfiction".
+            case(
+                [(works_alias.c.fiction == True, literal_column("'Fiction'"))],
+                else_=literal_column("'Nonfiction'"),
+            ).label("fiction"),
+            # Replace "Young Adult" with "YoungAdult" and "Adults Only" with "AdultsOnly".
+            func.replace(works_alias.c.audience, " ", "").label("audience"),
+            works_alias.c.summary_text.label("summary"),
+            works_alias.c.quality,
+            works_alias.c.rating,
+            works_alias.c.popularity,
+            # Here are all the subqueries.
+            licensepools_json.label("licensepools"),
+            customlists_json.label("customlists"),
+            contributors_json.label("contributors"),
+            identifiers_json.label("identifiers"),
+            subjects_json.label("classifications"),
+            genres_json.label("genres"),
+            target_age_json.label("target_age"),
+        ]
+        if fragments:
+            fields = set(["_id", "work_id"])
+            for fragment in fragments:
+                fields.update(cls.SEARCH_DOCUMENT_FRAGMENTS[fragment])
+            columns = [x for x in columns if x.name in fields]
+
         search_data = (
-            select(
-                [
-                    works_alias.c.work_id.label("_id"),
-                    works_alias.c.work_id.label("work_id"),
-                    works_alias.c.title,
-                    works_alias.c.sort_title,
-                    works_alias.c.subtitle,
-                    works_alias.c.series,
-                    works_alias.c.series_position,
-                    works_alias.c.language,
-                    works_alias.c.author,
-                    works_alias.c.sort_author,
-                    works_alias.c.medium,
-                    works_alias.c.publisher,
-                    works_alias.c.imprint,
-                    works_alias.c.permanent_work_id,
-                    works_alias.c.presentation_ready,
-                    works_alias.c.last_update_time,
-                    # Convert true/false to "Fiction"/"Nonfiction".
-                    case(
-                        [(works_alias.c.fiction == True, literal_column("'Fiction'"))],
-                        else_=literal_column("'Nonfiction'"),
-                    ).label("fiction"),
-                    # Replace "Young Adult" with "YoungAdult" and "Adults Only" with "AdultsOnly".
-                    func.replace(works_alias.c.audience, " ", "").label("audience"),
-                    works_alias.c.summary_text.label("summary"),
-                    works_alias.c.quality,
-                    works_alias.c.rating,
-                    works_alias.c.popularity,
-                    # Here are all the subqueries.
-                    licensepools_json.label("licensepools"),
-                    customlists_json.label("customlists"),
-                    contributors_json.label("contributors"),
-                    identifiers_json.label("identifiers"),
-                    subjects_json.label("classifications"),
-                    genres_json.label("genres"),
-                    target_age_json.label("target_age"),
-                ]
-            )
-            .select_from(works_alias)
-            .alias("search_data_subquery")
+            select(columns).select_from(works_alias).alias("search_data_subquery")
         )
 
         # Finally, convert everything to json.
@@ -882,6 +882,68 @@ class ReaperMonitor(Monitor):
         return self._db.query(self.MODEL_CLASS).filter(self.where_clause)
 
 
+class CachedFeedRefreshMonitor(Monitor):
+    """Regenerate the most frequently requested cached feeds before
+    they go stale, so that patrons rarely have to wait for one of
+    them to be generated.
+
+    Core doesn't know how to turn a CachedFeed back into the
+    WorkList, Facets and Annotator that originally generated it, so
+    this class is designed to be subclassed. Subclasses must
+    implement refresh().
+    """
+
+    SERVICE_NAME = "Cached Feed Refresher"
+
+    # Regenerate this many of the most popular feeds on each run.
+    FEED_COUNT = 20
+
+    # Feeds older than this are considered close enough to expiring
+    # that they should be regenerated. This should be set somewhat
+    # lower than the max_cache_age of the feeds in question.
+    REFRESH_AFTER = datetime.timedelta(minutes=10)
+
+    def __init__(self, _db, feed_count=None, refresh_after=None, **kwargs):
+        super(CachedFeedRefreshMonitor, self).__init__(_db, **kwargs)
+        self.feed_count = feed_count or self.FEED_COUNT
+        self.refresh_after = refresh_after or self.REFRESH_AFTER
+
+    def query(self):
+        """Find the popular CachedFeeds that are about to go stale."""
+        cutoff = utc_now() - self.refresh_after
+        return (
+            self._db.query(CachedFeed)
+            .filter(CachedFeed.content != None)
+            .filter(CachedFeed.timestamp < cutoff)
+            .order_by(CachedFeed.request_count.desc(), CachedFeed.id)
+            .limit(self.feed_count)
+        )
+
+    def run_once(self, *args, **kwargs):
+        refreshed = 0
+        for feed in self.query().all():
+            try:
+                content = self.refresh(feed)
+            except Exception as e:
+                self.log.error("Could not refresh %r: %r", feed, e, exc_info=e)
+                continue
+            if content is None:
+                continue
+            feed.update(self._db, str(content))
+            self._db.commit()
+            refreshed += 1
+        return TimestampData(achievements="Feeds refreshed: %d" % refreshed)
+
+    def refresh(self, feed):
+        """Generate new content for a CachedFeed.
+
+        :param feed: A CachedFeed.
+        :return: The new content of the feed (a string or an OPDSFeed),
+            or None if this feed can't be regenerated.
+        """
+        raise NotImplementedError()
+
+
 # ReaperMonitors that do something specific.
 
 
@@ -1,8 +1,10 @@
 import datetime
 import logging
+import re
 from collections import defaultdict
 from urllib.parse import quote
 
+import flask
 from lxml import etree
 from sqlalchemy.orm.session import Session
 
@@ -53,6 +55,15 @@ class Annotator(object):
 
     opds_cache_field = Work.simple_opds_entry.name
 
+    # If this is True, an AcquisitionFeed will put a Work's cached
+    # OPDS entry into the feed as a string, with the output of
+    # annotate_work_entry() spliced onto the end, rather than parsing
+    # the cached entry into an lxml tree. This is only safe if
+    # annotate_work_entry() does nothing but add new tags to the end
+    # of the entry, and nothing needs to inspect the feed's entries
+    # after the feed is created.
+    splice_entries = False
+
     def is_work_entry_solo(self, work):
         """Return a boolean value indicating whether the work's OPDS catalog entry is served by itself,
             rather than as a part of the feed.
@@ -158,6 +169,104 @@ class Annotator(object):
         if updated:
             entry.extend([AtomFeed.updated(AtomFeed._strftime(updated))])
 
+    def annotate_opds2_publication(
+        self, work, active_license_pool, edition, identifier, feed, publication
+    ):
+        """The OPDS 2.0 equivalent of annotate_work_entry.
+
+        :param feed: An OPDS2Feed -- the feed in which this publication
+           will be situated.
+        :param publication: A dictionary, the publication that will be
+           added to the feed. Its `metadata` and `links` are already in
+           place.
+        """
+        metadata = publication["metadata"]
+        links = publication["links"]
+
+        if identifier:
+            metadata["identifier"] = identifier.urn
+
+        permalink_uri, permalink_type = self.permalink_for(
+            work, active_license_pool, identifier
+        )
+        if permalink_uri:
+            links.append(
+                dict(
+                    rel="self" if self.is_work_entry_solo(work) else "alternate",
+                    href=permalink_uri,
+                    type=permalink_type,
+                )
+            )
+
+        if active_license_pool:
+            avail = active_license_pool.availability_time
+            if avail:
+                if isinstance(avail, datetime.datetime):
+                    avail = avail.date()
+                if avail <= datetime.date.today():
+                    metadata["available"] = AtomFeed._strftime(avail)
+            links.extend(self.opds2_acquisition_links(active_license_pool))
+
+        if work.last_update_time:
+            metadata["modified"] = AtomFeed._strftime(work.last_update_time)
+
+    def opds2_acquisition_links(self, active_license_pool):
+        """Explain how to get a book, in OPDS 2.0 terms.
+
+        By default, only open-access downloads are described.
+        Annotators that know how to lend books should override this.
+
+        :return: A list of link dictionaries.
+        """
+        links = []
+        if not active_license_pool.open_access:
+            return links
+        for lpdm in active_license_pool.delivery_mechanisms:
+            resource = lpdm.resource
+            if not resource:
+                continue
+            if resource.representation:
+                href = resource.representation.public_url
+            else:
+                href = resource.url
+            if not href:
+                continue
+            types = AcquisitionFeed.format_types(lpdm.delivery_mechanism)
+            links.append(
+                self.opds2_acquisition_link(
+                    OPDSFeed.OPEN_ACCESS_REL,
+                    href,
+                    types,
+                    availability=dict(state="available"),
+                )
+            )
+        return links
+
+    @classmethod
+    def opds2_acquisition_link(cls, rel, href, types, **properties):
+        """The OPDS 2.0 equivalent of AcquisitionFeed.acquisition_link.
+
+        :param types: A list of media types. The first is the type of
+            the link itself; the rest become nested indirectAcquisition
+            properties.
+        :param properties: Additional link properties.
+        :return: A dictionary.
+        """
+        link = dict(rel=rel, href=href)
+        if types:
+            link["type"] = types[0]
+        indirect = None
+        for type in reversed(types[1:]):
+            parent = dict(type=type)
+            if indirect is not None:
+                parent["child"] = [indirect]
+            indirect = parent
+        if indirect is not None:
+            properties["indirectAcquisition"] = [indirect]
+        if properties:
+            link["properties"] = properties
+        return link
+
     @classmethod
     def annotate_feed(cls, feed, lane, list=None):
         """Make any custom modifications necessary to integrate this
@@ -704,6 +813,10 @@ class AcquisitionFeed(OPDSFeed):
         # Miscellaneous.
         annotator.annotate_feed(feed, worklist)
 
+        # If some of the lanes couldn't be filled because a search
+        # timed out, this feed shouldn't be cached as though it were
+        # complete.
+        feed.incomplete = getattr(facets, "search_timed_out", False)
         return feed
 
     @classmethod
@@ -836,7 +949,17 @@ class AcquisitionFeed(OPDSFeed):
         return feed
 
     @classmethod
-    def from_query(cls, query, _db, feed_name, url, pagination, url_fn, annotator):
+    def from_query(
+        cls,
+        query,
+        _db,
+        feed_name,
+        url,
+        pagination,
+        url_fn,
+        annotator,
+        defer_entries=False,
+    ):
         """Build  a feed representing one page of a given list. Currently used for
         creating an OPDS feed for a custom list and not cached.
 
@@ -848,11 +971,21 @@ class AcquisitionFeed(OPDSFeed):
         TODO: This cannot currently return OPDSFeedResponse because the
         admin interface modifies the feed after it's generated.
 
+        :param defer_entries: If this is True, the page of works won't
+            be loaded until the feed is serialized. This is most useful
+            in conjunction with as_streaming_response().
         """
         page_of_works = pagination.modify_database_query(_db, query)
         pagination.total_size = int(query.count())
 
-        feed = cls(_db, feed_name, url, page_of_works, annotator)
+        feed = cls(
+            _db,
+            feed_name,
+            url,
+            page_of_works,
+            annotator,
+            defer_entries=defer_entries,
+        )
 
         if pagination.total_size > 0 and pagination.has_next_page:
             OPDSFeed.add_link_to_feed(
@@ -875,6 +1008,17 @@ class AcquisitionFeed(OPDSFeed):
         """Convert this feed into an OPDSFEedResponse."""
         return OPDSFeedResponse(self, **kwargs)
 
+    def as_streaming_response(self, **kwargs):
+        """Convert this feed into an OPDSFeedResponse whose entity-body
+        is serialized as it's sent to the client.
+        """
+        body = self.stream()
+        if flask.has_request_context():
+            # Deferred entries may need to hit the database after the
+            # view function returns.
+            body = flask.stream_with_context(body)
+        return OPDSFeedResponse(body, **kwargs)
+
     def as_error_response(self, **kwargs):
         """Convert this feed into an OPDSFEedResponse that should be treated
         by intermediaries as an error -- that is, treated as private
@@ -1208,20 +1352,50 @@ class AcquisitionFeed(OPDSFeed):
                 continue
             yield cls.facet_link(url, str(facet_title), str(group_title), selected)
 
-    def __init__(self, _db, title, url, works, annotator=None, precomposed_entries=[]):
+    # Marks the spot in the serialized feed where a spliced entry
+    # should go.
+    SPLICE_MARKER = "splice:%d"
+    SPLICE_MARKER_RE = re.compile("<!--splice:([0-9]+)-->")
+
+    # Maps the start tag of a cached OPDS entry to its tag name and the
+    # namespaces it declares, so each distinct start tag only has to
+    # be parsed once.
+    _entry_start_tags = {}
+
+    def __init__(
+        self,
+        _db,
+        title,
+        url,
+        works,
+        annotator=None,
+        precomposed_entries=[],
+        defer_entries=False,
+    ):
         """Turn a list of works, messages, and precomposed <opds> entries
         into a feed.
+
+        :param defer_entries: If this is True, the works won't be
+            turned into <entry> tags until the feed is serialized, and
+            when the feed is streamed (see AtomFeed.stream), each
+            <entry> will be discarded as soon as it's been sent. Such
+            a feed can only be serialized once.
         """
         if not annotator:
             annotator = Annotator
         if callable(annotator):
             annotator = annotator()
         self.annotator = annotator
+        self.spliced_entries = []
 
         super(AcquisitionFeed, self).__init__(title, url)
 
-        for work in works:
-            self.add_entry(work)
+        if defer_entries:
+            self.deferred_works = works
+        else:
+            self.deferred_works = None
+            for work in works:
+                self.add_entry(work)
 
         # Add the precomposed entries and the messages.
         for entry in precomposed_entries:
@@ -1229,18 +1403,61 @@ class AcquisitionFeed(OPDSFeed):
                 entry = entry.tag
             self.feed.append(entry)
 
+    def __str__(self):
+        if self.deferred_works is not None:
+            return b"".join(self.stream()).decode("utf8")
+        feed = super(AcquisitionFeed, self).__str__()
+        if feed is None or not self.spliced_entries:
+            return feed
+        return self.SPLICE_MARKER_RE.sub(
+            lambda match: self.spliced_entries[int(match.group(1))], feed
+        )
+
+    def _elements_to_stream(self):
+        for element in self.feed:
+            yield element
+        if self.deferred_works is not None:
+            works = self.deferred_works
+            self.deferred_works = None
+            for work in works:
+                entry = self._make_entry(work)
+                if entry is not None:
+                    yield entry
+
+    def _serialize_element(self, element):
+        if isinstance(element, etree._Comment):
+            match = self.SPLICE_MARKER_RE.match(etree.tounicode(element))
+            if match:
+                # This entry has already been serialized. Free up the
+                # memory it was using, since it's about to be sent.
+                index = int(match.group(1))
+                entry = self.spliced_entries[index]
+                self.spliced_entries[index] = None
+                return entry.encode("utf8") + b"\n"
+        return super(AcquisitionFeed, self)._serialize_element(element)
+
     def add_entry(self, work):
         """Attempt to create an OPDS <entry>. If successful, append it to
         the feed.
         """
-        entry = self.create_entry(work)
-
+        entry = self._make_entry(work)
         if entry is not None:
-            if isinstance(entry, OPDSMessage):
-                entry = entry.tag
             self.feed.append(entry)
         return entry
 
+    def _make_entry(self, work):
+        """Create an OPDS <entry> (or a placeholder for a spliced entry)
+        without adding it to the feed.
+        """
+        entry = None
+        if getattr(self.annotator, "splice_entries", False):
+            entry = self.splice_entry(work)
+        if entry is None:
+            entry = self.create_entry(work)
+        if isinstance(entry, OPDSMessage):
+            entry = entry.tag
+        return entry
+
     def create_entry(
         self, work, even_if_no_license_pool=False, force_create=False, use_cache=True
     ):
@@ -1362,6 +1579,72 @@ class AcquisitionFeed(OPDSFeed):
 
         return xml
 
+    def splice_entry(self, work):
+        """Turn a Work's cached OPDS entry into an entry for this feed,
+        without building an lxml tree for it.
+
+        The annotator is run against an empty <entry> tag, and the
+        tags it adds are spliced onto the end of the cached entry.
+
+        :return: A placeholder comment to be added to the feed in place
+            of the entry, or None if the entry can't be spliced -- in
+            which case the caller should fall back to create_entry().
+        """
+        if isinstance(work, Edition):
+            return None
+        field = self.annotator.opds_cache_field
+        cached = field and getattr(work, field, None)
+        if not cached:
+            return None
+
+        active_license_pool = self.annotator.active_licensepool_for(work)
+        if not active_license_pool:
+            # create_entry() knows how to explain the problem.
+            return None
+        identifier = active_license_pool.identifier
+        edition = active_license_pool.presentation_edition
+        if not identifier or not edition:
+            return None
+
+        end = cached.rfind("</")
+        start_tag_end = cached.find(">")
+        if end == -1 or start_tag_end == -1:
+            return None
+        start_tag = cached[: start_tag_end + 1]
+
+        try:
+            if start_tag not in self._entry_start_tags:
+                root = etree.fromstring(start_tag + cached[end:])
+                self._entry_start_tags[start_tag] = (root.tag, root.nsmap)
+            tag, nsmap = self._entry_start_tags[start_tag]
+            overlay = etree.Element(tag, nsmap=nsmap)
+            self.annotator.annotate_work_entry(
+                work, active_license_pool, edition, identifier, self, overlay
+            )
+        except UnfulfillableWork as e:
+            return None
+        except Exception as e:
+            logging.error("Exception splicing OPDS entry for %r", work, exc_info=e)
+            return None
+
+        if overlay.attrib:
+            # The annotator wants to modify the <entry> tag itself,
+            # which can't be done by splicing.
+            return None
+
+        if len(overlay):
+            # The namespaces declared on the overlay are the ones
+            # already declared in the cached entry, so the tags inside
+            # the overlay can be moved over as-is.
+            overlay = etree.tounicode(overlay)
+            overlay = overlay[overlay.find(">") + 1 : overlay.rfind("</")]
+        else:
+            overlay = ""
+
+        marker = etree.Comment(self.SPLICE_MARKER % len(self.spliced_entries))
+        self.spliced_entries.append(cached[:end] + overlay + cached[end:])
+        return marker
+
     def _make_entry_xml(self, work, edition):
         """Create a new (incomplete) OPDS entry for the given work.
 
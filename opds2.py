@@ -0,0 +1,474 @@
+"""Generate OPDS 2.0 feeds.
+
+OPDS 2.0 feeds are JSON documents, so they're a lot cheaper to build
+and to parse than OPDS 1 feeds. The feeds generated here correspond
+to the ones generated by opds.AcquisitionFeed, and they're built
+using the same Annotator classes.
+"""
+import datetime
+import json
+import logging
+
+from .facets import FacetConstants
+from .lane import Facets, FeaturedFacets, Pagination
+from .model import CachedFeed, Edition
+from .opds import AcquisitionFeed, UnfulfillableWork
+from .util.datetime_helpers import utc_now
+from .util.opds_writer import AtomFeed, OPDSFeed
+
+
+class OPDS2Feed(object):
+    """An OPDS 2.0 feed of publications."""
+
+    MEDIA_TYPE = "application/opds+json"
+    PUBLICATION_MEDIA_TYPE = "application/opds-publication+json"
+
+    # Feeds in this format are cached separately from OPDS 1 feeds.
+    CACHED_FEED_FORMAT = "opds2"
+
+    @classmethod
+    def groups(
+        cls,
+        _db,
+        title,
+        url,
+        worklist,
+        annotator,
+        pagination=None,
+        facets=None,
+        max_age=None,
+        search_engine=None,
+        search_debug=False,
+        **response_kwargs
+    ):
+        """The OPDS 2.0 equivalent of AcquisitionFeed.groups.
+
+        :return: An OPDSFeedResponse containing the feed.
+        """
+        annotator = AcquisitionFeed._make_annotator(annotator)
+        facets = facets or FeaturedFacets.default(worklist.get_library(_db))
+
+        def refresh():
+            return cls._generate_groups(
+                _db=_db,
+                title=title,
+                url=url,
+                worklist=worklist,
+                annotator=annotator,
+                pagination=pagination,
+                facets=facets,
+                search_engine=search_engine,
+                search_debug=search_debug,
+            )
+
+        response_kwargs.setdefault("mimetype", cls.MEDIA_TYPE)
+        return CachedFeed.fetch(
+            _db=_db,
+            worklist=worklist,
+            pagination=pagination,
+            facets=facets,
+            refresher_method=refresh,
+            max_age=max_age,
+            feed_format=cls.CACHED_FEED_FORMAT,
+            **response_kwargs
+        )
+
+    @classmethod
+    def _generate_groups(
+        cls,
+        _db,
+        title,
+        url,
+        worklist,
+        annotator,
+        pagination,
+        facets,
+        search_engine,
+        search_debug,
+    ):
+        """Internal method called by groups() when a grouped feed
+        must be regenerated.
+        """
+        all_works = []
+        for work, sublane in worklist.groups(
+            _db=_db,
+            pagination=pagination,
+            facets=facets,
+            search_engine=search_engine,
+            debug=search_debug,
+        ):
+            # See AcquisitionFeed._generate_groups for an explanation.
+            if sublane == worklist:
+                v = dict(
+                    lane=worklist,
+                    label=worklist.display_name_for_all,
+                    link_to_list_feed=True,
+                )
+            else:
+                v = dict(lane=sublane)
+            annotator.lanes_by_work[work].append(v)
+            all_works.append(work)
+
+        all_works = annotator.sort_works_for_groups_feed(all_works)
+        feed = cls(_db, title, url, all_works, annotator, grouped=True)
+
+        entrypoints = facets.selectable_entrypoints(worklist)
+        if entrypoints:
+
+            def make_link(ep):
+                return annotator.groups_url(
+                    worklist, facets=facets.navigate(entrypoint=ep)
+                )
+
+            feed.add_entrypoint_links(make_link, entrypoints, facets.entrypoint)
+        feed.incomplete = getattr(facets, "search_timed_out", False)
+        return feed
+
+    @classmethod
+    def page(
+        cls,
+        _db,
+        title,
+        url,
+        worklist,
+        annotator,
+        facets=None,
+        pagination=None,
+        max_age=None,
+        search_engine=None,
+        search_debug=False,
+        **response_kwargs
+    ):
+        """The OPDS 2.0 equivalent of AcquisitionFeed.page.
+
+        :return: An OPDSFeedResponse containing the feed.
+        """
+        library = worklist.get_library(_db)
+        facets = facets or Facets.default(library)
+        pagination = pagination or Pagination.default()
+        annotator = AcquisitionFeed._make_annotator(annotator)
+
+        def refresh():
+            return cls._generate_page(
+                _db,
+                title,
+                url,
+                worklist,
+                annotator,
+                facets,
+                pagination,
+                search_engine,
+                search_debug,
+            )
+
+        response_kwargs.setdefault("max_age", max_age)
+        response_kwargs.setdefault("mimetype", cls.MEDIA_TYPE)
+        return CachedFeed.fetch(
+            _db,
+            worklist=worklist,
+            pagination=pagination,
+            facets=facets,
+            refresher_method=refresh,
+            feed_format=cls.CACHED_FEED_FORMAT,
+            **response_kwargs
+        )
+
+    @classmethod
+    def _generate_page(
+        cls,
+        _db,
+        title,
+        url,
+        lane,
+        annotator,
+        facets,
+        pagination,
+        search_engine,
+        search_debug,
+    ):
+        """Internal method called by page() when a cached feed
+        must be regenerated.
+        """
+        works = lane.works(
+            _db,
+            pagination=pagination,
+            facets=facets,
+            search_engine=search_engine,
+            debug=search_debug,
+        )
+        if not isinstance(works, list):
+            works = [x for x in works]
+
+        if not pagination.page_has_loaded:
+            pagination.page_loaded(works)
+        feed = cls(_db, title, url, works, annotator)
+
+        entrypoints = facets.selectable_entrypoints(lane)
+        if entrypoints:
+
+            def make_link(ep):
+                return annotator.feed_url(lane, facets=facets.navigate(entrypoint=ep))
+
+            feed.add_entrypoint_links(make_link, entrypoints, facets.entrypoint)
+
+        for args in AcquisitionFeed.facet_links(annotator, facets):
+            feed.add_facet_link(args)
+
+        feed.metadata["itemsPerPage"] = pagination.size
+        if len(works) > 0 and pagination.has_next_page:
+            feed.add_link(
+                annotator.feed_url(lane, facets, pagination.next_page), rel="next"
+            )
+        if pagination.offset > 0:
+            feed.add_link(
+                annotator.feed_url(lane, facets, pagination.first_page), rel="first"
+            )
+        previous_page = pagination.previous_page
+        if previous_page:
+            feed.add_link(
+                annotator.feed_url(lane, facets, previous_page), rel="previous"
+            )
+        return feed
+
+    def __init__(self, _db, title, url, works, annotator=None, grouped=False):
+        """Turn a list of works into a feed.
+
+        :param grouped: If this is True, works will be put into
+            groups based on the annotator's group_uri(). Works that
+            don't belong to any group go into the top-level list of
+            publications.
+        """
+        self.annotator = AcquisitionFeed._make_annotator(annotator)
+        self.metadata = dict(title=str(title))
+        self.links = []
+        self.publications = []
+        self.groups = []
+        self.facets = []
+        self._groups_by_uri = {}
+        self.add_link(url, rel="self")
+        for work in works:
+            self.add_publication(work, grouped=grouped)
+
+    def __str__(self):
+        return json.dumps(self.as_dict)
+
+    @property
+    def as_dict(self):
+        data = dict(
+            metadata=self.metadata,
+            links=self.links,
+            publications=self.publications,
+        )
+        if self.groups:
+            data["groups"] = self.groups
+        if self.facets:
+            data["facets"] = self.facets
+        return data
+
+    def add_link(self, href, rel=None, type=None, **kwargs):
+        """Add a link to the feed.
+
+        :param type: The media type of the link. Defaults to the type
+            of an OPDS 2.0 feed.
+        """
+        link = dict(href=href, type=type or self.MEDIA_TYPE)
+        if rel:
+            link["rel"] = rel
+        link.update(kwargs)
+        self.links.append(link)
+        return link
+
+    def add_facet_link(self, args):
+        """Add a facet link to the feed.
+
+        :param args: A dictionary of the sort returned by
+            AcquisitionFeed.facet_link, describing the link as it would
+            appear in an OPDS 1 feed.
+        """
+        group_title = args["{%s}facetGroup" % AtomFeed.OPDS_NS]
+        link = dict(href=args["href"], type=self.MEDIA_TYPE, title=args["title"])
+        if args.get("{%s}activeFacet" % AtomFeed.OPDS_NS) == "true":
+            # In OPDS 2.0, the active facet is the one that links to
+            # the current feed.
+            link["rel"] = "self"
+        if (
+            args.get("{%s}facetGroupType" % AtomFeed.SIMPLIFIED_NS)
+            == FacetConstants.ENTRY_POINT_REL
+        ):
+            link["properties"] = dict(facetGroupType=FacetConstants.ENTRY_POINT_REL)
+
+        for group in self.facets:
+            if group["metadata"]["title"] == group_title:
+                break
+        else:
+            group = dict(metadata=dict(title=group_title), links=[])
+            self.facets.append(group)
+        group["links"].append(link)
+
+    def add_entrypoint_links(
+        self, url_generator, entrypoints, selected_entrypoint, group_name="Formats"
+    ):
+        """Add a facet group for a set of EntryPoints.
+
+        See AcquisitionFeed.add_entrypoint_links.
+        """
+        if len(entrypoints) == 1 and selected_entrypoint in (None, entrypoints[0]):
+            return
+
+        is_default = True
+        for entrypoint in entrypoints:
+            link = AcquisitionFeed._entrypoint_link(
+                url_generator, entrypoint, selected_entrypoint, is_default, group_name
+            )
+            if link is not None:
+                self.add_facet_link(link)
+                is_default = False
+
+    def add_publication(self, work, grouped=False):
+        """Turn a Work into a publication and add it to the feed.
+
+        :return: The publication, or None if the Work couldn't be
+            turned into a publication.
+        """
+        publication = self.publication(work, grouped=grouped)
+        if publication is None:
+            return None
+        group_uri = publication.pop("group", None)
+        if group_uri:
+            self._groups_by_uri[group_uri]["publications"].append(publication)
+        else:
+            self.publications.append(publication)
+        return publication
+
+    def publication(self, work, grouped=False):
+        """Create an OPDS 2.0 publication for a Work.
+
+        :return: A dictionary, or None if there's no way to present
+            the Work to a client.
+        """
+        if isinstance(work, Edition):
+            return None
+        active_license_pool = self.annotator.active_licensepool_for(work)
+        if not active_license_pool:
+            logging.warning("NO ACTIVE LICENSE POOL FOR %r", work)
+            return None
+        identifier = active_license_pool.identifier
+        edition = active_license_pool.presentation_edition
+        if not identifier or not edition:
+            return None
+
+        try:
+            publication = self._make_publication(work, edition)
+            self.annotator.annotate_opds2_publication(
+                work, active_license_pool, edition, identifier, self, publication
+            )
+        except UnfulfillableWork as e:
+            logging.info(
+                "Work %r is not fulfillable, refusing to create a publication.",
+                work,
+            )
+            return None
+        except Exception as e:
+            logging.error(
+                "Exception generating OPDS 2.0 publication for %r", work, exc_info=e
+            )
+            return None
+
+        if grouped:
+            group_uri, group_title = self.annotator.group_uri(
+                work, active_license_pool, identifier
+            )
+            if group_uri:
+                if group_uri not in self._groups_by_uri:
+                    group = dict(
+                        metadata=dict(title=str(group_title)),
+                        links=[dict(href=group_uri, rel="self", type=self.MEDIA_TYPE)],
+                        publications=[],
+                    )
+                    self._groups_by_uri[group_uri] = group
+                    self.groups.append(group)
+                publication["group"] = group_uri
+        return publication
+
+    def _make_publication(self, work, edition):
+        """Describe a Work's bibliographic metadata, images and
+        categories as an OPDS 2.0 publication.
+
+        This is the equivalent of AcquisitionFeed._make_entry_xml.
+        """
+        metadata = dict(title=edition.title or OPDSFeed.NO_TITLE)
+        additional_type = Edition.medium_to_additional_type.get(edition.medium)
+        if additional_type:
+            metadata["@type"] = additional_type
+        if edition.sort_title:
+            metadata["sortAs"] = edition.sort_title
+        if edition.subtitle:
+            metadata["subtitle"] = edition.subtitle
+
+        authors = []
+        for contributor in edition.author_contributors:
+            name = contributor.display_name or contributor.sort_name
+            if not name:
+                continue
+            author = dict(name=name)
+            if contributor.sort_name:
+                author["sortAs"] = contributor.sort_name
+            authors.append(author)
+        if authors:
+            metadata["author"] = authors
+
+        if edition.series:
+            series = dict(name=edition.series)
+            if edition.series_position is not None:
+                series["position"] = edition.series_position
+            metadata["belongsTo"] = dict(series=series)
+
+        content = self.annotator.content(work)
+        if isinstance(content, bytes):
+            content = content.decode("utf8")
+        if content:
+            metadata["description"] = content
+
+        language = edition.language_code
+        if language:
+            metadata["language"] = language
+        if edition.publisher:
+            metadata["publisher"] = edition.publisher
+        if edition.imprint:
+            metadata["imprint"] = edition.imprint
+
+        issued = edition.issued or edition.published
+        if isinstance(issued, (datetime.datetime, datetime.date)):
+            if isinstance(issued, datetime.datetime):
+                issued_already = issued <= utc_now()
+            else:
+                issued_already = issued <= datetime.date.today()
+            if issued_already:
+                metadata["published"] = issued.isoformat().split("T")[0]
+
+        subjects = []
+        for scheme, categories in list(self.annotator.categories(work).items()):
+            for category in categories:
+                if isinstance(category, (bytes, str)):
+                    category = dict(term=category)
+                subject = dict(scheme=scheme, code=str(category["term"]))
+                subject["name"] = str(category.get("label", category["term"]))
+                subjects.append(subject)
+        if subjects:
+            metadata["subject"] = subjects
+
+        images = []
+        thumbnail_urls, full_urls = self.annotator.cover_links(work)
+        for rel, urls in (("cover", full_urls), ("thumbnail", thumbnail_urls)):
+            for url in urls:
+                image_type = "image/png"
+                if url.endswith(".jpeg") or url.endswith(".jpg"):
+                    image_type = "image/jpeg"
+                elif url.endswith(".gif"):
+                    image_type = "image/gif"
+                images.append(dict(href=url, type=image_type, rel=rel))
+
+        publication = dict(metadata=metadata, links=[])
+        if images:
+            publication["images"] = images
+        return publication
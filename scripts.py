@@ -5,6 +5,7 @@ import random
 import re
 import subprocess
 import sys
+import time
 import traceback
 import unicodedata
 import uuid
@@ -19,7 +20,13 @@ from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 from .config import CannotLoadConfiguration, Configuration
 from .coverage import CollectionCoverageProviderJob, CoverageProviderProgress
-from .external_search import ExternalSearchIndex, Filter, SearchIndexCoverageProvider
+from .external_search import (
+    ExternalSearchIndex,
+    Filter,
+    SearchIndexCoverageProvider,
+    SearchIndexFragmentCoverageProvider,
+    SearchIndexPipeline,
+)
 from .lane import Lane
 from .metadata_layer import (
     LinkData,
@@ -356,6 +363,11 @@ class RunThreadedCollectionCoverageProviderScript(Script):
         """Runs a CollectionCoverageProvider with multiple threads and
         updates the timestamp accordingly.
 
+        If the provider is created with claim_batches=True, each
+        thread claims one batch of items after another until there
+        are none left. Otherwise, the items are divided up ahead of
+        time by offset.
+
         :param pool: A DatabasePool (or other) object for use in testing
             environments.
         """
@@ -368,6 +380,22 @@ class RunThreadedCollectionCoverageProviderScript(Script):
             with (
                 pool or DatabasePool(self.worker_size, self.session_factory)
             ) as job_queue:
+                if provider.claim_batches:
+                    self._db.commit()
+                    # All the jobs share a start time, so an item that
+                    # one of them attempted during this run won't be
+                    # claimed by another.
+                    start = utc_now()
+                    for i in range(self.worker_size):
+                        job = CollectionCoverageProviderJob(
+                            collection,
+                            self.provider_class,
+                            CoverageProviderProgress(start=start),
+                            **self.provider_kwargs,
+                        )
+                        job_queue.put(job)
+                    continue
+
                 query_size, batch_size = self.get_query_and_batch_sizes(provider)
                 # Without a commit, the query to count which items need
                 # coverage hangs in the database, blocking the threads.
@@ -3358,7 +3386,7 @@ class RemovesSearchCoverage(object):
         :return: The number of records deleted.
         """
         wcr = WorkCoverageRecord
-        clause = wcr.operation == wcr.UPDATE_SEARCH_INDEX_OPERATION
+        clause = wcr.operation.in_(wcr.search_index_operations())
         count = self._db.query(wcr).filter(clause).count()
 
         # We want records to be updated in ascending order in order to avoid deadlocks.
@@ -3403,6 +3431,286 @@ class RebuildSearchIndexScript(RunWorkCoverageProviderScript, RemovesSearchCover
         return super(RebuildSearchIndexScript, self).do_run()
 
 
+class ParallelRebuildSearchIndexScript(TimestampScript, RemovesSearchCoverage):
+    """Completely delete the search index and recreate it, generating
+    and uploading search documents in several threads at once.
+
+    Progress is stored in the script's Timestamp, so an interrupted
+    rebuild can be picked up where it left off with --resume.
+    """
+
+    @classmethod
+    def arg_parser(cls):
+        parser = cls.pipeline_arg_parser()
+        parser.add_argument(
+            "--resume",
+            help="Continue an interrupted rebuild instead of starting over.",
+            action="store_true",
+        )
+        return parser
+
+    @classmethod
+    def pipeline_arg_parser(cls):
+        """Create an ArgumentParser for the options that control the
+        SearchIndexPipeline.
+        """
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            "--producers",
+            help="Number of threads generating search documents.",
+            type=int,
+            default=SearchIndexPipeline.DEFAULT_PRODUCERS,
+        )
+        parser.add_argument(
+            "--senders",
+            help="Number of threads uploading search documents.",
+            type=int,
+            default=SearchIndexPipeline.DEFAULT_SENDERS,
+        )
+        parser.add_argument(
+            "--batch-size",
+            help="Number of work IDs handled in each batch.",
+            type=int,
+            default=SearchIndexPipeline.DEFAULT_BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--queue-size",
+            help="Number of batches of documents that can wait to be uploaded.",
+            type=int,
+        )
+        return parser
+
+    def __init__(self, _db=None, search_index_client=None, pipeline_class=None):
+        super(ParallelRebuildSearchIndexScript, self).__init__(_db)
+        self.search = search_index_client or ExternalSearchIndex(self._db)
+        self.session_factory = SessionManager.sessionmaker(session=self._db)
+        self.pipeline_class = pipeline_class or SearchIndexPipeline
+
+    def timestamp(self, _db):
+        timestamp, ignore = get_one_or_create(
+            _db,
+            Timestamp,
+            service=self.script_name,
+            service_type=Timestamp.SCRIPT_TYPE,
+            collection=None,
+        )
+        return timestamp
+
+    def checkpoint(self, _db, work_id):
+        """Record that every Work with an ID lower than `work_id` has
+        been indexed.
+        """
+        self.timestamp(_db).counter = work_id
+        _db.commit()
+
+    def do_run(self, cmd_args=None):
+        parsed = self.parse_command_line(self._db, cmd_args=cmd_args)
+
+        # Create the Timestamp up front so the pipeline's threads
+        # don't race to create it.
+        timestamp = self.timestamp(self._db)
+        if parsed.resume:
+            start_id = timestamp.counter
+            self.log.info("Resuming search index rebuild at work ID %s.", start_id)
+        else:
+            # Calling setup_index will destroy the index and recreate it
+            # empty.
+            self.search.setup_index()
+            count = self.remove_search_coverage_records()
+            self.log.info("Deleted %d search coverage records.", count)
+            start_id = None
+            timestamp.counter = None
+        self._db.commit()
+
+        pipeline = self.pipeline(parsed, checkpoint=self.checkpoint)
+        pipeline.run(self._db, start_id=start_id)
+        return TimestampData(achievements=pipeline.achievements)
+
+    def pipeline(self, parsed, checkpoint=None, record_coverage=True):
+        """Create a pipeline as specified on the command line."""
+        return self.pipeline_class(
+            self.search,
+            self.session_factory,
+            producers=parsed.producers,
+            senders=parsed.senders,
+            batch_size=parsed.batch_size,
+            queue_size=parsed.queue_size,
+            checkpoint=checkpoint,
+            record_coverage=record_coverage,
+        )
+
+
+class BlueGreenRebuildSearchIndexScript(ParallelRebuildSearchIndexScript):
+    """Rebuild the search index in a brand new index while the current
+    index keeps serving searches, then switch the -current alias over
+    to the new index.
+
+    The new index is loaded with refresh disabled and no replicas.
+    Once it's loaded, it gets the current index's settings, is merged
+    down and warmed up, and is compared against the current index
+    before the alias moves. If any Works couldn't be indexed, the
+    alias doesn't move.
+
+    No coverage records are written while the new index is loaded.
+    Until the alias moves, the current index is the one that matters,
+    and SearchIndexCoverageProvider keeps it up to date as usual.
+    """
+
+    # Settings copied from the current index once the new index is loaded.
+    PRODUCTION_SETTINGS = ["refresh_interval", "number_of_replicas"]
+
+    @classmethod
+    def arg_parser(cls):
+        parser = cls.pipeline_arg_parser()
+        parser.add_argument(
+            "--sample-size",
+            help="Number of documents from the current index to look for in the new index.",
+            type=int,
+            default=100,
+        )
+        parser.add_argument(
+            "--tolerance",
+            help="Fraction by which the new index may have fewer documents than the current index.",
+            type=float,
+            default=0.01,
+        )
+        parser.add_argument(
+            "--force",
+            help="Switch to the new index even if it doesn't match the current index.",
+            action="store_true",
+        )
+        return parser
+
+    def do_run(self, cmd_args=None):
+        parsed = self.parse_command_line(self._db, cmd_args=cmd_args)
+        search = self.search
+        old_index = search.current_alias_index(self._db)
+        new_index = search.rebuild_index_name(self._db)
+        started = utc_now()
+
+        settings = {}
+        if old_index:
+            settings = search.index_settings(old_index, self.PRODUCTION_SETTINGS)
+        search.setup_index(new_index=new_index, **search.BULK_LOAD_SETTINGS)
+
+        # Only this script's client writes to the new index. Everyone
+        # else keeps using the current index until the alias moves.
+        live_index = search.works_index
+        search.works_index = new_index
+        pipeline = self.pipeline(parsed, record_coverage=False)
+        pipeline.run(self._db)
+
+        # Works that changed while the new index was being loaded may
+        # have been updated only in the current index.
+        catch_up_started = utc_now()
+        caught_up = self.catch_up(started, parsed.batch_size)
+
+        search.finish_bulk_load(new_index, settings)
+        achievements = "%s Works updated during the rebuild: %d." % (
+            pipeline.achievements,
+            caught_up,
+        )
+
+        # Works that couldn't be indexed would go missing from search
+        # the moment the alias moves.
+        if pipeline.failed and not parsed.force:
+            search.works_index = live_index
+            return TimestampData(
+                achievements=achievements,
+                exception="%d Works could not be added to %s; the alias was not moved."
+                % (pipeline.failed, new_index),
+            )
+
+        if old_index:
+            problems = search.compare_indexes(
+                new_index,
+                old_index,
+                sample_size=parsed.sample_size,
+                tolerance=parsed.tolerance,
+            )
+            for problem in problems:
+                self.log.error(problem)
+            if problems and not parsed.force:
+                search.works_index = live_index
+                return TimestampData(
+                    achievements=achievements,
+                    exception="%s does not match %s; the alias was not moved."
+                    % (new_index, old_index),
+                )
+
+        search.transfer_current_alias(self._db, new_index)
+
+        # Works that changed while the new index was being finished,
+        # or before every other process noticed that the alias moved,
+        # may also have been updated only in the old index.
+        time.sleep(search.CURRENT_INDEX_CACHE_TTL)
+        caught_up_after = self.catch_up(catch_up_started, parsed.batch_size)
+        achievements = "%s Works updated after the switch: %d." % (
+            achievements,
+            caught_up_after,
+        )
+
+        if old_index:
+            self.log.info(
+                "Searches now use %s. %s can be deleted.", new_index, old_index
+            )
+        return TimestampData(achievements=achievements)
+
+    def catch_up(self, since, batch_size):
+        """Bring the new index up to date with every Work that was
+        registered for a search index update, whole or partial, after
+        `since`.
+
+        Works that are still presentation-ready are indexed again;
+        Works that aren't are removed from the new index.
+
+        :return: The number of Works updated.
+        """
+        changed = (
+            self._db.query(WorkCoverageRecord.work_id)
+            .filter(
+                WorkCoverageRecord.operation.in_(
+                    WorkCoverageRecord.search_index_operations()
+                )
+            )
+            .filter(WorkCoverageRecord.timestamp >= since)
+        )
+        qu = (
+            self._db.query(Work)
+            .filter(Work.id.in_(changed.subquery()))
+            .order_by(Work.id)
+            .yield_per(batch_size)
+        )
+        count = 0
+        batch = []
+        for work in qu:
+            count += 1
+            if not work.presentation_ready:
+                self.search.remove_work(work)
+                continue
+            batch.append(work)
+            if len(batch) >= batch_size:
+                self.search.bulk_update(batch)
+                batch = []
+        if batch:
+            self.search.bulk_update(batch)
+        return count
+
+
+class UpdateSearchIndexFragmentsScript(RunWorkCoverageProviderScript):
+    """Regenerate the parts of search documents that have changed since
+    they were last indexed, without rebuilding the whole documents.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(UpdateSearchIndexFragmentsScript, self).__init__(
+            SearchIndexFragmentCoverageProvider, *args, **kwargs
+        )
+
+    def get_providers(self, _db, provider_class, **kwargs):
+        return list(provider_class.all(_db, **kwargs))
+
+
 class SearchIndexCoverageRemover(TimestampScript, RemovesSearchCoverage):
     """Script that removes search index coverage for all works.
 
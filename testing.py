@@ -1155,9 +1155,15 @@ class SearchClientForTesting(ExternalSearchIndex):
     This makes search results more predictable.
     """
 
-    def setup_index(self, new_index=None):
+    # Tests change the index and search it again right away, so
+    # don't cache search results unless a test asks for it.
+    DEFAULT_RESULT_CACHE_TTL = 0
+
+    def setup_index(self, new_index=None, **index_settings):
+        index_settings.setdefault("number_of_shards", 1)
+        index_settings.setdefault("number_of_replicas", 0)
         return super(SearchClientForTesting, self).setup_index(
-            new_index, number_of_shards=1, number_of_replicas=0
+            new_index, **index_settings
         )
 
 
@@ -1,11 +1,18 @@
 # encoding: utf-8
 import datetime
+import gzip
+from collections import Counter
 
 import pytest
 
 from ...classifier import Classifier
 from ...lane import Facets, Lane, Pagination, WorkList
-from ...model.cachedfeed import CachedFeed
+from ...model.cachedfeed import (
+    CachedFeed,
+    CachedFeedMemoryCache,
+    CachedFeedRefreshJob,
+    CachedFeedRequestCountJob,
+)
 from ...model.configuration import ConfigurationSetting
 from ...opds import AcquisitionFeed
 from ...testing import DatabaseTest
@@ -405,6 +412,540 @@ class TestCachedFeed(DatabaseTest):
         assert isinstance(r, OPDSFeedResponse)
         assert True == r.private
 
+    def test_memory_cache(self):
+        # If CachedFeed.memory_cache is set, it's checked before the
+        # database, and it's populated whenever a feed is generated.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        cache = CachedFeedMemoryCache()
+        CachedFeed.memory_cache = cache
+        try:
+            r = CachedFeed.fetch(*args, max_age=1000)
+            assert "This is feed #1" == str(r)
+            assert 1 == len(cache)
+            assert 1 == cache.misses
+
+            # Remove the feed from the database. We can still serve it
+            # from memory.
+            for feed in self._db.query(CachedFeed):
+                self._db.delete(feed)
+            self._db.flush()
+            r = CachedFeed.fetch(*args, max_age=1000)
+            assert isinstance(r, OPDSFeedResponse)
+            assert "This is feed #1" == str(r)
+            assert 1000 == r.max_age
+            assert 1 == cache.hits
+            assert 1 == len(refresher.calls)
+
+            # The in-memory feed is subject to the same staleness rules
+            # as a feed in the database.
+            r = CachedFeed.fetch(*args, max_age=0)
+            assert "This is feed #2" == str(r)
+
+            # Asking for the CachedFeed object itself bypasses the
+            # memory cache, since it can only provide content.
+            feed = CachedFeed.fetch(*args, max_age=1000, raw=True)
+            assert isinstance(feed, CachedFeed)
+            assert "This is feed #2" == feed.content
+
+            # Calling update() on a CachedFeed updates the memory
+            # cache as well.
+            feed.update(self._db, "Updated content")
+            r = CachedFeed.fetch(*args, max_age=1000)
+            assert "Updated content" == str(r)
+        finally:
+            CachedFeed.memory_cache = None
+
+    def test__memory_cache_key(self):
+        # Database objects are replaced with their IDs.
+        work = self._work()
+        keys = CachedFeed.CachedFeedKeys(
+            feed_type="type",
+            library=self._default_library,
+            work=work,
+            lane_id=None,
+            unique_key="key",
+            facets_key="facets",
+            pagination_key="pagination",
+        )
+        memory_key = CachedFeed._memory_cache_key(keys)
+        assert self._default_library.id == memory_key.library
+        assert work.id == memory_key.work
+        assert "type" == memory_key.feed_type
+        assert "pagination" == memory_key.pagination_key
+
+    def test_single_flight(self):
+        # In single-flight mode, a feed is only regenerated by a
+        # process that holds the advisory lock for that feed.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class Mock(CachedFeed):
+            single_flight = True
+            LOCK_AVAILABLE = False
+            lock_calls = []
+
+            # Simulates whatever another process did while this one
+            # was waiting for the lock.
+            while_locked = None
+
+            @classmethod
+            def _acquire_refresh_lock(cls, _db, keys, wait=False):
+                cls.lock_calls.append(wait)
+                if cls.while_locked:
+                    cls.while_locked()
+                return wait or cls.LOCK_AVAILABLE
+
+        # When there's no feed at all, there's nothing stale to serve,
+        # so the process waits for the lock and then generates the feed.
+        feed = Mock.fetch(*args, max_age=1000, raw=True)
+        assert "This is feed #1" == feed.content
+        assert [True] == Mock.lock_calls
+
+        # Now the feed is stale, but someone else holds the lock. We
+        # get the stale feed.
+        feed.timestamp = utc_now() - datetime.timedelta(days=1)
+        feed = Mock.fetch(*args, max_age=1000, raw=True)
+        assert "This is feed #1" == feed.content
+        assert [True, False] == Mock.lock_calls
+        assert 1 == len(refresher.calls)
+
+        # Once the lock is available, the feed is regenerated.
+        Mock.LOCK_AVAILABLE = True
+        feed = Mock.fetch(*args, max_age=1000, raw=True)
+        assert "This is feed #2" == feed.content
+        assert [True, False, False] == Mock.lock_calls
+
+        # But if whoever held the lock stored a fresh feed, that feed
+        # is used instead of generating another one.
+        feed.timestamp = utc_now() - datetime.timedelta(days=1)
+        self._db.flush()
+
+        def someone_else_refreshed():
+            self._db.execute(
+                CachedFeed.__table__.update()
+                .where(CachedFeed.id == feed.id)
+                .values(content="Someone else's feed", timestamp=utc_now())
+            )
+
+        Mock.while_locked = someone_else_refreshed
+        feed = Mock.fetch(*args, max_age=1000, raw=True)
+        assert "Someone else's feed" == feed.content
+        assert 2 == len(refresher.calls)
+        Mock.while_locked = None
+
+        # Ignoring the cache always means regenerating the feed.
+        Mock.LOCK_AVAILABLE = False
+        Mock.lock_calls = []
+        feed = Mock.fetch(*args, max_age=CachedFeed.IGNORE_CACHE)
+        assert "This is feed #3" == str(feed)
+        assert [] == Mock.lock_calls
+
+    def test_ignore_cache_streams_feed(self):
+        # If a feed isn't going to be cached, and it can be streamed,
+        # it's serialized as it's sent rather than all at once.
+        wl = WorkList()
+        wl.initialize(self._default_library)
+
+        class StreamableFeed(object):
+            def stream(self):
+                yield b"<feed>"
+                yield b"</feed>"
+
+            def __str__(self):
+                raise Exception("I should not have been called.")
+
+        response = CachedFeed.fetch(
+            self._db,
+            wl,
+            Facets.default(self._default_library),
+            Pagination.default(),
+            StreamableFeed,
+            max_age=CachedFeed.IGNORE_CACHE,
+        )
+        assert response.is_streamed
+        assert b"<feed></feed>" == response.get_data()
+        assert [] == self._db.query(CachedFeed).all()
+
+    def test_incomplete_feed(self):
+        # A feed that's missing some content because a search timed
+        # out is sent out, but never stored.
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+
+        class IncompleteFeed(object):
+            incomplete = True
+
+            def __str__(self):
+                return "An incomplete feed"
+
+        def fetch(refresher, **kwargs):
+            return CachedFeed.fetch(
+                self._db, wl, facets, pagination, refresher, max_age=600, **kwargs
+            )
+
+        # With nothing else to serve, the incomplete feed is served,
+        # and the client is told not to hold on to it for long.
+        response = fetch(IncompleteFeed)
+        assert "An incomplete feed" == response.get_data(as_text=True)
+        assert CachedFeed.INCOMPLETE_FEED_MAX_AGE == response.max_age
+        assert [] == self._db.query(CachedFeed).all()
+
+        # If there's an older version of the feed, it's served instead
+        # of the incomplete one, and it isn't replaced.
+        feed = fetch(MockFeedGenerator(), raw=True)
+        feed.timestamp = utc_now() - datetime.timedelta(days=1)
+        response = fetch(IncompleteFeed)
+        assert "This is feed #1" == response.get_data(as_text=True)
+        assert CachedFeed.INCOMPLETE_FEED_MAX_AGE == response.max_age
+        assert "This is feed #1" == feed.content
+
+        # The same goes for a feed regenerated in the background.
+        keys = CachedFeed._memory_cache_key(
+            CachedFeed._prepare_keys(self._db, wl, facets, pagination)
+        )
+        job = CachedFeedRefreshJob(keys, lambda _db: IncompleteFeed())
+        job.run(self._db)
+        assert "This is feed #1" == feed.content
+
+    def test__acquire_refresh_lock(self):
+        lane = self._lane()
+        keys = CachedFeed._prepare_keys(self._db, lane, None, None)
+
+        # The lock ID is stable and fits in a Postgres bigint.
+        lock_id = CachedFeed._refresh_lock_id(keys)
+        assert lock_id == CachedFeed._refresh_lock_id(keys)
+        assert -(2 ** 63) <= lock_id < 2 ** 63
+
+        other_keys = keys._replace(pagination_key="other")
+        assert lock_id != CachedFeed._refresh_lock_id(other_keys)
+
+        # Advisory locks are reentrant within a single transaction.
+        assert True == CachedFeed._acquire_refresh_lock(self._db, keys)
+        assert True == CachedFeed._acquire_refresh_lock(self._db, keys)
+        assert True == CachedFeed._acquire_refresh_lock(self._db, keys, wait=True)
+
+    def test_stale_while_revalidate(self):
+        # A stale feed can be served while a new one is generated
+        # by a worker in CachedFeed.refresh_pool.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+
+        class MockPool(object):
+            def __init__(self):
+                self.jobs = []
+
+            def put(self, job):
+                self.jobs.append(job)
+
+        background_calls = []
+
+        def background_refresher(_db):
+            background_calls.append(_db)
+            return "Regenerated in the background."
+
+        def fetch(**kwargs):
+            return CachedFeed.fetch(
+                self._db,
+                wl,
+                facets,
+                pagination,
+                refresher,
+                max_age=60,
+                raw=True,
+                background_refresher=background_refresher,
+                **kwargs
+            )
+
+        pool = MockPool()
+        CachedFeed.refresh_pool = pool
+        try:
+            # The first time, there's nothing to serve, so the feed is
+            # generated immediately.
+            feed = fetch(stale_while_revalidate=600)
+            assert "This is feed #1" == feed.content
+            assert [] == pool.jobs
+
+            # Make the feed stale, but within the window. It's served
+            # as-is, and a refresh job is queued.
+            feed.timestamp = utc_now() - datetime.timedelta(seconds=120)
+            feed = fetch(stale_while_revalidate=600)
+            assert "This is feed #1" == feed.content
+            assert 1 == len(refresher.calls)
+            [job] = pool.jobs
+            assert isinstance(job, CachedFeedRefreshJob)
+            assert self._default_library.id == job.keys.library
+
+            # The same refresh isn't queued twice.
+            fetch(stale_while_revalidate=600)
+            assert 1 == len(pool.jobs)
+
+            # Once the job runs, the feed is updated and another
+            # refresh can be queued.
+            job.run(self._db)
+            assert [self._db] == background_calls
+            assert "Regenerated in the background." == feed.content
+            assert job.keys not in CachedFeed._pending_refreshes
+
+            # A feed that's too stale is regenerated immediately.
+            feed.timestamp = utc_now() - datetime.timedelta(days=1)
+            feed = fetch(stale_while_revalidate=600)
+            assert "This is feed #2" == feed.content
+            assert 1 == len(pool.jobs)
+
+            # So is a stale feed when no window was requested.
+            feed.timestamp = utc_now() - datetime.timedelta(seconds=120)
+            feed = fetch()
+            assert "This is feed #3" == feed.content
+            assert 1 == len(pool.jobs)
+        finally:
+            CachedFeed.refresh_pool = None
+            CachedFeed._pending_refreshes.clear()
+
+    def test__can_revalidate_in_background(self):
+        class MockCachedFeed(object):
+            content = "content"
+
+            def __init__(self, timestamp):
+                self.timestamp = timestamp
+
+        m = CachedFeed._can_revalidate_in_background
+        now = utc_now()
+        two_minutes_old = MockCachedFeed(now - datetime.timedelta(minutes=2))
+
+        # Without a refresh pool, nothing can happen in the background.
+        assert False == m(two_minutes_old, 60, 600)
+
+        CachedFeed.refresh_pool = object()
+        try:
+            assert True == m(two_minutes_old, 60, 600)
+            assert True == m(two_minutes_old, 60, datetime.timedelta(minutes=10))
+
+            # The feed is too old.
+            assert False == m(two_minutes_old, 60, 30)
+
+            # There's no window at all.
+            assert False == m(two_minutes_old, 60, None)
+
+            # There's no feed to serve.
+            assert False == m(None, 60, 600)
+            no_content = MockCachedFeed(now)
+            no_content.content = None
+            assert False == m(no_content, 60, 600)
+
+            # The feed doesn't have a normal expiration time.
+            assert False == m(two_minutes_old, CachedFeed.CACHE_FOREVER, 600)
+            assert False == m(two_minutes_old, CachedFeed.IGNORE_CACHE, 600)
+            assert False == m(two_minutes_old, 0, 600)
+        finally:
+            CachedFeed.refresh_pool = None
+
+    def test__record_request(self):
+        # Requests for a feed are counted in memory, and periodically
+        # added to CachedFeed.request_count.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class Mock(CachedFeed):
+            _request_counts = Counter()
+            _request_counts_flushed_at = None
+
+        feed = Mock.fetch(*args, max_age=1000, raw=True)
+        Mock.fetch(*args, max_age=1000, raw=True)
+        assert 0 == feed.request_count
+        assert 2 == Mock._request_counts[feed.id]
+
+        # Once the flush interval has passed, the next request writes
+        # all the counts to the database.
+        Mock._request_counts_flushed_at -= Mock.REQUEST_COUNT_FLUSH_INTERVAL
+        Mock.fetch(*args, max_age=1000, raw=True)
+        self._db.expire(feed)
+        assert 3 == feed.request_count
+        assert feed.id not in Mock._request_counts
+
+        # If there's a refresh pool, the counts are written by one of
+        # its workers instead.
+        class MockPool(object):
+            def __init__(self):
+                self.jobs = []
+
+            def put(self, job):
+                self.jobs.append(job)
+
+        Mock.refresh_pool = MockPool()
+        Mock._request_counts_flushed_at -= Mock.REQUEST_COUNT_FLUSH_INTERVAL
+        Mock.fetch(*args, max_age=1000, raw=True)
+        [job] = Mock.refresh_pool.jobs
+        assert isinstance(job, CachedFeedRequestCountJob)
+        assert {feed.id: 1} == job.counts
+        assert 0 == len(Mock._request_counts)
+        job.run(self._db)
+        self._db.expire(feed)
+        assert 4 == feed.request_count
+
+        # The counts can also be flushed on demand.
+        Mock.fetch(*args, max_age=1000, raw=True)
+        Mock.flush_request_counts(self._db)
+        self._db.expire(feed)
+        assert 5 == feed.request_count
+        assert 0 == len(Mock._request_counts)
+
+    def test_write_request_counts(self):
+        feeds = []
+        for i in range(3):
+            feed = CachedFeed(
+                type=CachedFeed.PAGE_TYPE, pagination=self._str, content="content"
+            )
+            self._db.add(feed)
+            feeds.append(feed)
+        self._db.flush()
+        one, two, three = feeds
+
+        CachedFeed.write_request_counts(
+            self._db, Counter({one.id: 2, two.id: 2, three.id: 5})
+        )
+        for feed in feeds:
+            self._db.expire(feed)
+        assert [2, 2, 5] == [x.request_count for x in feeds]
+
+    def test_precompressed_content(self):
+        # Feeds can be stored precompressed, along with a content hash.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        # By default, only the content hash is stored.
+        feed = CachedFeed.fetch(*args, max_age=0, raw=True)
+        assert CachedFeed.hash_content("This is feed #1") == feed.content_hash
+        assert None == feed.gzip_content
+        assert {} == feed.precompressed
+
+        class Mock(CachedFeed):
+            precompress_encodings = (CachedFeed.GZIP,)
+
+        feed = Mock.fetch(*args, max_age=0, raw=True)
+        assert b"This is feed #2" == gzip.decompress(feed.gzip_content)
+        assert None == feed.brotli_content
+        assert {"gzip": feed.gzip_content} == feed.precompressed
+
+        # The precompressed content and hash are passed along to the
+        # response.
+        response = Mock.fetch(*args, max_age=1000)
+        assert feed.precompressed == response.precompressed
+        assert feed.content_hash == response.content_hash
+
+        # Updating the feed updates everything derived from its content.
+        feed.update(self._db, "New content")
+        assert b"New content" == gzip.decompress(feed.gzip_content)
+        assert CachedFeed.hash_content("New content") == feed.content_hash
+
+        # The in-process cache holds on to the precompressed content,
+        # so a feed served from memory doesn't have to be compressed
+        # again.
+        class MemoryMock(Mock):
+            memory_cache = CachedFeedMemoryCache()
+
+        MemoryMock.fetch(*args, max_age=1000)
+        [entry] = MemoryMock.memory_cache._entries.values()
+        assert feed.precompressed == entry.precompressed
+        assert entry.size > CachedFeedMemoryCache._size(feed.content)
+
+        response = MemoryMock.fetch(*args, max_age=1000)
+        assert 1 == MemoryMock.memory_cache.hits
+        assert feed.precompressed == response.precompressed
+
+    def test_compress(self):
+        m = CachedFeed.compress
+        assert b"content" == gzip.decompress(m("content", CachedFeed.GZIP))
+        assert b"content" == gzip.decompress(m(b"content", CachedFeed.GZIP))
+        assert None == m("content", "compress")
+
+        # The hash is stable no matter how the content is represented.
+        assert CachedFeed.hash_content("content") == CachedFeed.hash_content(b"content")
+        assert None == CachedFeed.hash_content(None)
+
+    def test_conditional_request(self):
+        # fetch() sets validators on the response, and answers a
+        # conditional request with 304 if the client's copy is current.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        r = CachedFeed.fetch(*args, max_age=1000)
+        feed = self._db.query(CachedFeed).one()
+        etag = '"%s"' % feed.content_hash
+        assert etag == r.headers["ETag"]
+        assert "Last-Modified" in r.headers
+
+        class Mock(CachedFeed):
+            @classmethod
+            def _validators(cls, _db, kwargs):
+                cls.validators_called = True
+                return super(Mock, cls)._validators(_db, kwargs)
+
+        # A matching If-None-Match gets a 304 without loading the feed.
+        Mock.validators_called = False
+        self._db.expire(feed)
+        r = Mock.fetch(*args, max_age=1000, if_none_match=etag)
+        assert 304 == r.status_code
+        assert "" == str(r)
+        assert etag == r.headers["ETag"]
+        assert True == Mock.validators_called
+        assert "content" not in feed.__dict__
+
+        # An If-Modified-Since in the future gets a 304.
+        r = Mock.fetch(
+            *args, max_age=1000, if_modified_since="Fri, 01 Jan 2100 00:00:00 GMT"
+        )
+        assert 304 == r.status_code
+
+        # A non-matching ETag gets the full feed.
+        r = Mock.fetch(*args, max_age=1000, if_none_match='"other"')
+        assert 200 == r.status_code
+        assert "This is feed #1" == str(r)
+
+        # If the feed is stale, it's regenerated, and since the old
+        # ETag doesn't match the new feed, the client gets the new feed.
+        r = Mock.fetch(*args, max_age=0, if_none_match=etag)
+        assert 200 == r.status_code
+        assert "This is feed #2" == str(r)
+
+        # The memory cache can also answer conditional requests.
+        CachedFeed.memory_cache = CachedFeedMemoryCache()
+        try:
+            r = Mock.fetch(*args, max_age=1000)
+            etag = r.headers["ETag"]
+            Mock.validators_called = False
+            r = Mock.fetch(*args, max_age=1000, if_none_match=etag)
+            assert 304 == r.status_code
+            assert False == Mock.validators_called
+        finally:
+            CachedFeed.memory_cache = None
+
     # Tests of helper methods.
 
     def test_feed_type(self):
@@ -649,3 +1190,44 @@ class TestCachedFeed(DatabaseTest):
         # The special constant CACHE_FOREVER means it's always cached.
         feed = CachedFeed.fetch(*args, max_age=CachedFeed.CACHE_FOREVER, raw=True)
         assert "This is feed #2" == feed.content
+
+
+class TestCachedFeedMemoryCache(object):
+    def test_lru_eviction(self):
+        class Mock(CachedFeedMemoryCache):
+            @classmethod
+            def _size(cls, content):
+                return len(content)
+
+        cache = Mock(max_bytes=10)
+        now = utc_now()
+        cache.put("a", "aaaa", now)
+        cache.put("b", "bbbb", now)
+        assert 8 == cache.current_bytes
+
+        # Using 'a' makes 'b' the least recently used entry.
+        assert "aaaa" == cache.get("a").content
+        cache.put("c", "cccc", now)
+        assert "b" not in cache
+        assert "a" in cache
+        assert "c" in cache
+        assert 8 == cache.current_bytes
+        assert 1 == cache.evictions
+
+        # Replacing an entry doesn't count its old size twice.
+        cache.put("c", "cc", now)
+        assert 6 == cache.current_bytes
+
+        # A feed too large to fit is not cached at all.
+        assert None == cache.put("d", "d" * 11, now)
+        assert "d" not in cache
+        assert 6 == cache.current_bytes
+
+        assert None == cache.get("b")
+        assert dict(hits=1, misses=1, evictions=1, entries=2, bytes=6) == cache.stats
+
+        cache.remove("a")
+        assert 2 == cache.current_bytes
+        cache.clear()
+        assert 0 == len(cache)
+        assert 0 == cache.current_bytes
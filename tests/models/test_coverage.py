@@ -427,6 +427,84 @@ class TestCoverageRecord(DatabaseTest):
         assert operation == new_record.operation
         assert "Oh no" == new_record.exception
 
+    def test_bulk_upsert(self):
+        source = DataSource.lookup(self._db, DataSource.GUTENBERG)
+        other_source = DataSource.lookup(self._db, DataSource.OVERDRIVE)
+
+        # An untouched identifier.
+        i1 = self._identifier()
+
+        # An identifier that already has failing coverage. Since the
+        # operation and collection are both NULL, a unique index
+        # can't tell this record apart from a new one.
+        covered = self._identifier()
+        existing = self._coverage_record(
+            covered,
+            source,
+            status=CoverageRecord.TRANSIENT_FAILURE,
+            exception="Uh oh",
+        )
+        original_timestamp = existing.timestamp
+
+        # A record for a different data source, which won't be touched.
+        other = self._coverage_record(
+            covered, other_source, status=CoverageRecord.TRANSIENT_FAILURE
+        )
+
+        # Each identifier can get a different outcome.
+        records = CoverageRecord.bulk_upsert(
+            self._db,
+            [
+                (i1.id, CoverageRecord.PERSISTENT_FAILURE, "Nope"),
+                (covered.id, CoverageRecord.SUCCESS, None),
+            ],
+            source,
+        )
+        assert 2 == len(records)
+
+        # A new record was created for the uncovered identifier.
+        [new_record] = i1.coverage_records
+        assert new_record in records
+        assert source == new_record.data_source
+        assert None == new_record.operation
+        assert None == new_record.collection
+        assert CoverageRecord.PERSISTENT_FAILURE == new_record.status
+        assert "Nope" == new_record.exception
+
+        # The existing record was updated, rather than duplicated, and
+        # the ORM object reflects the change.
+        assert existing in records
+        assert set([existing, other]) == set(covered.coverage_records)
+        assert CoverageRecord.SUCCESS == existing.status
+        assert None == existing.exception
+        assert existing.timestamp > original_timestamp
+        assert CoverageRecord.TRANSIENT_FAILURE == other.status
+
+        # Records for a different operation or collection are distinct.
+        collection = self._default_collection
+        [with_collection] = CoverageRecord.bulk_upsert(
+            self._db,
+            [(covered.id, CoverageRecord.SUCCESS, None)],
+            source,
+            operation="testing",
+            collection=collection,
+        )
+        assert with_collection != existing
+        assert "testing" == with_collection.operation
+        assert collection == with_collection.collection
+
+        # Pending changes made through the ORM are taken into account.
+        i2 = self._identifier()
+        pending, ignore = CoverageRecord.add_for(i2, source)
+        [record] = CoverageRecord.bulk_upsert(
+            self._db, [(i2.id, CoverageRecord.TRANSIENT_FAILURE, "Oops")], source
+        )
+        assert pending == record
+        assert CoverageRecord.TRANSIENT_FAILURE == record.status
+
+        # Nothing to do, nothing returned.
+        assert [] == CoverageRecord.bulk_upsert(self._db, [], source)
+
 
 class TestWorkCoverageRecord(DatabaseTest):
     def test_lookup(self):
@@ -550,3 +628,51 @@ class TestWorkCoverageRecord(DatabaseTest):
         # a different operation.
         assert WorkCoverageRecord.SUCCESS == irrelevant_record.status
         assert irrelevant_record.timestamp < new_timestamp
+
+    def test_bulk_upsert(self):
+        operation = "relevant"
+
+        not_already_covered = self._work()
+        already_covered = self._work()
+        previously_failed, ignore = WorkCoverageRecord.add_for(
+            already_covered,
+            operation,
+            status=WorkCoverageRecord.TRANSIENT_FAILURE,
+        )
+        previously_failed.exception = "Some exception"
+        irrelevant, ignore = WorkCoverageRecord.add_for(
+            already_covered, "irrelevant", status=WorkCoverageRecord.TRANSIENT_FAILURE
+        )
+
+        new_timestamp = utc_now()
+        records = WorkCoverageRecord.bulk_upsert(
+            self._db,
+            [
+                (not_already_covered.id, WorkCoverageRecord.SUCCESS, None),
+                (
+                    already_covered.id,
+                    WorkCoverageRecord.PERSISTENT_FAILURE,
+                    "Still broken",
+                ),
+            ],
+            operation,
+            new_timestamp,
+        )
+        assert 2 == len(records)
+
+        # A new record was created.
+        [new_record] = not_already_covered.coverage_records
+        assert new_record in records
+        assert operation == new_record.operation
+        assert WorkCoverageRecord.SUCCESS == new_record.status
+        assert new_timestamp == new_record.timestamp
+
+        # The existing record was updated.
+        assert previously_failed in records
+        assert WorkCoverageRecord.PERSISTENT_FAILURE == previously_failed.status
+        assert "Still broken" == previously_failed.exception
+        assert new_timestamp == previously_failed.timestamp
+
+        # The record for a different operation was left alone.
+        assert WorkCoverageRecord.TRANSIENT_FAILURE == irrelevant.status
+        assert irrelevant.timestamp < new_timestamp
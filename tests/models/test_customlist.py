@@ -7,6 +7,7 @@ from ...model import get_one_or_create
 from ...model.coverage import WorkCoverageRecord
 from ...model.customlist import CustomList, CustomListEntry
 from ...model.datasource import DataSource
+from ...model.work import Work
 from ...testing import DatabaseTest
 from ...util.datetime_helpers import utc_now
 
@@ -49,11 +50,15 @@ class TestCustomList(DatabaseTest):
 
     def assert_reindexing_scheduled(self, work):
         """Assert that the given work has exactly one WorkCoverageRecord, which
-        indicates that it needs to have its search index updated.
+        indicates that the customlists part of its search document needs
+        to be updated.
         """
         [needs_reindex] = work.coverage_records
         assert (
-            WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION == needs_reindex.operation
+            WorkCoverageRecord.search_index_fragment_operation(
+                Work.CUSTOMLISTS_FRAGMENT
+            )
+            == needs_reindex.operation
         )
         assert WorkCoverageRecord.REGISTERED == needs_reindex.status
 
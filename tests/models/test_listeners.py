@@ -8,7 +8,12 @@ from ...config import Configuration
 from ...model import (
     CachedFeed,
     ConfigurationSetting,
+    Contributor,
+    DataSource,
+    Genre,
+    Subject,
     Timestamp,
+    Work,
     WorkCoverageRecord,
     create,
     site_configuration_has_changed,
@@ -229,7 +234,51 @@ class TestListeners(DatabaseTest):
         assert 1 == len(work.coverage_records)
         assert work.id == work.coverage_records[0].work_id
         assert (
-            WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            WorkCoverageRecord.search_index_fragment_operation(
+                Work.LICENSEPOOLS_FRAGMENT
+            )
             == work.coverage_records[0].operation
         )
         assert WorkCoverageRecord.REGISTERED == work.coverage_records[0].status
+
+    def test_search_document_fragment_changes(self):
+        work = self._work(with_license_pool=True)
+        [pool] = work.license_pools
+        operation = WorkCoverageRecord.search_index_fragment_operation
+
+        def registered():
+            operations = set(
+                x.operation
+                for x in work.coverage_records
+                if x.status == WorkCoverageRecord.REGISTERED
+            )
+            work.coverage_records = []
+            self._db.flush()
+            return operations
+
+        registered()
+
+        # A new contributor for the presentation edition.
+        work.presentation_edition.add_contributor("A Writer", Contributor.AUTHOR_ROLE)
+        assert operation(Work.CONTRIBUTORS_FRAGMENT) in registered()
+
+        # A new genre, and a change to an existing genre's affinity.
+        genre, ignore = Genre.lookup(self._db, "Romance")
+        work.genres = [genre]
+        assert operation(Work.GENRES_FRAGMENT) in registered()
+        [work_genre] = work.work_genres
+        work_genre.affinity = 0.5
+        assert operation(Work.GENRES_FRAGMENT) in registered()
+
+        # A new classification for the work's identifier, and a change
+        # to its weight. The classifications are part of the
+        # identifiers fragment.
+        source = DataSource.lookup(self._db, DataSource.OVERDRIVE)
+        classification = pool.identifier.classify(source, Subject.TAG, "A tag")
+        assert operation(Work.IDENTIFIERS_FRAGMENT) in registered()
+        classification.weight = 100
+        assert operation(Work.IDENTIFIERS_FRAGMENT) in registered()
+
+        # Setting a value to what it already was does nothing.
+        classification.weight = 100
+        assert set() == registered()
@@ -1326,6 +1326,36 @@ class TestWork(DatabaseTest):
             [x["collection_id"] for x in search_doc["licensepools"]]
         )
 
+    def test_to_search_documents_fragments(self):
+        work = self._work(with_license_pool=True, genre="Fantasy")
+        full = work.to_search_document()
+
+        # Only the requested fragments of the document are generated.
+        [doc] = Work.to_search_documents([work], fragments=["licensepools"])
+        assert set(["_id", "work_id", "licensepools", "last_update_time"]) == set(
+            doc.keys()
+        )
+        for key, value in list(doc.items()):
+            assert full[key] == value
+
+        [doc] = Work.to_search_documents(
+            [work], fragments=["genres", "identifiers", "customlists"]
+        )
+        assert (
+            set(
+                [
+                    "_id",
+                    "work_id",
+                    "genres",
+                    "identifiers",
+                    "classifications",
+                    "customlists",
+                ]
+            )
+            == set(doc.keys())
+        )
+        assert full["genres"] == doc["genres"]
+
     def test_age_appropriate_for_patron(self):
         work = self._work()
         work.audience = Classifier.AUDIENCE_YOUNG_ADULT
@@ -1474,19 +1504,15 @@ class TestWork(DatabaseTest):
 
     def test_reindex_on_availability_change(self):
         # A change in a LicensePool's availability creates a
-        # WorkCoverageRecord indicating that the work needs to be
-        # re-indexed.
-        def find_record(work):
-            """Find the Work's 'update search index operation'
-            WorkCoverageRecord.
-            """
-            records = [
-                x
-                for x in work.coverage_records
-                if x.operation.startswith(
-                    WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
-                )
-            ]
+        # WorkCoverageRecord indicating that the licensepools part of
+        # the work's search document needs to be regenerated.
+        licensepools = WorkCoverageRecord.search_index_fragment_operation(
+            Work.LICENSEPOOLS_FRAGMENT
+        )
+
+        def find_record(work, operation=licensepools):
+            """Find one of the Work's search index WorkCoverageRecords."""
+            records = [x for x in work.coverage_records if x.operation == operation]
             if records:
                 return records[0]
             return None
@@ -1522,11 +1548,18 @@ class TestWork(DatabaseTest):
         # If its last_update_time is changed, it needs to be
         # reindexed. (This happens whenever
         # LicensePool.update_availability is called, meaning that
-        # patron transactions always trigger a reindex).
+        # patron transactions always trigger a reindex of the
+        # licensepools part of the search document).
         record.status = success
         work.last_update_time = utc_now()
         assert registered == record.status
 
+        # None of these changes required the whole search document to
+        # be regenerated.
+        assert None == find_record(
+            work, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
+
         # If its collection changes (which shouldn't happen), it needs
         # to be reindexed.
         record.status = success
@@ -1535,11 +1568,11 @@ class TestWork(DatabaseTest):
         assert registered == record.status
 
         # If a LicensePool is deleted (which also shouldn't happen),
-        # its former Work needs to be reindexed.
+        # its former Work needs to be completely reindexed.
         record.status = success
         self._db.delete(pool)
         work = self._db.query(Work).filter(Work.id == work.id).one()
-        record = find_record(work)
+        record = find_record(work, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION)
         assert registered == record.status
 
         # If a LicensePool is moved in from another Work, _both_ Works
@@ -1554,6 +1587,45 @@ class TestWork(DatabaseTest):
             record = find_record(work)
             assert registered == record.status
 
+    def test_search_index_fragment_needs_updating(self):
+        WCR = WorkCoverageRecord
+        work = self._work()
+        work.coverage_records = []
+
+        # Registering a fragment creates a WorkCoverageRecord for
+        # that fragment in the REGISTERED state.
+        [record] = work.search_index_fragment_needs_updating(Work.CUSTOMLISTS_FRAGMENT)
+        assert WCR.search_index_fragment_operation("customlists") == record.operation
+        assert WCR.REGISTERED == record.status
+        assert [record] == work.coverage_records
+
+        # Once the whole document needs to be regenerated, the
+        # pending fragment is no longer needed.
+        full = work.external_index_needs_updating()
+        assert [full] == work.coverage_records
+
+        # And no new fragments are registered until the whole document
+        # has been regenerated.
+        assert [] == work.search_index_fragment_needs_updating(
+            Work.LICENSEPOOLS_FRAGMENT, Work.GENRES_FRAGMENT
+        )
+        assert [full] == work.coverage_records
+
+        full.status = WCR.SUCCESS
+        records = work.search_index_fragment_needs_updating(
+            Work.LICENSEPOOLS_FRAGMENT, Work.GENRES_FRAGMENT
+        )
+        assert [
+            WCR.search_index_fragment_operation("licensepools"),
+            WCR.search_index_fragment_operation("genres"),
+        ] == [x.operation for x in records]
+
+        # Fragments that were already regenerated aren't affected
+        # by a full reindex.
+        records[0].status = WCR.SUCCESS
+        work.external_index_needs_updating()
+        assert set([full, records[0]]) == set(work.coverage_records)
+
     def test_reset_coverage(self):
         # Test the methods that reset coverage for works, indicating
         # that some task needs to be performed again.
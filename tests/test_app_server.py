@@ -15,7 +15,10 @@ from ..app_server import (
     URNLookupController,
     URNLookupHandler,
     compressible,
+    gzip_stream,
+    load_conditional_request_headers,
     load_facets_from_request,
+    load_feed_class_from_request,
     load_pagination_from_request,
 )
 from ..config import Configuration
@@ -23,10 +26,12 @@ from ..entrypoint import AudiobooksEntryPoint, EbooksEntryPoint, EntryPoint
 from ..lane import Facets, Pagination, SearchFacets, WorkList
 from ..log import LogConfiguration
 from ..model import ConfigurationSetting, Identifier
-from ..opds import TestAnnotator
+from ..opds import AcquisitionFeed, TestAnnotator
+from ..opds2 import OPDS2Feed
 from ..problem_details import INVALID_INPUT, INVALID_URN
 from ..testing import DatabaseTest
-from ..util.opds_writer import OPDSFeed, OPDSMessage
+from ..util.flask_util import Response
+from ..util.opds_writer import AtomFeed, OPDSFeed, OPDSMessage
 
 
 class TestHeartbeatController(object):
@@ -544,3 +549,129 @@ class TestCompressibleAnnotator(object):
         response = ask_for_compression("gzip", "Accept-Transfer-Encoding")
         assert value == response.data
         assert "Content-Encoding" not in response.headers
+
+    def test_compressible_precompressed(self):
+        # If a response carries precompressed representations, the
+        # @compressible annotator sends one of those instead of
+        # compressing the body itself.
+        value = b"Compress me!"
+        precompressed = {"gzip": b"pretend gzip", "br": b"pretend brotli"}
+
+        @compressible
+        def function():
+            return value
+
+        def ask_for_compression(compression, content_hash="hash", available=None):
+            headers = {}
+            if compression:
+                headers["Accept-Encoding"] = compression
+            if available is None:
+                available = precompressed
+            with self.app.test_request_context(headers=headers):
+                response = Response(
+                    function(), precompressed=available, content_hash=content_hash
+                )
+                self.app.process_response(response)
+                return response
+
+        # Brotli is preferred if the client accepts it.
+        response = ask_for_compression("gzip, deflate, br")
+        assert b"pretend brotli" == response.data
+        assert "br" == response.headers["Content-Encoding"]
+        assert '"hash-br"' == response.headers["ETag"]
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+        response = ask_for_compression("gzip")
+        assert b"pretend gzip" == response.data
+        assert "gzip" == response.headers["Content-Encoding"]
+        assert '"hash-gzip"' == response.headers["ETag"]
+
+        # Without a content hash, no ETag is sent.
+        response = ask_for_compression("gzip", content_hash=None)
+        assert b"pretend gzip" == response.data
+        assert "ETag" not in response.headers
+
+        # If the client accepts an encoding that wasn't precompressed,
+        # the body is compressed as usual. Since that representation
+        # isn't reproducible, its ETag is weakened.
+        response = ask_for_compression("gzip", available={"br": b"pretend brotli"})
+        assert value == gzip.decompress(response.data)
+        assert 'W/"hash"' == response.headers["ETag"]
+
+        # If the client doesn't accept any encoding, the body is sent
+        # uncompressed.
+        response = ask_for_compression(None)
+        assert value == response.data
+        assert "Content-Encoding" not in response.headers
+
+    def test_compressible_streamed(self):
+        # A streamed response is compressed as it's sent, rather than
+        # being loaded into memory first.
+        chunks = [b"Compress ", b"me ", b"as I go."]
+
+        @compressible
+        def function():
+            return iter(chunks)
+
+        with self.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = Response(function(), content_hash="hash")
+            assert response.is_streamed
+            self.app.process_response(response)
+            assert response.is_streamed
+            assert "gzip" == response.headers["Content-Encoding"]
+            assert 'W/"hash"' == response.headers["ETag"]
+            assert b"".join(chunks) == gzip.decompress(response.get_data())
+
+        # gzip_stream turns a sequence of chunks into a valid gzip file.
+        assert b"".join(chunks) == gzip.decompress(b"".join(gzip_stream(chunks)))
+
+
+class TestLoadFeedClassFromRequest(object):
+    def test_load_feed_class_from_request(self):
+        app = Flask(__name__)
+
+        def feed_class(accept):
+            headers = {}
+            if accept:
+                headers["Accept"] = accept
+            with app.test_request_context(headers=headers):
+                cls = load_feed_class_from_request()
+                response = app.process_response(flask.Response("feed"))
+                assert "Accept" in response.headers["Vary"]
+                return cls
+
+        # OPDS 1 is the default.
+        assert AcquisitionFeed == feed_class(None)
+        assert AcquisitionFeed == feed_class("*/*")
+        assert AcquisitionFeed == feed_class(
+            "%s, %s;q=0.5" % (OPDSFeed.ACQUISITION_FEED_TYPE, OPDS2Feed.MEDIA_TYPE)
+        )
+
+        # But a client that prefers OPDS 2.0 gets it.
+        assert OPDS2Feed == feed_class(OPDS2Feed.MEDIA_TYPE)
+        assert OPDS2Feed == feed_class(
+            "%s;q=0.5, %s" % (AtomFeed.ATOM_TYPE, OPDS2Feed.MEDIA_TYPE)
+        )
+
+
+class TestLoadConditionalRequestHeaders(object):
+    def test_load_conditional_request_headers(self):
+        app = Flask(__name__)
+        headers = {
+            "If-None-Match": '"abcd"',
+            "If-Modified-Since": "Sat, 02 Jan 2021 03:04:05 GMT",
+        }
+        with app.test_request_context(headers=headers):
+            assert (
+                dict(
+                    if_none_match='"abcd"',
+                    if_modified_since="Sat, 02 Jan 2021 03:04:05 GMT",
+                )
+                == load_conditional_request_headers()
+            )
+
+        with app.test_request_context():
+            assert (
+                dict(if_none_match=None, if_modified_since=None)
+                == load_conditional_request_headers()
+            )
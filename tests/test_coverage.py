@@ -1,4 +1,5 @@
 import datetime
+import threading
 
 import pytest
 
@@ -54,6 +55,7 @@ from ..testing import (
     AlwaysSuccessfulWorkCoverageProvider,
     DatabaseTest,
     DummyHTTPClient,
+    MockCoverageProvider,
     NeverSuccessfulBibliographicCoverageProvider,
     NeverSuccessfulCoverageProvider,
     NeverSuccessfulWorkCoverageProvider,
@@ -421,9 +423,11 @@ class TestBaseCoverageProvider(CoverageProviderTest):
 
         # The offset (an extension specific to
         # CoverageProviderProgress, not stored in the database)
-        # has not changed -- if we were to call run_once again we
-        # would not need to skip any records.
+        # has not changed. Instead, the progress object remembers the
+        # last item processed, and if we were to call run_once again
+        # it would pick up after that item.
         assert 0 == progress.offset
+        assert uncovered.id == progress.last_id
 
         # Various internal totals were updated and a value for .achievements
         # can be generated from those totals.
@@ -451,7 +455,10 @@ class TestBaseCoverageProvider(CoverageProviderTest):
         assert covered not in provider.attempts
 
         # We can change which identifiers get processed by changing
-        # what counts as 'coverage'.
+        # what counts as 'coverage'. As run_once_and_update_timestamp
+        # does, we start again from the beginning of the table when
+        # we do this.
+        progress.last_id = None
         result = provider.run_once(progress, count_as_covered=[CoverageRecord.SUCCESS])
         assert progress == result
         assert 0 == progress.offset
@@ -461,7 +468,11 @@ class TestBaseCoverageProvider(CoverageProviderTest):
         assert covered not in provider.attempts
 
         # Let's call it again and say that we are covering everything
-        # _except_ persistent failures.
+        # _except_ persistent failures. This time we'll skip the first
+        # item by giving an offset, as
+        # RunThreadedCollectionCoverageProviderScript does.
+        progress.last_id = None
+        progress.offset = 1
         result = provider.run_once(
             progress, count_as_covered=[CoverageRecord.PERSISTENT_FAILURE]
         )
@@ -471,10 +482,28 @@ class TestBaseCoverageProvider(CoverageProviderTest):
         # successfully covered.
         assert covered in provider.attempts
 
-        # *Now* the offset has changed, so that the first four results
-        # -- which we've decided to skip -- won't be considered again
-        # this run.
+        # When there's an offset, the offset is what changes, so that
+        # the first four results -- one we skipped and three we've
+        # decided to skip -- won't be considered again this run.
         assert 4 == progress.offset
+        assert None == progress.last_id
+
+    def test_next_batch(self):
+        provider = AlwaysSuccessfulCoverageProvider(self._db, batch_size=2)
+        i1 = self._identifier()
+        i2 = self._identifier()
+        covered = self._identifier()
+        i3 = self._identifier()
+        provider.add_coverage_record_for(covered)
+
+        # Batches are taken in order of ID, picking up after the last
+        # item processed, and skipping items that are already covered.
+        progress = CoverageProviderProgress()
+        assert [i1, i2] == provider.next_batch(progress)
+        progress.last_id = i2.id
+        assert [i3] == provider.next_batch(progress)
+        progress.last_id = i3.id
+        assert [] == provider.next_batch(progress)
 
     def test_run_once_records_successes_and_failures(self):
         class Mock(AlwaysSuccessfulCoverageProvider):
@@ -507,6 +536,72 @@ class TestBaseCoverageProvider(CoverageProviderTest):
             == progress.achievements
         )
 
+    def test_claim_batch(self):
+        provider = AlwaysSuccessfulCoverageProvider(self._db, batch_size=2)
+        i1 = self._identifier()
+        i2 = self._identifier()
+        i3 = self._identifier()
+
+        # No more than batch_size items are claimed.
+        batch = provider.claim_batch()
+        assert 2 == len(batch)
+        assert set(batch) < set([i1, i2, i3])
+
+        # An item that already has coverage isn't claimed.
+        provider.add_coverage_record_for(i1)
+        provider.add_coverage_record_for(i2)
+        assert [i3] == provider.claim_batch()
+
+        # Neither is an item whose coverage was attempted at or after
+        # `attempted_before`, even if it counts as not covered.
+        start = utc_now()
+        failure = provider.failure(i3, "oops", transient=True)
+        record = provider.record_failure_as_coverage_record(failure)
+        record.timestamp = start - datetime.timedelta(days=1)
+        assert [i3] == provider.claim_batch(attempted_before=start)
+        record.timestamp = start
+        assert [] == provider.claim_batch(attempted_before=start)
+
+        # The items are locked and looked up again as whatever kind of
+        # object the query finds, which isn't necessarily ITEM_CLASS.
+        class OtherItemClass(AlwaysSuccessfulCoverageProvider):
+            ITEM_CLASS = Work
+
+        provider = OtherItemClass(self._db, batch_size=2)
+        i4 = self._identifier()
+        assert i4 in provider.claim_batch()
+
+    def test_run_once_claiming_batches(self):
+        # A provider that claims its batches doesn't need to keep
+        # track of an offset; items it has attempted during this run
+        # aren't claimed again.
+        provider = TransientFailureCoverageProvider(
+            self._db, batch_size=1, claim_batches=True
+        )
+        i1 = self._identifier()
+        i2 = self._identifier()
+
+        progress = CoverageProviderProgress(start=utc_now())
+        provider.run_once(progress)
+        provider.run_once(progress)
+        assert 2 == progress.transient_failures
+        assert 0 == progress.offset
+        assert False == progress.is_complete
+
+        # Now there's nothing left to claim, even though both items
+        # still need coverage.
+        provider.run_once(progress)
+        assert True == progress.is_complete
+        assert 2 == progress.transient_failures
+
+        # The whole run finishes, rather than retrying the transient
+        # failures forever.
+        provider.run_once_and_update_timestamp()
+        assert [] == provider.claim_batch(
+            count_as_covered=CoverageRecord.DEFAULT_COUNT_AS_COVERED,
+            attempted_before=progress.start,
+        )
+
     def test_process_batch_and_handle_results(self):
         """Test that process_batch_and_handle_results passes the identifiers
         its given into the appropriate BaseCoverageProvider, and deals
@@ -1277,6 +1372,42 @@ class TestIdentifierCoverageProvider(CoverageProviderTest):
     def test_record_failure_as_coverage_record(self):
         """TODO: We need test coverage here."""
 
+    def test_record_failures_as_coverage_records(self):
+        provider = AlwaysSuccessfulCoverageProvider(self._db)
+        edition = self._edition()
+        identifier = self._identifier()
+        other_source = DataSource.lookup(self._db, DataSource.OVERDRIVE)
+
+        # Failures for different data sources are written as different
+        # groups, but they all come back together.
+        failures = [
+            provider.failure(edition, "oops", transient=True),
+            CoverageFailure(
+                identifier, "bad", data_source=other_source, transient=False
+            ),
+        ]
+        records = provider.record_failures_as_coverage_records(failures)
+        by_identifier = dict((x.identifier, x) for x in records)
+        assert set([edition.primary_identifier, identifier]) == set(by_identifier)
+
+        record = by_identifier[edition.primary_identifier]
+        assert provider.data_source == record.data_source
+        assert provider.operation == record.operation
+        assert CoverageRecord.TRANSIENT_FAILURE == record.status
+        assert "oops" == record.exception
+
+        record = by_identifier[identifier]
+        assert other_source == record.data_source
+        assert CoverageRecord.PERSISTENT_FAILURE == record.status
+        assert "bad" == record.exception
+
+        # A failure with no data source can't become a CoverageRecord.
+        with pytest.raises(Exception) as excinfo:
+            provider.record_failures_as_coverage_records(
+                [CoverageFailure(identifier, "no source")]
+            )
+        assert "it has no output source" in str(excinfo.value)
+
     def test_failure(self):
         provider = AlwaysSuccessfulCollectionCoverageProvider(self._default_collection)
         identifier = self._identifier()
@@ -1975,6 +2106,88 @@ class TestBibliographicCoverageProvider(CoverageProviderTest):
         assert CoverageRecord.TRANSIENT_FAILURE == result.status
         assert False == self.work.presentation_ready
 
+    def test_process_batch_fetches_concurrently(self):
+        class Mock(MockCoverageProvider, BibliographicCoverageProvider):
+            FETCH_THREADS = 3
+
+            def __init__(self, *args, **kwargs):
+                super(Mock, self).__init__(*args, **kwargs)
+                self.fetch_threads = set()
+                self.processed = []
+
+            def fetch(self, identifier):
+                self.fetch_threads.add(threading.current_thread())
+                if identifier.identifier == "fail":
+                    raise Exception("oops")
+                with self.throttle.request("http://example.com/"):
+                    return "data for %s" % identifier.identifier
+
+            def process_fetched(self, identifier, data):
+                self.processed.append((identifier, data, threading.current_thread()))
+                return identifier
+
+        provider = Mock(self.pool.collection)
+        fail = self._identifier(foreign_id="fail")
+        success, failure = provider.process_batch([self.identifier, fail])
+
+        # The fetches happened in worker threads.
+        assert threading.current_thread() not in provider.fetch_threads
+
+        # The successful fetch was processed in this thread, and the
+        # Identifier was made presentation-ready.
+        assert self.identifier == success
+        assert [
+            (
+                self.identifier,
+                "data for %s" % self.identifier.identifier,
+                threading.current_thread(),
+            )
+        ] == provider.processed
+        assert True == self.work.presentation_ready
+
+        # The exception raised by fetch() became a transient failure.
+        assert isinstance(failure, CoverageFailure)
+        assert fail == failure.obj
+        assert True == failure.transient
+        assert "oops" in failure.exception
+
+        # With only one thread, each Identifier is fetched and
+        # processed by process_item().
+        provider = Mock(self.pool.collection)
+        provider.FETCH_THREADS = 1
+        assert [self.identifier] == provider.process_batch([self.identifier])
+        assert set([threading.current_thread()]) == provider.fetch_threads
+        assert 1 == len(provider.processed)
+
+        # A provider that asks for threads but doesn't implement
+        # fetch() finds out before any work is handed to the pool.
+        class NoFetch(MockCoverageProvider, BibliographicCoverageProvider):
+            FETCH_THREADS = 3
+
+        provider = NoFetch(self.pool.collection)
+        with pytest.raises(NotImplementedError):
+            provider.process_batch([self.identifier])
+        assert None == provider._fetch_pool
+
+    def test__fetch(self):
+        # In a worker thread, _fetch() only captures what fetch()
+        # returned or raised; it doesn't create a CoverageFailure,
+        # since that would use the database session.
+        class Mock(MockCoverageProvider, BibliographicCoverageProvider):
+            def fetch(self, identifier):
+                if identifier.identifier == "fail":
+                    raise ValueError("oops")
+                return "data"
+
+            def failure(self, *args, **kwargs):
+                raise Exception("I should not be called.")
+
+        provider = Mock(self.pool.collection)
+        assert ("data", None) == provider._fetch(self.identifier)
+        result, exception = provider._fetch(self._identifier(foreign_id="fail"))
+        assert None == result
+        assert isinstance(exception, ValueError)
+
 
 class TestWorkCoverageProvider(DatabaseTest):
     def setup_method(self):
@@ -1,9 +1,10 @@
 # encoding: utf-8
+import datetime
 import json
 import logging
 import re
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import pytest
 from elasticsearch.exceptions import ElasticsearchException
@@ -35,8 +36,14 @@ from ..external_search import (
     Query,
     QueryParser,
     SearchBase,
+    SearchHistogram,
     SearchIndexCoverageProvider,
+    SearchIndexFragmentCoverageProvider,
+    SearchIndexPipeline,
+    SearchMetrics,
+    SearchResultCache,
     SortKeyPagination,
+    TimedOutSearchResults,
     WorkSearchResult,
     mock_search_index,
 )
@@ -50,13 +57,14 @@ from ..model import (
     Edition,
     ExternalIntegration,
     Genre,
+    SessionManager,
     Work,
     WorkCoverageRecord,
     get_one_or_create,
 )
 from ..problem_details import INVALID_INPUT
 from ..testing import DatabaseTest, EndToEndSearchTest, ExternalSearchTest
-from ..util.datetime_helpers import datetime_utc, from_timestamp
+from ..util.datetime_helpers import datetime_utc, from_timestamp, utc_now
 
 RESEARCH = Term(audience=Classifier.AUDIENCE_RESEARCH.lower())
 
@@ -88,6 +96,50 @@ class TestExternalSearch(ExternalSearchTest):
         assert self._db == index.set_works_index_and_alias_called_with
         assert "test_search_term" == index.test_search_term
 
+        # The lifetime of the search result cache is also taken from
+        # the ExternalIntegration.
+        assert ExternalSearchIndex.DEFAULT_RESULT_CACHE_TTL == index.result_cache.ttl
+        setting = self.integration.setting(ExternalSearchIndex.RESULT_CACHE_TTL_KEY)
+        setting.value = "30"
+        index = MockIndex(self._db)
+        assert 30 == index.result_cache.ttl
+
+        # Every index object in the process shares the same cache, so
+        # clearing it through one clears it for all of them.
+        index.result_cache.set("key", ["result"])
+        other = MockIndex(self._db)
+        assert index.result_cache is other.result_cache
+        other.clear_result_cache()
+        assert None == index.result_cache.get("key")
+
+        # A lifetime of zero disables the cache.
+        setting.value = "0"
+        index = MockIndex(self._db)
+        assert None == index.result_cache
+
+        # A cache can also be passed in.
+        cache = SearchResultCache()
+        index = MockIndex(self._db, result_cache=cache)
+        assert cache == index.result_cache
+
+        # By default, searches are measured but none are considered slow.
+        assert isinstance(index.metrics, SearchMetrics)
+        assert None == index.metrics.slow_threshold
+        assert False == index.metrics.measure_sizes
+
+        # The slow search threshold is taken from the ExternalIntegration.
+        self.integration.setting(
+            ExternalSearchIndex.SLOW_SEARCH_THRESHOLD_KEY
+        ).value = "2.5"
+        index = MockIndex(self._db)
+        assert 2.5 == index.metrics.slow_threshold
+        assert True == index.metrics.measure_sizes
+
+        # A SearchMetrics can also be passed in.
+        metrics = SearchMetrics()
+        index = MockIndex(self._db, metrics=metrics)
+        assert metrics == index.metrics
+
     # TODO: would be good to check the put_script calls, but the
     # current constructor makes put_script difficult to mock.
 
@@ -228,6 +280,65 @@ class TestExternalSearch(ExternalSearchTest):
             ValueError, self.search.transfer_current_alias, self._db, "banana-v10"
         )
 
+    def test_rebuilt_index(self):
+        original_index = self.search.works_index
+        new_index = self.search.rebuild_index_name(self._db)
+        assert new_index.startswith(original_index + "-")
+
+        # A rebuilt index is in series with the original index, so the
+        # alias can be moved onto it.
+        assert self.search.base_index_name(
+            original_index
+        ) == self.search.base_index_name(new_index)
+        self.setup_index(new_index)
+        self.search.transfer_current_alias(self._db, new_index)
+        assert new_index == self.search.current_alias_index(self._db)
+
+        # From then on, the rebuilt index is used instead of the
+        # original.
+        self.search.set_works_index_and_alias(self._db)
+        assert new_index == self.search.works_index
+        assert "test_index-current" == self.search.works_alias
+
+        # Other index objects in this process don't need to ask
+        # Elasticsearch where the alias points.
+        class Mock(ExternalSearchIndex):
+            def current_alias_index(self, _db):
+                raise Exception("Alias was looked up again.")
+
+        other = Mock(self._db)
+        assert new_index == other.works_index
+
+    def test_bulk_load(self):
+        work = self.default_work(title="A title")
+        original_index = self.search.works_index
+        self.search.bulk_update([work])
+        self.search.indices.refresh(index=original_index)
+
+        new_index = self.search.rebuild_index_name(self._db)
+        self.search.setup_index(new_index, **self.search.BULK_LOAD_SETTINGS)
+        self.indexes.append(new_index)
+        assert dict(refresh_interval="-1") == self.search.index_settings(
+            new_index, ["refresh_interval"]
+        )
+
+        # The new index is missing a document.
+        self.search.indices.refresh(index=new_index)
+        count_problem, missing_problem = self.search.compare_indexes(
+            new_index, original_index
+        )
+        assert "%s contains 0 documents" % new_index in count_problem
+        assert "Document %s is missing" % work.id in missing_problem
+
+        self.search.works_index = new_index
+        self.search.bulk_update([work])
+        self.search.works_index = original_index
+        self.search.finish_bulk_load(new_index, dict(refresh_interval="2s"))
+        assert dict(refresh_interval="2s") == self.search.index_settings(
+            new_index, ["refresh_interval"]
+        )
+        assert [] == self.search.compare_indexes(new_index, original_index)
+
     def test_query_works(self):
         # Verify that query_works operates by calling query_works_multi.
         # The actual functionality of query_works and query_works_multi
@@ -237,8 +348,9 @@ class TestExternalSearch(ExternalSearchTest):
                 self.query_works_multi_calls = []
                 self.queued_results = []
 
-            def query_works_multi(self, queries, debug=False):
+            def query_works_multi(self, queries, debug=False, fields=None):
                 self.query_works_multi_calls.append((queries, debug))
+                self.fields = fields
                 return self.queued_results.pop()
 
         search = Mock()
@@ -262,6 +374,13 @@ class TestExternalSearch(ExternalSearchTest):
         call = search.query_works_multi_calls.pop()
         assert ([(query, filter, pagination)], False) == call
         assert [] == search.query_works_multi_calls
+        assert None == search.fields
+
+        # Any fields the caller needs are passed along.
+        search.queued_results.append([["r1"]])
+        search.query_works(query, filter, pagination, fields=["language"])
+        search.query_works_multi_calls.pop()
+        assert ["language"] == search.fields
 
         # If no Pagination object is provided, a default is used.
         search.queued_results.append([["r3", "r4"]])
@@ -355,6 +474,170 @@ class TestExternalSearch(ExternalSearchTest):
         assert {collection.name: 1} == result
 
 
+class TestRunMultiSearches(object):
+    def test_run_multi_searches(self):
+        index = MockExternalSearchIndex()
+        index.SEARCH_TIMEOUT_GRACE = 0
+        calls = []
+
+        def multi_search(searches, timeout=None, lanes=None):
+            calls.append((searches, timeout))
+            if "slow" in searches:
+                time.sleep(0.5)
+            if "broken" in searches:
+                raise Exception("Search failed!")
+            return ["results for %s" % x for x in searches]
+
+        index._multi_search = multi_search
+
+        # A single batch is run as a single request.
+        assert [["results for a"]] == index._run_multi_searches([[(0, "a")]])
+        assert [(["a"], None)] == calls
+
+        # Several batches are run in parallel.
+        batches = [[(0, "a"), (1, "b")], [(2, "c")]]
+        assert [["results for a", "results for b"], ["results for c"]] == (
+            index._run_multi_searches(batches)
+        )
+
+        # A batch that doesn't finish in time is represented by None.
+        batches = [[(0, "a")], [(1, "slow")]]
+        assert [["results for a"], None] == index._run_multi_searches(
+            batches, timeout=0.1
+        )
+        assert 0.1 == calls[-1][1]
+
+        # An exception raised by a batch is raised again in the
+        # calling thread.
+        with pytest.raises(Exception) as excinfo:
+            index._run_multi_searches([[(0, "a")], [(1, "broken")]])
+        assert "Search failed!" in str(excinfo.value)
+
+
+class TestSearchResultCache(object):
+    def test_key(self):
+        key = SearchResultCache.key
+        search = dict(query=dict(match_all={}), size=10, _source=["work_id"])
+
+        # The key doesn't depend on the order of the keys in the
+        # search dictionary...
+        reordered = dict(_source=["work_id"], size=10, query=dict(match_all={}))
+        assert key("index", search) == key("index", reordered)
+
+        # ...but it does depend on their values, and on the index.
+        assert key("index", search) != key("index", dict(search, size=20))
+        assert key("index", search) != key("other-index", search)
+
+    def test_get_and_set(self):
+        cache = SearchResultCache(size=2, ttl=60)
+        assert None == cache.get("a")
+        cache.set("a", ["result a"])
+        cache.set("b", ["result b"])
+        assert ["result a"] == cache.get("a")
+        assert (1, 1) == (cache.hits, cache.misses)
+
+        # When the cache is full, the oldest entry is dropped.
+        cache.set("c", ["result c"])
+        assert None == cache.get("a")
+        assert ["result b"] == cache.get("b")
+        assert ["result c"] == cache.get("c")
+        assert 2 == len(cache)
+
+        cache.clear()
+        assert 0 == len(cache)
+
+        # Entries expire.
+        cache = SearchResultCache(ttl=0)
+        cache.set("a", ["result a"])
+        time.sleep(0.01)
+        assert None == cache.get("a")
+
+
+class TestSearchMetrics(object):
+    def test_histogram(self):
+        histogram = SearchHistogram([1, 10])
+        assert None == histogram.mean
+        for value in (0.5, 1, 5, 100):
+            histogram.add(value)
+        assert [2, 1, 1] == histogram.counts
+        assert 4 == histogram.count
+        assert 106.5 / 4 == histogram.mean
+
+    def test_search_finished(self):
+        metrics = SearchMetrics()
+        search = dict(query=dict(match_all={}))
+        metrics.search_finished(
+            "query_works_multi",
+            0.2,
+            search,
+            took=0.05,
+            request_bytes=100,
+            response_bytes=5000,
+            lane=3,
+        )
+        metrics.search_finished("count_works", 0.1, search)
+
+        # Each measurement goes into a histogram labeled with the
+        # call and the lane.
+        wall_time = metrics.histogram(
+            SearchMetrics.WALL_TIME, call="query_works_multi", lane=3
+        )
+        assert 1 == wall_time.count
+        assert 0.2 == wall_time.total
+        took = metrics.histogram(SearchMetrics.TOOK, call="query_works_multi", lane=3)
+        assert 0.05 == took.total
+        response_bytes = metrics.histogram(
+            SearchMetrics.RESPONSE_BYTES, call="query_works_multi", lane=3
+        )
+        assert SearchMetrics.SIZE_BUCKETS == response_bytes.buckets
+        assert 5000 == response_bytes.total
+
+        # Measurements that weren't provided aren't recorded.
+        assert (
+            1
+            == metrics.histogram(
+                SearchMetrics.WALL_TIME, call="count_works", lane=None
+            ).count
+        )
+        assert None == metrics.histogram(
+            SearchMetrics.TOOK, call="count_works", lane=None
+        )
+
+        # With no threshold, no search is slow.
+        assert 0 == len(metrics.slow_searches)
+
+    def test_slow_search(self):
+        metrics = SearchMetrics(slow_threshold=1, slow_search_log_size=2)
+        search = dict(query=dict(match_all={}))
+        metrics.search_finished("count_works", 0.5, search, lane=1)
+        metrics.search_finished("count_works", 1, search, lane=2)
+        metrics.search_finished("count_works", 3, search, lane=3)
+        metrics.search_finished("count_works", 2, search, lane=4)
+
+        # Only the slowest searches were noted, and only the most
+        # recent ones were kept.
+        assert [3, 4] == [x["lane"] for x in metrics.slow_searches]
+        [slow, slower] = metrics.slow_searches
+        assert search == slow["search"]
+        assert 3 == slow["elapsed"]
+
+        # A Search object is turned into a dictionary only once the
+        # search turns out to be slow.
+        class MockSearch(object):
+            def to_dict(self):
+                return search
+
+        metrics.search_finished("count_works", 5, MockSearch(), lane=5)
+        assert search == metrics.slow_searches[-1]["search"]
+
+    def test_measure_sizes(self):
+        # Sizes are measured by default only when a slow threshold is set.
+        assert False == SearchMetrics().measure_sizes
+        assert True == SearchMetrics(slow_threshold=1).measure_sizes
+        assert True == SearchMetrics(measure_sizes=True).measure_sizes
+        assert False == SearchMetrics(1, measure_sizes=False).measure_sizes
+
+
 class TestCurrentMapping(object):
     def test_character_filters(self):
         # Verify the functionality of the regular expressions we tell
@@ -586,6 +869,158 @@ class TestExternalSearchWithWorks(EndToEndSearchTest):
         self.not_presentation_ready = _work(title="Moby Dick 2")
         self.not_presentation_ready.presentation_ready = False
 
+    def test_iterate_works(self):
+        if not self.search:
+            return
+
+        # Going through every work a page at a time finds every work
+        # exactly once.
+        pages = list(self.search.iterate_works(page_size=3))
+        ids = [hit.work_id for page in pages for hit in page]
+        everything = self.search.query_works(None, None, Pagination(size=100))
+        assert sorted(x.work_id for x in everything) == ids
+        assert all(len(page) == 3 for page in pages[:-1])
+
+        # With no order specified, works are ordered by ID.
+        assert sorted(ids) == ids
+
+        # A Filter's order and restrictions are respected.
+        filter = Filter(fiction=False)
+        filter.order = "sort_title"
+        pages = list(self.search.iterate_works(filter, page_size=1))
+        titles = [hit.meta.sort[0] for page in pages for hit in page]
+        assert sorted(titles) == titles
+        expect = self.search.query_works(None, filter, Pagination(size=100))
+        assert set(x.work_id for x in expect) == set(
+            hit.work_id for page in pages for hit in page
+        )
+
+        # A Filter that matches nothing isn't even run.
+        assert [] == list(self.search.iterate_works(Filter(match_nothing=True)))
+
+    def test_query_works_multi_in_parallel(self):
+        if not self.search:
+            return
+        queries = [
+            ("moby dick", None, Pagination(size=1)),
+            ("moby duck", None, Pagination(size=1)),
+            ("melville", None, Pagination(size=1)),
+        ]
+
+        # Splitting the queries into batches that run in parallel
+        # gives the same results as sending them all at once.
+        def ids(resultset):
+            return [[x.work_id for x in results] for results in resultset]
+
+        all_at_once = ids(self.search.query_works_multi(queries))
+        in_parallel = ids(self.search.query_works_multi(queries, batch_size=1))
+        assert all_at_once == in_parallel
+        assert [self.moby_dick.id] == in_parallel[2]
+
+        # If a batch doesn't finish in time, its queries get a
+        # marker instead of results.
+        original = self.search._multi_search
+
+        def multi_search(searches, timeout=None):
+            if len(searches) == 1:
+                return None
+            return original(searches, timeout)
+
+        self.search._multi_search = multi_search
+        resultset = list(
+            self.search.query_works_multi(queries, batch_size=2, timeout=10)
+        )
+        first, second, third = resultset
+        assert all_at_once[:2] == ids([first, second])
+        assert isinstance(third, TimedOutSearchResults)
+        assert [] == third
+        assert True == third.timed_out
+
+    def test_create_search_doc_fields(self):
+        if not self.search:
+            return
+        # Outside of debug mode, the source document isn't loaded at
+        # all. The work ID and any requested fields come from doc
+        # values.
+        search = self.search.create_search_doc(
+            "moby dick", None, None, False, fields=["last_update_time", "work_id"]
+        ).to_dict()
+        assert False == search["_source"]
+        assert ["work_id", "last_update_time"] == search["docvalue_fields"]
+
+        # In debug mode, everything is loaded.
+        search = self.search.create_search_doc("moby dick", None, None, True).to_dict()
+        assert ["*"] == search["_source"]
+        assert "docvalue_fields" not in search
+
+        # Either way, each hit has a single work ID.
+        [hit] = self.search.query_works(
+            "moby dick", None, Pagination(size=1), fields=["last_update_time"]
+        )
+        assert self.moby_dick.id == hit.work_id
+        assert 1 == len(hit.last_update_time)
+        assert "title" not in hit
+
+        [hit] = self.search.query_works("moby dick", None, Pagination(size=1), True)
+        assert self.moby_dick.id == hit.work_id
+        assert self.moby_dick.title == hit.title
+
+    def test_search_metrics(self):
+        if not self.search:
+            return
+        metrics = SearchMetrics(slow_threshold=0)
+        self.search.metrics = metrics
+
+        lane = self._lane()
+        filter = Filter(lane_id=lane.id)
+        self.search.query_works("moby dick", filter, Pagination(size=1))
+        self.search.count_works(filter)
+
+        # Both searches were measured, and labeled with the lane.
+        for call in ("query_works_multi", "count_works"):
+            histogram = metrics.histogram(
+                SearchMetrics.WALL_TIME, call=call, lane=lane.id
+            )
+            assert 1 == histogram.count
+
+        # Elasticsearch told us how long it spent on the search, and
+        # we know how much data went back and forth.
+        labels = dict(call="query_works_multi", lane=lane.id)
+        assert 1 == metrics.histogram(SearchMetrics.TOOK, **labels).count
+        assert metrics.histogram(SearchMetrics.RESPONSE_BYTES, **labels).total > 0
+
+        # With a threshold of zero, every search is slow, and the
+        # query that was sent is kept.
+        [multi, count] = metrics.slow_searches
+        assert "query_works_multi" == multi["call"]
+        assert "query" in multi["search"]
+
+    def test_result_cache(self):
+        if not self.search:
+            return
+        cache = SearchResultCache()
+        self.search.result_cache = cache
+
+        pagination = Pagination(size=1, offset=0)
+        [first] = self.search.query_works("moby dick", None, pagination)
+        assert (0, 1) == (cache.hits, cache.misses)
+
+        # Running the same search again uses the cached results, and
+        # the Pagination still learns about the page that was loaded.
+        pagination = Pagination(size=1, offset=0)
+        [second] = self.search.query_works("moby dick", None, pagination)
+        assert (1, 1) == (cache.hits, cache.misses)
+        assert first.work_id == second.work_id
+        assert 1 == pagination.this_page_size
+
+        # A different page is a different search.
+        self.search.query_works("moby dick", None, pagination.next_page)
+        assert (1, 2) == (cache.hits, cache.misses)
+
+        # Updating the index clears the cache.
+        self.search.bulk_update([self.moby_dick])
+        assert 0 == len(cache)
+
     def test_query_works(self):
         # An end-to-end test of the search functionality.
         #
@@ -3381,6 +3816,81 @@ class TestFilter(DatabaseTest):
         filter = Filter.from_worklist(self._db, for_other_library, None)
         assert True == filter.allow_holds
 
+    def test_lane_restrictions(self):
+        # The restrictions a Lane places on a Filter are cached,
+        # since finding them means walking up the lane hierarchy.
+        Filter.clear_lane_restrictions_cache()
+        cache = Filter._lane_restrictions_cache
+        parent = self._lane(display_name="Parent")
+        parent.fiction = True
+        parent.genres = [self.horror]
+        child = self._lane(display_name="Child", parent=parent)
+        child.customlists = [self.best_sellers]
+        self._db.flush()
+
+        restrictions = Filter.lane_restrictions(child)
+        assert True == restrictions["fiction"]
+        assert [parent.genre_ids] == restrictions["genre_restriction_sets"]
+        assert [[self.best_sellers.id]] == restrictions["customlist_restriction_sets"]
+        assert 1 == len(cache)
+
+        # The second time, the hierarchy isn't consulted at all.
+        def explode(key):
+            raise Exception("I should not be called.")
+
+        child.inherited_value = explode
+        child.inherited_values = explode
+        assert restrictions == Filter.lane_restrictions(child)
+
+        # Each caller gets its own copy of the cached restrictions.
+        Filter.lane_restrictions(child)["genre_restriction_sets"].append([1])
+        assert restrictions == Filter.lane_restrictions(child)
+        del child.inherited_value
+        del child.inherited_values
+
+        # Changing the parent lane clears the cache.
+        parent.fiction = False
+        assert 0 == len(cache)
+        self._db.flush()
+        assert False == Filter.lane_restrictions(child)["fiction"]
+
+        # So does creating a CustomList, since it might belong to a
+        # lane through its DataSource.
+        self._customlist(num_entries=0)
+        assert 0 == len(cache)
+
+        # Other processes find out about changes to a lane's lists
+        # through the site configuration timestamp. A new list only
+        # counts if some lane draws on every list from its DataSource.
+        long_ago = utc_now() - datetime.timedelta(hours=1)
+        Configuration.site_configuration_last_update(self._db, known_value=long_ago)
+        self._customlist(num_entries=0)
+        assert long_ago == Configuration._site_configuration_last_update()
+
+        nyt_lane = self._lane(display_name="Best Sellers")
+        nyt_lane.list_datasource = DataSource.lookup(self._db, DataSource.NYT)
+        new_list, ignore = self._customlist(num_entries=0)
+        for change in (
+            lambda: self._customlist(num_entries=0),
+            lambda: child.customlists.append(new_list),
+            lambda: child.customlists.remove(self.best_sellers),
+        ):
+            Configuration.site_configuration_last_update(self._db, known_value=long_ago)
+            change()
+            assert Configuration._site_configuration_last_update() > long_ago
+        self._db.flush()
+
+        # A lane with unsaved changes isn't cached.
+        child.media = [Edition.AUDIO_MEDIUM]
+        assert [Edition.AUDIO_MEDIUM] == Filter.lane_restrictions(child)["media"]
+        assert 0 == len(cache)
+
+        # A WorkList that isn't a Lane isn't cached either.
+        worklist = WorkList()
+        worklist.initialize(self._default_library, fiction=True)
+        assert True == Filter.lane_restrictions(worklist)["fiction"]
+        assert 0 == len(cache)
+
     def assert_filter_builds_to(self, expect, filter, _chain_filters=None):
         """Helper method for the most common case, where a
         Filter.build() returns a main filter and no nested filters.
@@ -4364,6 +4874,144 @@ class TestBulkUpdate(DatabaseTest):
         assert set([w1, w2, w3]) == set(successes)
         assert [] == failures
 
+    def test_fragments(self):
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        index = MockExternalSearchIndex()
+
+        # A partial update can't be applied to a work that isn't in
+        # the index yet.
+        successes, failures = index.bulk_update([work], fragments=["licensepools"])
+        assert [] == successes
+        [(failed, error)] = failures
+        assert work == failed
+        assert "document_missing_exception" == error
+        assert {} == index.docs
+
+        index.bulk_update([work])
+        [key] = list(index.docs.keys())
+        doc = index.docs[key]
+        assert 1 == len(doc["licensepools"])
+
+        # Only the fields covered by the fragment are sent to the
+        # index, and they're merged into the existing document.
+        old_title = doc["title"]
+        work.license_pools[0].licenses_owned = 0
+        work.license_pools[0].open_access = False
+        work.presentation_edition.title = "A new title"
+        self._db.commit()
+        successes, failures = index.bulk_update([work], fragments=["licensepools"])
+        assert [work] == successes
+        assert [] == failures
+        assert doc is index.docs[key]
+        assert None == doc["licensepools"]
+        assert old_title == doc["title"]
+
+    def test_bulk_chunks(self):
+        index = MockExternalSearchIndex()
+        actions = [dict(_id=i, title="x" * 100) for i in range(10)]
+
+        # Chunks hold no more than bulk_chunk_size documents.
+        index._bulk_chunk_size = 4
+        assert [4, 4, 2] == [len(x) for x in index.bulk_chunks(actions)]
+
+        # ...and no more than BULK_MAX_CHUNK_BYTES bytes.
+        index.BULK_MAX_CHUNK_BYTES = 250
+        assert [2, 2, 2, 2, 2] == [len(x) for x in index.bulk_chunks(actions)]
+
+        # A document bigger than the limit is sent by itself.
+        index.BULK_MAX_CHUNK_BYTES = 10
+        assert [1] * 10 == [len(x) for x in index.bulk_chunks(actions)]
+
+    def test_adapt_bulk_chunk_size(self):
+        index = MockExternalSearchIndex()
+        index.BULK_MIN_CHUNK_SIZE = 10
+        index.BULK_MAX_CHUNK_SIZE = 1000
+        assert index.BULK_CHUNK_SIZE == index.bulk_chunk_size
+        index._bulk_chunk_size = 100
+        target = index.BULK_TARGET_SECONDS
+
+        # A fast request makes the chunks bigger.
+        assert 150 == index.adapt_bulk_chunk_size(target / 10)
+
+        # A request that takes about as long as it should changes nothing.
+        assert 150 == index.adapt_bulk_chunk_size(target * 0.75)
+
+        # A slow request, or a rejection, makes the chunks smaller.
+        assert 75 == index.adapt_bulk_chunk_size(target * 2)
+        assert 37 == index.adapt_bulk_chunk_size(0, rejected=True)
+
+        # The size stays within bounds.
+        for i in range(10):
+            index.adapt_bulk_chunk_size(0, rejected=True)
+        assert 10 == index.bulk_chunk_size
+        for i in range(20):
+            index.adapt_bulk_chunk_size(0)
+        assert 1000 == index.bulk_chunk_size
+
+    def test_bulk_error_id(self):
+        m = ExternalSearchIndex.bulk_error_id
+        # Whether the ID comes from the document we sent or from the
+        # response, it's a string.
+        assert "1" == m(dict(data=dict(_id=1)))
+        assert "2" == m(dict(index=dict(_id="2")))
+        assert "3" == m(dict(update=dict(_id="3")))
+        assert None == m(dict(error="No document"))
+
+    def test_bulk_send_retries_only_failed_documents(self):
+        index = MockExternalSearchIndex()
+        index.BULK_INITIAL_BACKOFF = 0
+        index._bulk_chunk_size = 100
+        attempts = []
+
+        def bulk(docs, **kwargs):
+            attempts.append([x["_id"] for x in docs])
+            errors = []
+            for doc in docs:
+                if doc["_id"] == 2 and len(attempts) < 3:
+                    # The cluster is too busy to handle this document
+                    # right now.
+                    status = 429
+                elif doc["_id"] == 3:
+                    # This document will never be accepted.
+                    status = 400
+                else:
+                    continue
+                # Elasticsearch reports document IDs as strings.
+                errors.append(dict(index=dict(_id=str(doc["_id"]), status=status)))
+            return len(docs) - len(errors), errors
+
+        index.bulk = bulk
+        indexed, errors = index.bulk_send([dict(_id=i) for i in (1, 2, 3)])
+
+        # Only the rejected document was sent again, and it eventually
+        # got through.
+        assert [[1, 2, 3], [2], [2]] == attempts
+        assert set(["1", "2"]) == indexed
+        assert ["3"] == list(errors.keys())
+
+        # The rejections made the chunk size smaller.
+        assert index.bulk_chunk_size < 100
+
+        # bulk_update reconciles the results with the works.
+        works = [self._work(), self._work()]
+        for work in works:
+            work.set_presentation_ready()
+
+        def bulk(docs, **kwargs):
+            errors = [
+                dict(index=dict(_id=str(doc["_id"]), status=400, error="Bad document"))
+                for doc in docs
+                if doc["_id"] == works[1].id
+            ]
+            return len(docs) - len(errors), errors
+
+        index.bulk = bulk
+        index._bulk_chunk_size = 1
+        successes, failures = index.bulk_update(works)
+        assert [works[0]] == successes
+        assert [(works[1], "Bad document")] == failures
+
 
 class TestSearchErrors(ExternalSearchTest):
     def test_search_connection_timeout(self):
@@ -4378,7 +5026,7 @@ class TestSearchErrors(ExternalSearchTest):
                         status="TIMEOUT",
                         exception="ConnectionTimeout",
                         error="Connection Timeout!",
-                        _id=doc["_id"],
+                        _id=str(doc["_id"]),
                         data=doc,
                     )
                 )
@@ -4387,6 +5035,7 @@ class TestSearchErrors(ExternalSearchTest):
             return 0, errors
 
         self.search.bulk = bulk_with_timeout
+        self.search.BULK_INITIAL_BACKOFF = 0
 
         work = self._work()
         work.set_presentation_ready()
@@ -4396,8 +5045,18 @@ class TestSearchErrors(ExternalSearchTest):
         assert work == failures[0][0]
         assert "Connection Timeout!" == failures[0][1]
 
-        # When all the documents fail, it tries again once with the same arguments.
-        assert [work.id, work.id] == [docs[0]["_id"] for docs in attempts]
+        # When a document fails because of a timeout, it tries again,
+        # up to BULK_MAX_RETRIES times.
+        expect = [work.id] * (self.search.BULK_MAX_RETRIES + 1)
+        assert expect == [docs[0]["_id"] for docs in attempts]
+
+        # Unless it's told not to.
+        attempts = []
+        successes, failures = self.search.bulk_update(
+            [work], retry_on_batch_failure=False
+        )
+        assert 1 == len(attempts)
+        assert 1 == len(failures)
 
     def test_search_single_document_error(self):
         successful_work = self._work()
@@ -4489,3 +5148,234 @@ class TestSearchIndexCoverageProvider(DatabaseTest):
         assert work == record.obj
         assert True == record.transient
         assert "There was an error!" == record.exception
+
+    def test_run_includes_fragments(self):
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        index = MockExternalSearchIndex()
+        provider = SearchIndexCoverageProvider(self._db, search_index_client=index)
+        provider.run()
+        assert 1 == len(index.docs)
+
+        # Only a fragment of the work's document needs regenerating.
+        [record] = work.search_index_fragment_needs_updating(Work.CUSTOMLISTS_FRAGMENT)
+        assert WorkCoverageRecord.REGISTERED == record.status
+
+        # Even if nothing ever runs UpdateSearchIndexFragmentsScript,
+        # the fragment is taken care of.
+        provider.run()
+        assert WorkCoverageRecord.SUCCESS == record.status
+
+        # The fragment providers themselves don't go looking for
+        # other fragments.
+        assert all(
+            False == x.INCLUDE_FRAGMENTS
+            for x in SearchIndexFragmentCoverageProvider.all(
+                self._db, search_index_client=index
+            )
+        )
+
+
+class TestSearchIndexFragmentCoverageProvider(DatabaseTest):
+    def test_constructor(self):
+        index = MockExternalSearchIndex()
+        provider = SearchIndexFragmentCoverageProvider(
+            self._db, search_index_client=index, fragment=Work.GENRES_FRAGMENT
+        )
+        assert (
+            WorkCoverageRecord.search_index_fragment_operation("genres")
+            == provider.operation
+        )
+        assert True == provider.registered_only
+
+        with pytest.raises(ValueError) as excinfo:
+            SearchIndexFragmentCoverageProvider(
+                self._db, search_index_client=index, fragment="no such fragment"
+            )
+        assert "Unknown search document fragment: no such fragment" in str(
+            excinfo.value
+        )
+
+        # all() creates one provider for every fragment.
+        providers = list(
+            SearchIndexFragmentCoverageProvider.all(self._db, search_index_client=index)
+        )
+        assert set(Work.SEARCH_DOCUMENT_FRAGMENTS) == set(x.fragment for x in providers)
+
+    def test_items_that_need_coverage(self):
+        index = MockExternalSearchIndex()
+        provider = SearchIndexFragmentCoverageProvider(
+            self._db, search_index_client=index, fragment=Work.CUSTOMLISTS_FRAGMENT
+        )
+        work = self._work(with_license_pool=True)
+        self._work(with_license_pool=True)
+
+        # Only works registered as needing this fragment updated
+        # are covered.
+        assert [] == provider.items_that_need_coverage().all()
+        work.search_index_fragment_needs_updating(Work.CUSTOMLISTS_FRAGMENT)
+        assert [work] == provider.items_that_need_coverage().all()
+
+    def test_process_batch(self):
+        indexed = self._work(with_license_pool=True)
+        not_indexed = self._work(with_license_pool=True)
+        index = MockExternalSearchIndex()
+        index.bulk_update([indexed])
+
+        provider = SearchIndexFragmentCoverageProvider(
+            self._db, search_index_client=index, fragment=Work.LICENSEPOOLS_FRAGMENT
+        )
+        results = provider.process_batch([indexed, not_indexed])
+
+        # Both works count as successes.
+        assert set([indexed, not_indexed]) == set(results)
+
+        # But a work that wasn't in the index yet couldn't be updated,
+        # so it has been scheduled for a full reindex instead.
+        assert None == WorkCoverageRecord.lookup(
+            indexed, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
+        record = WorkCoverageRecord.lookup(
+            not_indexed, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
+        assert WorkCoverageRecord.REGISTERED == record.status
+        assert 1 == len(index.docs)
+
+
+class TestSearchIndexPipeline(DatabaseTest):
+    def test_ranges(self):
+        index = MockExternalSearchIndex()
+        pipeline = SearchIndexPipeline(index, None, batch_size=2)
+
+        # With no presentation-ready works, there's nothing to do.
+        not_ready = self._work()
+        assert [] == pipeline.ranges(self._db)
+
+        w1 = self._work(with_license_pool=True)
+        w2 = self._work(with_license_pool=True)
+        w3 = self._work(with_license_pool=True)
+        ranges = pipeline.ranges(self._db)
+
+        # The ranges are contiguous and cover every presentation-ready
+        # work.
+        assert w1.id == ranges[0][0]
+        assert w3.id + 1 == ranges[-1][1]
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            assert end == next_start
+        assert all(0 < end - start <= 2 for start, end in ranges)
+
+        # Ranges can start partway through.
+        ranges = pipeline.ranges(self._db, start_id=w2.id)
+        assert w2.id == ranges[0][0]
+        assert w3.id + 1 == ranges[-1][1]
+
+    def test_finish(self):
+        pipeline = SearchIndexPipeline(MockExternalSearchIndex(), None)
+        pipeline._unfinished = deque([1, 3, 5])
+        pipeline._finished = set()
+        pipeline._end = 7
+
+        # Finishing a range doesn't move the checkpoint until every
+        # earlier range is finished too.
+        assert None == pipeline._finish(3)
+        assert 5 == pipeline._finish(1)
+        assert 7 == pipeline._finish(5)
+        assert 0 == len(pipeline._unfinished)
+        assert set() == pipeline._finished
+
+    def test_run(self):
+        works = [self._work(with_license_pool=True) for i in range(3)]
+        not_ready = self._work()
+        index = MockExternalSearchIndex()
+        session_factory = SessionManager.sessionmaker(session=self._db)
+        checkpoints = []
+
+        def checkpoint(_db, work_id):
+            checkpoints.append(work_id)
+
+        pipeline = SearchIndexPipeline(
+            index,
+            session_factory,
+            producers=2,
+            senders=2,
+            batch_size=1,
+            queue_size=1,
+            checkpoint=checkpoint,
+        )
+        assert pipeline == pipeline.run(self._db)
+        self._db.commit()
+
+        # Every presentation-ready work was indexed.
+        assert set(x.id for x in works) == set(x[-1] for x in index.docs)
+        assert 3 == pipeline.generated
+        assert 3 == pipeline.sent
+        assert 0 == pipeline.failed
+        assert pipeline.achievements.startswith("Documents generated: 3")
+
+        # And got a coverage record saying so.
+        for work in works:
+            record = WorkCoverageRecord.lookup(
+                work, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            )
+            assert WorkCoverageRecord.SUCCESS == record.status
+
+        # The checkpoint only ever moves forward, and it finishes past
+        # the last work.
+        assert sorted(checkpoints) == checkpoints
+        assert works[-1].id + 1 == checkpoints[-1]
+
+        # A work whose document is rejected doesn't get a coverage
+        # record, even though Elasticsearch identifies the document
+        # with a string rather than the work's ID.
+        rejected = self._work(with_license_pool=True)
+        accepted = self._work(with_license_pool=True)
+        docs = [dict(_id=rejected.id), dict(_id=accepted.id)]
+
+        def bulk(docs, **kwargs):
+            return 1, [dict(index=dict(_id=str(rejected.id), status=400))]
+
+        index.bulk = bulk
+        pipeline.send(rejected.id, [rejected.id, accepted.id], docs, self._db)
+        assert None == WorkCoverageRecord.lookup(
+            rejected, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
+        assert WorkCoverageRecord.SUCCESS == (
+            WorkCoverageRecord.lookup(
+                accepted, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            ).status
+        )
+        assert 1 == pipeline.failed
+
+        # A document the cluster was too busy to accept is sent again
+        # rather than being dropped.
+        index.BULK_INITIAL_BACKOFF = 0
+        busy = self._work(with_license_pool=True)
+        attempts = []
+
+        def bulk(docs, **kwargs):
+            attempts.append([x["_id"] for x in docs])
+            if len(attempts) == 1:
+                return 0, [dict(index=dict(_id=str(busy.id), status=429))]
+            return len(docs), []
+
+        index.bulk = bulk
+        pipeline.send(busy.id, [busy.id], [dict(_id=busy.id)], self._db)
+        assert [[busy.id], [busy.id]] == attempts
+        assert WorkCoverageRecord.SUCCESS == (
+            WorkCoverageRecord.lookup(
+                busy, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            ).status
+        )
+        assert 1 == pipeline.failed
+
+        # A pipeline that's loading an index that isn't live yet
+        # doesn't record coverage at all.
+        pipeline.record_coverage = False
+        unrecorded = self._work(with_license_pool=True)
+        index.bulk = lambda docs, **kwargs: (len(docs), [])
+        pipeline.send(
+            unrecorded.id, [unrecorded.id], [dict(_id=unrecorded.id)], self._db
+        )
+        assert None == WorkCoverageRecord.lookup(
+            unrecorded, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
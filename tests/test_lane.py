@@ -20,6 +20,7 @@ from ..entrypoint import (
 from ..external_search import (
     Filter,
     MockExternalSearchIndex,
+    TimedOutSearchResults,
     WorkSearchResult,
     mock_search_index,
 )
@@ -2287,6 +2288,37 @@ class TestWorkList(DatabaseTest):
         # the return value of works(), the method we're testing.
         assert wl.fake_work_list == result
 
+    def test_iterate_works(self):
+        # Test the method that goes through every work in a WorkList
+        # a page at a time.
+
+        class MockSearchClient(object):
+            def iterate_works(self, filter, page_size):
+                self.called_with = (filter, page_size)
+                yield ["hit1", "hit2"]
+                yield ["hit3"]
+
+        class MockWorkList(WorkList):
+            def works_for_hits(self, _db, hits, facets=None):
+                return ["work for %s" % x for x in hits]
+
+        wl = MockWorkList()
+        wl.initialize(self._default_library, languages=["eng"])
+        facets = Facets(self._default_library, None, None, order=Facets.ORDER_TITLE)
+        search_client = MockSearchClient()
+
+        pages = list(wl.iterate_works(self._db, facets, search_client, page_size=2))
+        assert [
+            ["work for hit1", "work for hit2"],
+            ["work for hit3"],
+        ] == pages
+
+        # The search client was given the WorkList's Filter and the
+        # page size.
+        filter, page_size = search_client.called_with
+        assert Filter.from_worklist(self._db, wl, facets).build() == filter.build()
+        assert 2 == page_size
+
     def test_works_for_hits(self):
         # Verify that WorkList.works_for_hits() just calls
         # works_for_resultsets().
@@ -4363,6 +4395,134 @@ class TestWorkListGroups(DatabaseTest):
         # multiple lanes.
         assert int(self._default_library.featured_lane_size * 1.10) == pagination.size
 
+    def test_groups_for_lanes_batches_queries(self):
+        # Non-queryable children whose featured works can be found
+        # with a single search query have their queries sent along
+        # with the main query, and their Works loaded at the same time.
+        class MockParent(WorkList):
+            def __init__(self, *args, **kwargs):
+                super(MockParent, self).__init__(*args, **kwargs)
+                self.works_for_resultsets_calls = []
+
+            def works_for_resultsets(self, _db, resultsets, facets=None):
+                self.works_for_resultsets_calls.append((resultsets, facets))
+                return [[self.works_by_result[x] for x in r] for r in resultsets]
+
+        class MockSearchEngine(object):
+            def __init__(self):
+                self.calls = []
+
+            def query_works_multi(self, queries):
+                self.calls.append(queries)
+                return [["result %d" % i] for i in range(len(queries))]
+
+        class Unbatchable(WorkList):
+            # This WorkList finds its works some other way.
+            def works(self, _db, pagination, facets, *args, **kwargs):
+                return [unbatchable_work]
+
+        unbatchable_work = self._work()
+        parent = MockParent()
+        batchable = WorkList()
+        unbatchable = Unbatchable()
+        lane = self._lane()
+        lane.inherit_parent_restrictions = False
+        for wl in (batchable, unbatchable):
+            wl.initialize(library=self._default_library)
+        parent.initialize(
+            library=self._default_library, children=[batchable, unbatchable, lane]
+        )
+
+        work1 = self._work()
+        work2 = self._work()
+        parent.works_by_result = {"result 0": work1, "result 1": work2}
+
+        # None of the children are queryable. Before this feature, each
+        # one would have needed its own search request.
+        search = MockSearchEngine()
+        facets = FeaturedFacets(0)
+        pagination = Pagination(size=2)
+        groups = list(
+            parent._groups_for_lanes(
+                self._db,
+                [batchable, unbatchable, lane],
+                [],
+                pagination,
+                facets,
+                search_engine=search,
+            )
+        )
+
+        # The batchable WorkList and the Lane got their works from a
+        # single search request and a single database load. The
+        # other WorkList used its own works() method.
+        [queries] = search.calls
+        assert 2 == len(queries)
+        [(resultsets, loaded_with)] = parent.works_for_resultsets_calls
+        assert [["result 0"], ["result 1"]] == resultsets
+        assert facets == loaded_with
+        assert [
+            (work1, batchable),
+            (unbatchable_work, unbatchable),
+            (work2, lane),
+        ] == groups
+
+    def test__note_timed_out_searches(self):
+        facets = FeaturedFacets(0)
+        assert False == facets.search_timed_out
+
+        # Results that came back in time don't affect the facets.
+        WorkList._note_timed_out_searches(facets, [["result"], []])
+        assert False == facets.search_timed_out
+
+        # But if any search timed out, the facets are told about it.
+        WorkList._note_timed_out_searches(facets, [["result"], TimedOutSearchResults()])
+        assert True == facets.search_timed_out
+
+        # No facets, nothing to do.
+        WorkList._note_timed_out_searches(None, [TimedOutSearchResults()])
+
+    def test_featured_search_query(self):
+        facets = FeaturedFacets(0)
+        pagination = Pagination(size=2)
+
+        # An ordinary WorkList can describe its featured works with a
+        # search query.
+        wl = WorkList()
+        wl.initialize(library=self._default_library)
+        query, load_facets = wl.featured_search_query(self._db, facets, pagination)
+        query_string, filter, query_pagination = query
+        assert None == query_string
+        assert wl.filter(self._db, facets).build() == filter.build()
+        assert pagination == query_pagination
+        assert facets == load_facets
+
+        # But not one that overrides works() or groups().
+        class CustomWorks(WorkList):
+            def works(self, *args, **kwargs):
+                return []
+
+        class CustomGroups(WorkList):
+            def groups(self, *args, **kwargs):
+                return []
+
+        for cls in (CustomWorks, CustomGroups):
+            wl = cls()
+            wl.initialize(library=self._default_library)
+            assert None == wl.featured_search_query(self._db, facets, pagination)
+
+        # A Lane can describe its featured works with a search query,
+        # unless it's not included in grouped feeds.
+        lane = self._lane()
+        query, load_facets = lane.featured_search_query(self._db, facets, pagination)
+        query_string, filter, query_pagination = query
+        adapted = lane.overview_facets(self._db, facets)
+        assert Filter.from_worklist(self._db, lane, adapted).build() == filter.build()
+        assert facets == load_facets
+
+        lane.include_self_in_grouped_feed = False
+        assert None == lane.featured_search_query(self._db, facets, pagination)
+
     def test_featured_works_with_lanes(self):
         # _featured_works_with_lanes builds a list of queries and
         # passes the list into search_engine.works_query_multi(). It
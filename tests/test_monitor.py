@@ -28,6 +28,7 @@ from ..model import (
 )
 from ..monitor import (
     CachedFeedReaper,
+    CachedFeedRefreshMonitor,
     CirculationEventLocationScrubber,
     CollectionMonitor,
     CollectionReaper,
@@ -940,6 +941,68 @@ class MockReaperMonitor(ReaperMonitor):
     TIMESTAMP_FIELD = "timestamp"
 
 
+class TestCachedFeedRefreshMonitor(DatabaseTest):
+    def test_run_once(self):
+        now = utc_now()
+        old = now - datetime.timedelta(hours=1)
+
+        def feed(request_count, timestamp=old, content="old"):
+            cf, ignore = get_one_or_create(
+                self._db,
+                CachedFeed,
+                type=CachedFeed.PAGE_TYPE,
+                pagination=self._str,
+                library=self._default_library,
+            )
+            cf.request_count = request_count
+            cf.timestamp = timestamp
+            cf.content = content
+            return cf
+
+        popular = feed(100)
+        less_popular = feed(50)
+        unpopular = feed(1)
+        popular_but_fresh = feed(1000, timestamp=now)
+        popular_but_empty = feed(1000, content=None)
+        broken = feed(75)
+
+        class Mock(CachedFeedRefreshMonitor):
+            FEED_COUNT = 3
+
+            def __init__(self, *args, **kwargs):
+                super(Mock, self).__init__(*args, **kwargs)
+                self.refreshed = []
+
+            def refresh(self, feed):
+                self.refreshed.append(feed)
+                if feed is broken:
+                    raise Exception("Oops")
+                return "new"
+
+        monitor = Mock(self._db)
+        progress = monitor.run_once()
+
+        # The three most popular stale feeds with content were
+        # chosen, in order of popularity.
+        assert [popular, broken, less_popular] == monitor.refreshed
+        assert "Feeds refreshed: 2" == progress.achievements
+
+        # The ones that were successfully regenerated now have new
+        # content and an up-to-date timestamp.
+        for f in (popular, less_popular):
+            assert "new" == f.content
+            assert f.timestamp > now
+        for f in (broken, unpopular):
+            assert "old" == f.content
+
+        # The constructor arguments override the class defaults.
+        monitor = Mock(
+            self._db, feed_count=10, refresh_after=datetime.timedelta(days=1)
+        )
+        monitor.run_once()
+        assert [] == monitor.refreshed
+
+
 class TestReaperMonitor(DatabaseTest):
     def test_cutoff(self):
         """Test that cutoff behaves correctly when given different values for
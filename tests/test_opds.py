@@ -1441,6 +1441,135 @@ class TestAcquisitionFeed(DatabaseTest):
         assert 0 == response.max_age
         assert True == response.private
 
+    def test_splice_entries(self):
+        # An Annotator can ask for cached OPDS entries to be spliced
+        # into a feed rather than parsed and re-serialized.
+        class SplicingAnnotator(TestAnnotatorWithGroup):
+            splice_entries = True
+
+        work = self._work(with_open_access_download=True, title="Spliced")
+        work.calculate_opds_entries(verbose=False)
+        no_cache = self._work(with_open_access_download=True, title="Not Cached")
+        no_cache.simple_opds_entry = None
+
+        annotator = SplicingAnnotator()
+        feed = AcquisitionFeed(
+            self._db, "feed title", "http://url/", [work, no_cache], annotator
+        )
+
+        # The work with a cached entry was spliced in; the other one
+        # went through the normal process.
+        assert 1 == len(feed.spliced_entries)
+        [spliced] = feed.spliced_entries
+        assert spliced.startswith(work.simple_opds_entry[: -len("</entry>")])
+        assert '<bibframe:distribution bibframe:ProviderName="Gutenberg"/>' in spliced
+        entries = [x for x in feed.feed if etree.QName(x).localname == "entry"]
+        assert 1 == len(entries)
+
+        # The serialized feed is the same as if the feed had been
+        # built without splicing.
+        parsed = feedparser.parse(str(feed))
+        annotator.splice_entries = False
+        expect = feedparser.parse(
+            str(
+                AcquisitionFeed(
+                    self._db, "feed title", "http://url/", [work, no_cache], annotator
+                )
+            )
+        )
+        assert ["Spliced", "Not Cached"] == [x["title"] for x in parsed["entries"]]
+        for entry, expect_entry in zip(parsed["entries"], expect["entries"]):
+            assert expect_entry["id"] == entry["id"]
+            assert expect_entry["updated"] == entry["updated"]
+            assert [x["href"] for x in expect_entry["links"]] == [
+                x["href"] for x in entry["links"]
+            ]
+
+        # The whole thing is well-formed XML.
+        etree.fromstring(str(feed))
+
+    def test_defer_entries(self):
+        # A feed can be told not to create its entries until it's
+        # serialized.
+        work1 = self._work(with_open_access_download=True, title="First")
+        work2 = self._work(with_open_access_download=True, title="Second")
+
+        class Mock(AcquisitionFeed):
+            created = []
+
+            def create_entry(self, work, *args, **kwargs):
+                self.created.append(work)
+                return super(Mock, self).create_entry(work, *args, **kwargs)
+
+        feed = Mock(
+            self._db,
+            "feed title",
+            "http://url/",
+            [work1, work2],
+            TestAnnotator,
+            defer_entries=True,
+        )
+        assert [] == Mock.created
+
+        # As the feed is streamed, each entry is created just before
+        # it's sent.
+        stream = feed.stream()
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            if b"First" in chunk:
+                break
+        assert [work1] == Mock.created
+        chunks.extend(stream)
+        assert [work1, work2] == Mock.created
+
+        parsed = feedparser.parse(b"".join(chunks))
+        assert ["First", "Second"] == [x["title"] for x in parsed["entries"]]
+
+    def test_as_streaming_response(self):
+        class SplicingAnnotator(TestAnnotator):
+            splice_entries = True
+
+        work = self._work(with_open_access_download=True, title="Spliced")
+        work.calculate_opds_entries(verbose=False)
+        feed = AcquisitionFeed(
+            self._db, "feed title", "http://url/", [work], SplicingAnnotator
+        )
+        response = feed.as_streaming_response(max_age=10)
+        assert isinstance(response, OPDSFeedResponse)
+        assert response.is_streamed
+        assert 10 == response.max_age
+
+        # Spliced entries are streamed along with everything else.
+        parsed = feedparser.parse(response.get_data())
+        assert "feed title" == parsed["feed"]["title"]
+        assert ["Spliced"] == [x["title"] for x in parsed["entries"]]
+
+    def test_splice_entry_falls_back(self):
+        # splice_entry returns None whenever an entry can't be spliced,
+        # and the feed falls back to building it with lxml.
+        class SplicingAnnotator(TestAnnotator):
+            splice_entries = True
+
+        feed = AcquisitionFeed(
+            self._db, "feed title", "http://url/", [], SplicingAnnotator
+        )
+
+        # No cached entry.
+        work = self._work(with_open_access_download=True)
+        work.simple_opds_entry = None
+        assert None == feed.splice_entry(work)
+
+        # No active license pool.
+        work.calculate_opds_entries(verbose=False)
+        work.license_pools[0].open_access = False
+        work.license_pools[0].licenses_owned = 0
+        assert None == feed.splice_entry(work)
+
+        # An Edition rather than a Work.
+        assert None == feed.splice_entry(work.presentation_edition)
+        assert [] == feed.spliced_entries
+
     def test_add_entrypoint_links(self):
         """Verify that add_entrypoint_links calls _entrypoint_link
         on every EntryPoint passed in.
@@ -2463,6 +2592,13 @@ class TestEntrypointLinkInsertion(DatabaseTest):
         # TestAnnotator.groups_url() when passed an EntryPoint.
         assert "http://groups/?entrypoint=Book" == make_link(EbooksEntryPoint)
 
+        # The feed is only marked as incomplete if one of the searches
+        # used to build it timed out.
+        assert False == feed.incomplete
+        facets.search_timed_out = True
+        feed, make_link, entrypoints, selected = run(self.wl, facets)
+        assert True == feed.incomplete
+
     def test_page(self):
         # When AcquisitionFeed.page() generates the first page of a paginated
         # list, it will link to different entry points into the list,
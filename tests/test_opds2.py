@@ -0,0 +1,213 @@
+import json
+
+from ..classifier import Contemporary_Romance
+from ..external_search import MockExternalSearchIndex
+from ..lane import Facets, Pagination
+from ..model import CachedFeed, Edition
+from ..opds import AcquisitionFeed, TestAnnotator, TestAnnotatorWithGroup
+from ..opds2 import OPDS2Feed
+from ..testing import DatabaseTest
+from ..util.flask_util import OPDSFeedResponse
+from ..util.opds_writer import AtomFeed, OPDSFeed
+
+
+class TestOPDS2Feed(DatabaseTest):
+    def test_publication(self):
+        work = self._work(
+            title="A Title",
+            authors="Author, An",
+            with_open_access_download=True,
+        )
+        work.summary_text = "<p>A summary.</p>"
+        edition = work.presentation_edition
+        edition.subtitle = "A Subtitle"
+        edition.series = "A Series"
+        edition.series_position = 2
+        edition.publisher = "A Publisher"
+        pool = work.license_pools[0]
+
+        feed = OPDS2Feed(self._db, "feed title", "http://url/", [work], TestAnnotator)
+        [publication] = feed.publications
+        metadata = publication["metadata"]
+
+        assert "A Title" == metadata["title"]
+        assert "A Subtitle" == metadata["subtitle"]
+        assert Edition.medium_to_additional_type[Edition.BOOK_MEDIUM] == (
+            metadata["@type"]
+        )
+        [author] = metadata["author"]
+        assert "Author, An" == author["sortAs"]
+        assert dict(series=dict(name="A Series", position=2)) == metadata["belongsTo"]
+        assert "<p>A summary.</p>" == metadata["description"]
+        assert "en" == metadata["language"]
+        assert "A Publisher" == metadata["publisher"]
+
+        # The Annotator added information about the license pool.
+        assert pool.identifier.urn == metadata["identifier"]
+        assert AtomFeed._strftime(work.last_update_time) == metadata["modified"]
+
+        # Including a link to download the open-access book.
+        [lpdm] = pool.delivery_mechanisms
+        [acquisition] = [
+            x for x in publication["links"] if x.get("rel") == OPDSFeed.OPEN_ACCESS_REL
+        ]
+        assert lpdm.resource.representation.public_url == acquisition["href"]
+        assert lpdm.delivery_mechanism.content_type_media_type == acquisition["type"]
+        assert dict(state="available") == acquisition["properties"]["availability"]
+
+        # A book that isn't open-access gets no acquisition links
+        # from the default Annotator.
+        pool.open_access = False
+        feed = OPDS2Feed(self._db, "feed title", "http://url/", [work], TestAnnotator)
+        [publication] = feed.publications
+        assert [] == [
+            x for x in publication["links"] if x.get("rel") == OPDSFeed.OPEN_ACCESS_REL
+        ]
+        pool.open_access = True
+
+        # Works that can't be presented to a client are left out.
+        no_pool = self._work()
+        feed = OPDS2Feed(
+            self._db, "feed title", "http://url/", [no_pool, edition], TestAnnotator
+        )
+        assert [] == feed.publications
+
+    def test_opds2_acquisition_link(self):
+        m = TestAnnotator.opds2_acquisition_link
+        href = "http://acquire/"
+
+        # A direct acquisition link.
+        assert dict(
+            rel=OPDSFeed.BORROW_REL, href=href, type="application/epub+zip"
+        ) == m(OPDSFeed.BORROW_REL, href, ["application/epub+zip"])
+
+        # A doubly-indirect acquisition link, with extra properties.
+        link = m(
+            OPDSFeed.BORROW_REL,
+            href,
+            ["text/html", "drm/type", "application/epub+zip"],
+            availability=dict(state="unavailable"),
+        )
+        assert "text/html" == link["type"]
+        assert (
+            dict(
+                availability=dict(state="unavailable"),
+                indirectAcquisition=[
+                    dict(type="drm/type", child=[dict(type="application/epub+zip")])
+                ],
+            )
+            == link["properties"]
+        )
+
+    def test_as_dict(self):
+        work = self._work(with_open_access_download=True)
+        feed = OPDS2Feed(self._db, "feed title", "http://url/", [work], TestAnnotator)
+        data = json.loads(str(feed))
+        assert dict(title="feed title") == data["metadata"]
+        assert [
+            dict(href="http://url/", rel="self", type=OPDS2Feed.MEDIA_TYPE)
+        ] == data["links"]
+        assert 1 == len(data["publications"])
+
+        # Empty groups and facets are left out.
+        assert "groups" not in data
+        assert "facets" not in data
+
+    def test_add_facet_link(self):
+        feed = OPDS2Feed(self._db, "feed title", "http://url/", [])
+        feed.add_facet_link(
+            AcquisitionFeed.facet_link("http://title/", "Title", "Sort by", True)
+        )
+        feed.add_facet_link(
+            AcquisitionFeed.facet_link("http://author/", "Author", "Sort by", False)
+        )
+        [group] = feed.facets
+        assert dict(title="Sort by") == group["metadata"]
+        title, author = group["links"]
+
+        # The active facet is marked as such with its rel.
+        assert "self" == title["rel"]
+        assert "http://title/" == title["href"]
+        assert "rel" not in author
+
+    def test_page(self):
+        lane = self._lane("Contemporary Romance", genres="Contemporary Romance")
+        work1 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+        work2 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+        search_engine = MockExternalSearchIndex()
+        search_engine.bulk_update([work1, work2])
+
+        facets = Facets.default(self._default_library)
+        pagination = Pagination(size=1)
+
+        response = OPDS2Feed.page(
+            self._db,
+            "test",
+            self._url,
+            lane,
+            TestAnnotator,
+            pagination=pagination,
+            search_engine=search_engine,
+            max_age=10,
+        )
+        assert isinstance(response, OPDSFeedResponse)
+        assert OPDS2Feed.MEDIA_TYPE == response.mimetype
+        data = json.loads(response.get_data())
+        assert [work1.title] == [x["metadata"]["title"] for x in data["publications"]]
+        [next_link] = [x for x in data["links"] if x.get("rel") == "next"]
+        assert (
+            TestAnnotator.feed_url(lane, facets, pagination.next_page)
+            == next_link["href"]
+        )
+        assert any(group["links"] for group in data["facets"])
+
+        # The feed was cached separately from the OPDS 1 version of
+        # the same feed.
+        [cached] = self._db.query(CachedFeed).all()
+        assert "%s-opds2" % CachedFeed.PAGE_TYPE == cached.type
+
+        AcquisitionFeed.page(
+            self._db,
+            "test",
+            self._url,
+            lane,
+            TestAnnotator,
+            pagination=pagination,
+            search_engine=search_engine,
+            max_age=10,
+        )
+        assert 2 == self._db.query(CachedFeed).count()
+
+    def test_groups(self):
+        work = self._work(title="An epic tome", with_open_access_download=True)
+        search_engine = MockExternalSearchIndex()
+        search_engine.bulk_update([work])
+
+        fantasy = self._lane("Fantasy", genres="Fantasy")
+        self._lane("Epic Fantasy", parent=fantasy, genres=["Epic Fantasy"])
+        self._lane("Urban Fantasy", parent=fantasy, genres=["Urban Fantasy"])
+
+        response = OPDS2Feed.groups(
+            self._db,
+            "test",
+            self._url,
+            fantasy,
+            TestAnnotatorWithGroup(),
+            max_age=0,
+            search_engine=search_engine,
+        )
+        data = json.loads(response.get_data())
+
+        # The work shows up once in each group, just as it would in an
+        # OPDS 1 grouped feed.
+        groups = data["groups"]
+        assert [
+            "Group Title for Epic Fantasy!",
+            "Group Title for Urban Fantasy!",
+            "Group Title for Fantasy!",
+        ] == [x["metadata"]["title"] for x in groups]
+        assert "http://group/Epic Fantasy" == groups[0]["links"][0]["href"]
+        for group in groups:
+            [publication] = group["publications"]
+            assert "An epic tome" == publication["metadata"]["title"]
+        assert [] == data["publications"]
@@ -1,3 +1,4 @@
+import datetime
 import os
 import random
 import shutil
@@ -10,7 +11,10 @@ from parameterized import parameterized
 
 from ..classifier import Classifier
 from ..config import CannotLoadConfiguration
-from ..external_search import MockExternalSearchIndex
+from ..external_search import (
+    MockExternalSearchIndex,
+    SearchIndexFragmentCoverageProvider,
+)
 from ..lane import Lane, WorkList
 from ..metadata_layer import LinkData, TimestampData
 from ..mirror import MirrorUploader
@@ -39,6 +43,7 @@ from ..monitor import CollectionMonitor, Monitor, ReaperMonitor
 from ..s3 import MinIOUploader, MinIOUploaderConfiguration, S3Uploader
 from ..scripts import (
     AddClassificationScript,
+    BlueGreenRebuildSearchIndexScript,
     CheckContributorNamesInDB,
     CollectionArgumentsScript,
     CollectionInputScript,
@@ -58,6 +63,7 @@ from ..scripts import (
     MirrorResourcesScript,
     MockStdin,
     OPDSImportScript,
+    ParallelRebuildSearchIndexScript,
     PatronInputScript,
     RebuildSearchIndexScript,
     ReclassifyWorksForUncheckedSubjectsScript,
@@ -77,6 +83,7 @@ from ..scripts import (
     TimestampScript,
     UpdateCustomListSizeScript,
     UpdateLaneSizeScript,
+    UpdateSearchIndexFragmentsScript,
     WhereAreMyBooksScript,
     WorkClassificationScript,
     WorkProcessingScript,
@@ -784,6 +791,33 @@ class TestRunThreadedCollectionCoverageProviderScript(DatabaseTest):
         assert new_timestamp != original_timestamp
         assert new_timestamp > original_timestamp
 
+    def test_run_claiming_batches(self):
+        provider = AlwaysSuccessfulCollectionCoverageProvider
+        script = RunThreadedCollectionCoverageProviderScript(
+            provider, worker_size=2, _db=self._db, batch_size=1, claim_batches=True
+        )
+        collection = self._collection()
+        ed1, lp1 = self._edition(collection=collection, with_license_pool=True)
+        ed2, lp2 = self._edition(collection=collection, with_license_pool=True)
+        ed3, lp3 = self._edition(collection=collection, with_license_pool=True)
+        self._db.commit()
+
+        pool = DatabasePool(2, script.session_factory)
+        script.run(pool=pool)
+        self._db.commit()
+
+        # Instead of one job per batch, there's one job per worker.
+        # Each job kept claiming batches until there were none left.
+        assert 2 == pool.job_total
+
+        source = DataSource.lookup(self._db, provider.DATA_SOURCE_NAME)
+        identifiers_missing_coverage = Identifier.missing_coverage_from(
+            self._db,
+            provider.INPUT_IDENTIFIER_TYPES,
+            source,
+        )
+        assert [] == identifiers_missing_coverage.all()
+
 
 class TestRunWorkCoverageProviderScript(DatabaseTest):
     def test_constructor(self):
@@ -2982,6 +3016,252 @@ class TestRebuildSearchIndexScript(DatabaseTest):
         assert set(new_coverage) != set(original_coverage)
 
 
+class TestParallelRebuildSearchIndexScript(DatabaseTest):
+    class MockPipeline(object):
+        instances = []
+
+        def __init__(self, search_index_client, session_factory, **kwargs):
+            self.search_index_client = search_index_client
+            self.kwargs = kwargs
+            self.achievements = "Some achievements"
+            self.instances.append(self)
+
+        def run(self, _db, start_id=None):
+            self.start_id = start_id
+            # Pretend some work was done.
+            self.kwargs["checkpoint"](_db, 100)
+            return self
+
+    def test_do_run(self):
+        class MockSearchIndex(MockExternalSearchIndex):
+            setup_index_called = False
+
+            def setup_index(self):
+                self.setup_index_called = True
+
+        index = MockSearchIndex()
+        work = self._work(with_license_pool=True)
+        wcr = WorkCoverageRecord
+        wcr.add_for(work, wcr.UPDATE_SEARCH_INDEX_OPERATION)
+        wcr.add_for(work, wcr.QUALITY_OPERATION)
+
+        script = ParallelRebuildSearchIndexScript(
+            self._db, search_index_client=index, pipeline_class=self.MockPipeline
+        )
+        result = script.do_run(cmd_args=["--producers=3", "--batch-size=10"])
+
+        # The index was destroyed and recreated, and the search
+        # coverage records were removed.
+        assert True == index.setup_index_called
+        assert [wcr.QUALITY_OPERATION] == [x.operation for x in work.coverage_records]
+
+        # The pipeline was created with the given arguments and run
+        # from the beginning.
+        pipeline = self.MockPipeline.instances.pop()
+        assert index == pipeline.search_index_client
+        assert 3 == pipeline.kwargs["producers"]
+        assert 10 == pipeline.kwargs["batch_size"]
+        assert None == pipeline.start_id
+        assert isinstance(result, TimestampData)
+        assert "Some achievements" == result.achievements
+
+        # The checkpoint was stored in the script's Timestamp.
+        timestamp = Timestamp.lookup(
+            self._db, script.script_name, Timestamp.SCRIPT_TYPE, None
+        )
+        assert 100 == timestamp.counter
+
+        # When resuming, the index is left alone and the pipeline
+        # picks up at the checkpoint.
+        index.setup_index_called = False
+        script.do_run(cmd_args=["--resume"])
+        pipeline = self.MockPipeline.instances.pop()
+        assert 100 == pipeline.start_id
+        assert False == index.setup_index_called
+
+
+class TestBlueGreenRebuildSearchIndexScript(DatabaseTest):
+    class MockSearchIndex(MockExternalSearchIndex):
+        CURRENT_INDEX_CACHE_TTL = 0
+
+        def __init__(self, problems=[]):
+            super(
+                TestBlueGreenRebuildSearchIndexScript.MockSearchIndex, self
+            ).__init__()
+            self.problems = problems
+            self.calls = []
+
+        def current_alias_index(self, _db):
+            return "works-v4"
+
+        def rebuild_index_name(self, _db):
+            return "works-v4-20200101000000"
+
+        def index_settings(self, index, keys):
+            self.calls.append(("index_settings", index, keys))
+            return dict(refresh_interval="30s")
+
+        def setup_index(self, new_index=None, **index_settings):
+            self.calls.append(("setup_index", new_index, index_settings))
+
+        def finish_bulk_load(self, index, settings):
+            self.calls.append(("finish_bulk_load", index, settings))
+
+        def compare_indexes(self, new_index, old_index, sample_size, tolerance):
+            self.calls.append(
+                ("compare_indexes", new_index, old_index, sample_size, tolerance)
+            )
+            return self.problems
+
+        def transfer_current_alias(self, _db, new_index):
+            self.calls.append(("transfer_current_alias", new_index))
+
+        def remove_work(self, work):
+            self.calls.append(("remove_work", self.works_index, work.id))
+
+    class MockPipeline(object):
+        def __init__(self, search_index_client, session_factory, **kwargs):
+            self.search_index_client = search_index_client
+            self.kwargs = kwargs
+            self.achievements = "Some achievements."
+            self.failed = 0
+
+        def run(self, _db, start_id=None):
+            self.indexed_into = self.search_index_client.works_index
+            self.search_index_client.calls.append(
+                ("run", self.indexed_into, self.kwargs["record_coverage"])
+            )
+            return self
+
+    def test_do_run(self):
+        index = self.MockSearchIndex()
+        script = BlueGreenRebuildSearchIndexScript(
+            self._db, search_index_client=index, pipeline_class=self.MockPipeline
+        )
+
+        # These works were registered for search index updates during
+        # the rebuild, so they're dealt with after the pipeline runs.
+        # A work that's still presentation-ready is indexed again, even
+        # if only part of its document changed.
+        soon = utc_now() + datetime.timedelta(minutes=1)
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        WorkCoverageRecord.add_for(
+            work,
+            WorkCoverageRecord.search_index_fragment_operation(
+                Work.LICENSEPOOLS_FRAGMENT
+            ),
+            timestamp=soon,
+            status=WorkCoverageRecord.REGISTERED,
+        )
+
+        # A work that's no longer presentation-ready is removed.
+        not_ready = self._work(with_license_pool=True)
+        not_ready.presentation_ready = False
+        record = not_ready.external_index_needs_updating()
+        record.timestamp = soon
+
+        # This work wasn't registered during the rebuild, so it's
+        # left alone.
+        unchanged = self._work(with_license_pool=True)
+        unchanged.set_presentation_ready()
+        self._db.flush()
+
+        result = script.do_run(cmd_args=["--sample-size=5"])
+        new_index = "works-v4-20200101000000"
+        assert [
+            (
+                "index_settings",
+                "works-v4",
+                BlueGreenRebuildSearchIndexScript.PRODUCTION_SETTINGS,
+            ),
+            ("setup_index", new_index, index.BULK_LOAD_SETTINGS),
+            # Loading the new index doesn't write coverage records.
+            ("run", new_index, False),
+            ("remove_work", new_index, not_ready.id),
+            ("finish_bulk_load", new_index, dict(refresh_interval="30s")),
+            ("compare_indexes", new_index, "works-v4", 5, 0.01),
+            ("transfer_current_alias", new_index),
+            # The works are brought up to date again once the alias
+            # has moved, in case they changed while the new index was
+            # being finished.
+            ("remove_work", new_index, not_ready.id),
+        ] == index.calls
+        assert [work.id] == [x[-1] for x in index.docs]
+        assert (
+            "Some achievements. Works updated during the rebuild: 2. "
+            "Works updated after the switch: 2." == result.achievements
+        )
+        assert None == result.exception
+
+    def test_do_run_verification_failure(self):
+        index = self.MockSearchIndex(problems=["Something is wrong."])
+        index.works_index = "works-v4"
+        script = BlueGreenRebuildSearchIndexScript(
+            self._db, search_index_client=index, pipeline_class=self.MockPipeline
+        )
+        result = script.do_run(cmd_args=[])
+
+        # The alias wasn't moved, and the script's client is back to
+        # using the current index.
+        assert "transfer_current_alias" not in [x[0] for x in index.calls]
+        assert "works-v4" == index.works_index
+        assert (
+            "works-v4-20200101000000 does not match works-v4; the alias was not moved."
+            == result.exception
+        )
+
+        # With --force, the alias is moved anyway.
+        index.calls = []
+        result = script.do_run(cmd_args=["--force"])
+        assert ("transfer_current_alias", "works-v4-20200101000000") == index.calls[-1]
+        assert None == result.exception
+
+    def test_do_run_indexing_failure(self):
+        class FailingPipeline(self.MockPipeline):
+            def run(self, _db, start_id=None):
+                self.failed = 2
+                return self
+
+        index = self.MockSearchIndex()
+        index.works_index = "works-v4"
+        script = BlueGreenRebuildSearchIndexScript(
+            self._db, search_index_client=index, pipeline_class=FailingPipeline
+        )
+        result = script.do_run(cmd_args=[])
+
+        # Some works never made it into the new index, so the alias
+        # wasn't moved and the indexes weren't even compared.
+        calls = [x[0] for x in index.calls]
+        assert "compare_indexes" not in calls
+        assert "transfer_current_alias" not in calls
+        assert "works-v4" == index.works_index
+        assert (
+            "2 Works could not be added to works-v4-20200101000000; the alias was not moved."
+            == result.exception
+        )
+
+        # With --force, the alias is moved anyway.
+        index.calls = []
+        result = script.do_run(cmd_args=["--force"])
+        assert ("transfer_current_alias", "works-v4-20200101000000") == index.calls[-1]
+        assert None == result.exception
+
+
+class TestUpdateSearchIndexFragmentsScript(DatabaseTest):
+    def test_providers(self):
+        index = MockExternalSearchIndex()
+        script = UpdateSearchIndexFragmentsScript(self._db, search_index_client=index)
+
+        # There's one provider for each fragment of the search document.
+        assert set(Work.SEARCH_DOCUMENT_FRAGMENTS) == set(
+            x.fragment for x in script.providers
+        )
+        for provider in script.providers:
+            assert isinstance(provider, SearchIndexFragmentCoverageProvider)
+            assert index == provider.search_index_client
+
+
 class TestSearchIndexCoverageRemover(DatabaseTest):
 
     SERVICE_NAME = "Search Index Coverage Remover"
@@ -2993,7 +3273,11 @@ class TestSearchIndexCoverageRemover(DatabaseTest):
         decoys = [wcr.QUALITY_OPERATION, wcr.GENERATE_MARC_OPERATION]
 
         # Set up some coverage records.
-        for operation in decoys + [wcr.UPDATE_SEARCH_INDEX_OPERATION]:
+        search_operations = [
+            wcr.UPDATE_SEARCH_INDEX_OPERATION,
+            wcr.search_index_fragment_operation(Work.GENRES_FRAGMENT),
+        ]
+        for operation in decoys + search_operations:
             for w in (work, work2):
                 wcr.add_for(w, operation, status=random.choice(wcr.ALL_STATUSES))
 
@@ -3001,9 +3285,9 @@ class TestSearchIndexCoverageRemover(DatabaseTest):
         script = SearchIndexCoverageRemover(self._db)
         result = script.do_run()
         assert isinstance(result, TimestampData)
-        assert "Coverage records deleted: 2" == result.achievements
+        assert "Coverage records deleted: 4" == result.achievements
 
-        # UPDATE_SEARCH_INDEX_OPERATION records have been removed.
+        # The search index records have been removed.
         # No other records are affected.
         for w in (work, work2):
             remaining = [x.operation for x in w.coverage_records]
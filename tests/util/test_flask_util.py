@@ -7,8 +7,13 @@ from wsgiref.handlers import format_date_time
 
 from flask import Response as FlaskResponse
 
-from ...util.datetime_helpers import utc_now
-from ...util.flask_util import OPDSEntryResponse, OPDSFeedResponse, Response
+from ...util.datetime_helpers import datetime_utc, utc_now
+from ...util.flask_util import (
+    OPDSEntryResponse,
+    OPDSFeedResponse,
+    Response,
+    is_not_modified,
+)
 from ...util.opds_writer import OPDSFeed
 
 
@@ -90,6 +95,19 @@ class TestResponse(object):
         assert "max-age=30" in cache_control
         assert "Authorization" == response.headers["Vary"]
 
+    def test_validators(self):
+        # A content hash becomes a strong ETag, and a timestamp becomes
+        # the Last-Modified header.
+        last_modified = datetime_utc(2021, 1, 2, 3, 4, 5)
+        response = Response("content", content_hash="abcd", last_modified=last_modified)
+        assert '"abcd"' == response.headers["ETag"]
+        assert "Sat, 02 Jan 2021 03:04:05 GMT" == response.headers["Last-Modified"]
+
+        # Without them, neither header is set.
+        response = Response("content")
+        assert "ETag" not in response.headers
+        assert "Last-Modified" not in response.headers
+
     def test_unicode(self):
         # You can easily convert a Response object to Unicode
         # for use in a test.
@@ -148,3 +166,34 @@ class TestOPDSEntryResponse(object):
         override_defaults = c("an entry", content_type="content/type")
         assert "content/type" == override_defaults.content_type
         assert "content/type" == override_defaults.mimetype
+
+
+class TestIsNotModified(object):
+    def test_is_not_modified(self):
+        m = is_not_modified
+        last_modified = datetime_utc(2021, 1, 2, 3, 4, 5, 678)
+        before = "Sat, 02 Jan 2021 03:00:00 GMT"
+        same_second = "Sat, 02 Jan 2021 03:04:05 GMT"
+
+        # An unconditional request always gets the full response.
+        assert False == m("abcd", last_modified)
+
+        # If-None-Match is compared against the content hash, whether
+        # or not the client got a precompressed representation.
+        assert True == m("abcd", last_modified, '"abcd"')
+        assert True == m("abcd", last_modified, '"abcd-gzip"')
+        assert True == m("abcd", last_modified, 'W/"abcd"')
+        assert True == m("abcd", last_modified, '"other", "abcd"')
+        assert True == m("abcd", last_modified, "*")
+        assert False == m("abcd", last_modified, '"other"')
+        assert False == m(None, last_modified, '"abcd"')
+
+        # If-None-Match takes precedence over If-Modified-Since.
+        assert False == m("abcd", last_modified, '"other"', same_second)
+
+        # If-Modified-Since is compared against the timestamp, to the
+        # nearest second.
+        assert True == m("abcd", last_modified, None, same_second)
+        assert False == m("abcd", last_modified, None, before)
+        assert False == m("abcd", None, None, same_second)
+        assert False == m("abcd", last_modified, None, "not a date")
@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 
 import pytest
 import requests
@@ -9,6 +11,7 @@ from ...util.http import (
     HTTP,
     INTEGRATION_ERROR,
     BadResponseException,
+    HostThrottle,
     RemoteIntegrationException,
     RequestNetworkException,
     RequestTimedOut,
@@ -374,3 +377,52 @@ class TestRequestNetworkException(object):
         # The status code corresponding to an upstream timeout is 502.
         document, status_code, headers = standard_detail.response
         assert 502 == status_code
+
+
+class TestHostThrottle(object):
+    def test_max_concurrent(self):
+        throttle = HostThrottle(max_concurrent=2)
+        lock = threading.Lock()
+        active = dict(current=0, peak=0)
+
+        def request(url):
+            with throttle.request(url):
+                with lock:
+                    active["current"] += 1
+                    active["peak"] = max(active["peak"], active["current"])
+                time.sleep(0.05)
+                with lock:
+                    active["current"] -= 1
+
+        threads = [
+            threading.Thread(target=request, args=("http://a/%d" % i,))
+            for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Never more than two requests to the host at once.
+        assert 2 == active["peak"]
+        assert 0 == active["current"]
+
+        # Each host gets its own slots.
+        with throttle.request("http://a/1"):
+            with throttle.request("http://a/2"):
+                with throttle.request("http://b/"):
+                    pass
+
+    def test_min_interval(self):
+        throttle = HostThrottle(min_interval=0.05)
+        started = []
+        for i in range(3):
+            with throttle.request("http://a/%d" % i):
+                started.append(time.monotonic())
+        assert all(b - a >= 0.05 for a, b in zip(started, started[1:]))
+
+        # A request to a different host doesn't have to wait.
+        before = time.monotonic()
+        with throttle.request("http://b/"):
+            pass
+        assert time.monotonic() - before < 0.05
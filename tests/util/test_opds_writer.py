@@ -42,6 +42,30 @@ class TestOPDSMessage(object):
 
 
 class TestAtomFeed(object):
+    def test_stream(self):
+        feed = AtomFeed("A Feed", "http://feed/")
+        for i in range(3):
+            feed.feed.append(AtomFeed.entry(AtomFeed.title("Entry %d" % i)))
+
+        chunks = list(feed.stream())
+
+        # The start tag, each tag inside the <feed> tag, and the end
+        # tag were yielded separately.
+        assert len(feed.feed) + 2 == len(chunks)
+        assert all(isinstance(x, bytes) for x in chunks)
+        assert b"<title>Entry 1</title>" in chunks[-3]
+
+        # Namespaces declared on the <feed> tag aren't redeclared on
+        # every entry.
+        assert chunks[-3].startswith(b"<entry>")
+
+        # Put together, the chunks make up the same document that
+        # str() would generate.
+        streamed = etree.fromstring(b"".join(chunks))
+        expect = etree.fromstring(str(feed))
+        c14n = dict(method="c14n2", strip_text=True)
+        assert etree.tostring(expect, **c14n) == etree.tostring(streamed, **c14n)
+
     def test_add_link_to_entry(self):
         kwargs = dict(title=1, href="url", extra="extra info")
         entry = AtomFeed.E.entry()
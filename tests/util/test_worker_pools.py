@@ -1,18 +1,37 @@
+import multiprocessing
 import threading
 from contextlib import contextmanager
 
 from ...model import Identifier, SessionManager
 from ...testing import DatabaseTest
 from ...util.worker_pools import (
+    DatabaseBatchJob,
     DatabaseJob,
     DatabasePool,
+    DatabaseProcessPool,
     DatabaseWorker,
     Job,
     Pool,
+    ProcessPool,
     Queue,
     Worker,
 )
 
+# Jobs sent to a ProcessPool must be picklable, so they're defined at
+# the module level.
+
+
+def process_task():
+    return "Nakia"
+
+
+def broken_process_task(*args):
+    raise RuntimeError
+
+
+def database_process_task(_db):
+    _db.execute("select 1")
+
 
 class TestPool(object):
     def test_initializes_with_active_workers(self):
@@ -33,6 +52,33 @@ class TestPool(object):
                 pool.put(task)
             assert 4 == pool.job_total
 
+    def test_queue_size(self):
+        release = threading.Event()
+
+        def blocked_task():
+            release.wait()
+
+        pool = Pool(1, queue_size=1)
+        try:
+            # The worker takes one job and the queue holds one more.
+            pool.put(blocked_task)
+            pool.put(blocked_task)
+
+            # A third job won't fit until the worker makes progress.
+            finished = threading.Event()
+
+            def put_another():
+                pool.put(blocked_task)
+                finished.set()
+
+            threading.Thread(target=put_another, daemon=True).start()
+            assert False == finished.wait(0.1)
+        finally:
+            release.set()
+        assert True == finished.wait(1)
+        pool.join()
+        assert 3 == pool.job_total
+
     def test_pool_tracks_error_count(self):
         def broken_task():
             raise RuntimeError
@@ -75,6 +121,82 @@ class TestPool(object):
         assert 1 / 3.0 == pool.success_rate
 
 
+class TestProcessPool(object):
+    def test_initializes_with_active_workers(self):
+        with ProcessPool(2) as pool:
+            assert 2 == pool.size
+            assert 2 == len(pool.workers)
+            for worker in pool.workers:
+                assert worker.is_alive()
+                assert worker.pid != multiprocessing.current_process().pid
+
+        # Leaving the context shuts the workers down.
+        for worker in pool.workers:
+            assert False == worker.is_alive()
+
+    def test_error_count_and_success_rate(self):
+        pool = ProcessPool(2)
+        try:
+            assert 0 == pool.error_count
+            assert 1.0 == pool.success_rate
+            for i in range(2):
+                pool.put(process_task)
+            pool.put(broken_process_task)
+            pool.join()
+        finally:
+            pool.shutdown()
+
+        # Errors in the worker processes are counted in this one, and
+        # affect the success rate the same way they would in a Pool.
+        assert 3 == pool.job_total
+        assert 1 == pool.error_count
+        assert 1 / 3.0 == pool.success_rate
+
+    def test_shutdown(self):
+        pool = ProcessPool(2)
+        for i in range(4):
+            pool.put(process_task)
+
+        # Shutting down lets the workers finish the jobs already in
+        # the queue, then stops them.
+        pool.shutdown()
+        assert 0 == pool.error_count
+        for worker in pool.workers:
+            assert False == worker.is_alive()
+            assert 0 == worker.exitcode
+
+
+class TestDatabaseProcessPool(DatabaseTest):
+    def test_workers_have_their_own_sessions(self):
+        with DatabaseProcessPool(2) as pool:
+            for worker in pool.workers:
+                assert pool.url == worker.url
+
+                # The session isn't created until the process starts,
+                # so there's none in this process.
+                assert None == worker._db
+            for i in range(4):
+                pool.put(database_process_task)
+        assert 0 == pool.error_count
+
+        # A job that raises an exception is counted as an error.
+        with DatabaseProcessPool(1) as pool:
+            pool.put(broken_process_task)
+        assert 1 == pool.error_count
+
+    def test_put_batches(self):
+        class MockPool(DatabaseProcessPool):
+            def __init__(self):
+                self.queued = []
+
+            def put(self, job):
+                self.queued.append(job)
+
+        pool = MockPool()
+        pool.put_batches(DatabaseBatchJob, range(5), 2)
+        assert [[0, 1], [2, 3], [4]] == [x.ids for x in pool.queued]
+
+
 class TestDatabasePool(DatabaseTest):
     def test_workers_are_created_with_sessions(self):
         session_factory = SessionManager.sessionmaker(session=self._db)
@@ -166,3 +288,24 @@ class TestDatabaseJob(DatabaseTest):
         [identifier] = self._db.query(Identifier).all()
         assert "Keep It" == identifier.type
         assert "100" == identifier.identifier
+
+
+class TestDatabaseBatchJob(DatabaseTest):
+    class MockJob(DatabaseBatchJob):
+        model = Identifier
+
+        def process_batch(self, _db, items):
+            for item in items:
+                item.identifier = "processed"
+
+    def test_run(self):
+        i1 = self._identifier()
+        i2 = self._identifier()
+        i3 = self._identifier()
+        job = self.MockJob([i1.id, i3.id])
+        job.run(self._db)
+
+        # Only the objects whose IDs were in the batch were processed.
+        assert "processed" == i1.identifier
+        assert "processed" != i2.identifier
+        assert "processed" == i3.identifier
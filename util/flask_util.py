@@ -1,14 +1,16 @@
 """Utilities for Flask applications."""
 import datetime
 import time
+from collections.abc import Iterator
 from wsgiref.handlers import format_date_time
 
 import flask
 from flask import Response as FlaskResponse
 from lxml import etree
+from werkzeug.http import parse_date, parse_etags
 
 from . import problem_detail
-from .datetime_helpers import utc_now
+from .datetime_helpers import to_utc, utc_now
 from .opds_writer import OPDSFeed
 
 
@@ -25,6 +27,45 @@ def problem(type, status, title, detail=None, instance=None, headers={}):
     return FlaskResponse(data, status, headers)
 
 
+def is_not_modified(
+    content_hash, last_modified, if_none_match=None, if_modified_since=None
+):
+    """Decide whether a conditional request can be answered with
+    304 Not Modified.
+
+    :param content_hash: The hash of the current representation, as
+        used to build its ETag.
+    :param last_modified: A datetime: when the current representation
+        was generated.
+    :param if_none_match: The value of the request's If-None-Match
+        header.
+    :param if_modified_since: The value of the request's
+        If-Modified-Since header.
+    :return: True if the client's copy is up to date.
+    """
+    if if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since.
+        if not content_hash:
+            return False
+        etags = parse_etags(if_none_match)
+        if etags.star_tag:
+            return True
+        for tag in etags.as_set(include_weak=True):
+            # A precompressed representation has its content coding
+            # appended to the hash; see the @compressible decorator.
+            if tag == content_hash or tag.startswith(content_hash + "-"):
+                return True
+        return False
+
+    if if_modified_since and last_modified:
+        since = parse_date(if_modified_since)
+        if since is None:
+            return False
+        # HTTP dates have a resolution of one second.
+        return to_utc(last_modified).replace(microsecond=0) <= to_utc(since)
+    return False
+
+
 class Response(FlaskResponse):
     """A Flask Response object with some conveniences added.
 
@@ -33,6 +74,13 @@ class Response(FlaskResponse):
        * It's easy to calculate header values such as Cache-Control.
        * A response can be easily converted into a string for use in
          tests.
+       * A response can carry precompressed versions of its body,
+         which the @compressible decorator will use instead of
+         compressing the body itself.
+       * It's easy to set validators (ETag and Last-Modified) for use
+         in conditional requests.
+       * The entity-body can be a generator, in which case it will be
+         streamed to the client.
     """
 
     def __init__(
@@ -45,6 +93,9 @@ class Response(FlaskResponse):
         direct_passthrough=False,
         max_age=0,
         private=None,
+        precompressed=None,
+        content_hash=None,
+        last_modified=None,
     ):
         """Constructor.
 
@@ -57,7 +108,15 @@ class Response(FlaskResponse):
         :param private: If this is True, then the response contains
             information from an authenticated client and should not be stored
             in intermediate caches.
+        :param precompressed: A dictionary mapping HTTP content codings
+            (e.g. 'gzip') to the entity-body compressed with that coding.
+        :param content_hash: A hash of the uncompressed entity-body,
+            used as its strong ETag.
+        :param last_modified: A datetime used as the Last-Modified
+            header.
         """
+        self.precompressed = precompressed or {}
+        self.content_hash = content_hash
         max_age = max_age or 0
         try:
             max_age = int(max_age)
@@ -76,6 +135,10 @@ class Response(FlaskResponse):
         body = response
         if isinstance(body, etree._Element):
             body = etree.tostring(body)
+        elif isinstance(body, Iterator):
+            # This is a streamed response, e.g. from AtomFeed.stream().
+            # Pass it through as-is.
+            pass
         elif not isinstance(body, (bytes, str)):
             body = str(body)
 
@@ -87,6 +150,10 @@ class Response(FlaskResponse):
             content_type=content_type,
             direct_passthrough=direct_passthrough,
         )
+        if content_hash:
+            self.set_etag(content_hash)
+        if last_modified:
+            self.last_modified = last_modified
 
     def __str__(self):
         """This object can be treated as a string, e.g. in tests.
@@ -150,6 +217,9 @@ class OPDSFeedResponse(Response):
         direct_passthrough=False,
         max_age=None,
         private=None,
+        precompressed=None,
+        content_hash=None,
+        last_modified=None,
     ):
 
         mimetype = mimetype or OPDSFeed.ACQUISITION_FEED_TYPE
@@ -165,6 +235,9 @@ class OPDSFeedResponse(Response):
             direct_passthrough=direct_passthrough,
             max_age=max_age,
             private=private,
+            precompressed=precompressed,
+            content_hash=content_hash,
+            last_modified=last_modified,
         )
 
 
@@ -1,4 +1,7 @@
 import logging
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
 from urllib.parse import urlparse
 
 import requests
@@ -461,3 +464,67 @@ class HTTP(object):
                 response_content,
             )
         )
+
+
+class HostThrottle(object):
+    """Keep threads that share a remote service from overwhelming it.
+
+    Each host gets its own limit on concurrent requests, and its own
+    minimum interval between the start of one request and the next.
+    """
+
+    def __init__(self, max_concurrent=None, min_interval=0):
+        """Constructor.
+
+        :param max_concurrent: Allow no more than this many requests to
+            any one host at once. If this is None, there is no limit.
+        :param min_interval: Wait at least this many seconds between
+            starting requests to any one host.
+        """
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self._lock = Lock()
+        self._hosts = dict()
+
+    def _host(self, url):
+        """Find or create the state kept for the host of the given URL."""
+        host = urlparse(url).netloc or url
+        with self._lock:
+            if host not in self._hosts:
+                semaphore = None
+                if self.max_concurrent:
+                    semaphore = BoundedSemaphore(self.max_concurrent)
+                self._hosts[host] = _ThrottledHost(semaphore)
+            return self._hosts[host]
+
+    @contextmanager
+    def request(self, url):
+        """Wait until it's okay to make a request to the given URL, and
+        hold a slot for that URL's host until the block finishes.
+        """
+        host = self._host(url)
+        if host.semaphore:
+            host.semaphore.acquire()
+        try:
+            if self.min_interval:
+                with host.lock:
+                    now = time.monotonic()
+                    if host.last_request is not None:
+                        wait = host.last_request + self.min_interval - now
+                        if wait > 0:
+                            time.sleep(wait)
+                            now = time.monotonic()
+                    host.last_request = now
+            yield
+        finally:
+            if host.semaphore:
+                host.semaphore.release()
+
+
+class _ThrottledHost(object):
+    """The state HostThrottle keeps for a single host."""
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.lock = Lock()
+        self.last_request = None
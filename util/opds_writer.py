@@ -177,6 +177,52 @@ class AtomFeed(object):
             return None
         return etree.tostring(self.feed, encoding="unicode", pretty_print=True)
 
+    def stream(self):
+        """Serialize this feed incrementally.
+
+        Unlike str(), this never holds the whole serialized document
+        in memory; each child of the <feed> tag is yielded as soon as
+        it's been serialized.
+
+        :yield: A sequence of UTF-8 encoded bytestrings.
+        """
+        if self.feed is None:
+            return
+
+        # Serialize an empty copy of the <feed> tag to get its start
+        # and end tags.
+        root = etree.Element(self.feed.tag, self.feed.attrib, nsmap=self.feed.nsmap)
+        root.text = "\n"
+        start_tag, end_tag = etree.tostring(root, encoding="utf-8").split(b"\n", 1)
+
+        # A tag serialized on its own redeclares every namespace in
+        # scope. The ones that are already declared on the <feed> tag
+        # can be left out.
+        declarations = start_tag[start_tag.index(b" ") : -1]
+
+        yield start_tag + b"\n"
+        for element in self._elements_to_stream():
+            chunk = self._serialize_element(element)
+            head, sep, rest = chunk.partition(b">")
+            if declarations and declarations in head:
+                chunk = head.replace(declarations, b"", 1) + sep + rest
+            yield chunk
+        yield end_tag
+
+    def _elements_to_stream(self):
+        """Find the tags that go inside the <feed> tag when it's streamed."""
+        return iter(self.feed)
+
+    def _serialize_element(self, element):
+        """Serialize one of the tags inside the <feed> tag.
+
+        :param element: An lxml Element.
+        :return: A UTF-8 encoded bytestring.
+        """
+        return etree.tostring(
+            element, encoding="utf-8", pretty_print=True, with_tail=False
+        )
+
 
 class OPDSFeed(AtomFeed):
 
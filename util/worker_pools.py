@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 from contextlib import contextmanager
 from queue import Queue
 from threading import RLock, Thread, settrace
@@ -6,9 +7,10 @@ from threading import RLock, Thread, settrace
 # Much of the work in this file is based on
 # https://github.com/shazow/workerpool, with
 # great appreciation.
-
-# TODO: Consider supporting multiprocessing as well as
-# (or instead of) multithreading.
+#
+# The thread-based pools are fine for jobs that spend most of their
+# time waiting on the network or the database. CPU-bound jobs should
+# use ProcessPool or DatabaseProcessPool instead.
 
 
 class Worker(Thread):
@@ -69,8 +71,16 @@ class Pool(object):
 
     log = logging.getLogger(__name__)
 
-    def __init__(self, size, worker_factory=None):
-        self.jobs = Queue()
+    def __init__(self, size, worker_factory=None, queue_size=0):
+        """Constructor.
+
+        :param size: The number of Worker threads.
+        :param worker_factory: A callable that creates a Worker for this pool.
+        :param queue_size: If this is positive, put() will block once
+            this many jobs are waiting to be run, so whatever is feeding
+            the pool can't get too far ahead of the workers.
+        """
+        self.jobs = Queue(maxsize=queue_size)
 
         self.size = size
         self.workers = list()
@@ -135,17 +145,227 @@ class Pool(object):
 class DatabasePool(Pool):
     """A pool of DatabaseWorker threads and a job queue to keep them busy."""
 
-    def __init__(self, size, session_factory, worker_factory=None):
+    def __init__(self, size, session_factory, worker_factory=None, queue_size=0):
         self.session_factory = session_factory
 
         self.worker_factory = worker_factory or DatabaseWorker.factory
-        super(DatabasePool, self).__init__(size, worker_factory=self.worker_factory)
+        super(DatabasePool, self).__init__(
+            size, worker_factory=self.worker_factory, queue_size=queue_size
+        )
 
     def create_worker(self):
         worker_session = self.session_factory()
         return self.worker_factory(self, worker_session)
 
 
+class ProcessWorker(multiprocessing.Process):
+    """A Process that performs jobs.
+
+    Jobs are sent to the process by pickling them, so a job must be
+    either a module-level function or an instance of a module-level
+    Job class.
+    """
+
+    @classmethod
+    def factory(cls, worker_pool):
+        return cls(worker_pool.jobs, worker_pool.errors)
+
+    def __init__(self, jobs, errors):
+        """Constructor.
+
+        :param jobs: A multiprocessing.JoinableQueue of jobs. A job of
+            None tells the process to shut down.
+        :param errors: A multiprocessing.Value counting the jobs that
+            have raised exceptions, shared by every worker in a pool.
+        """
+        super(ProcessWorker, self).__init__()
+        self.daemon = True
+        self.jobs = jobs
+        self.errors = errors
+
+    @property
+    def log(self):
+        return logging.getLogger(self.name)
+
+    def run(self):
+        self.setup()
+        try:
+            while True:
+                job = self.jobs.get()
+                try:
+                    if job is None:
+                        break
+                    self.do_job(job)
+                except Exception as e:
+                    with self.errors.get_lock():
+                        self.errors.value += 1
+                    self.log.error("Job raised error: %r", e, exc_info=e)
+                finally:
+                    self.jobs.task_done()
+        finally:
+            self.teardown()
+
+    def setup(self):
+        """Prepare the process to start taking jobs."""
+        pass
+
+    def teardown(self):
+        """Clean up once the process is told to shut down."""
+        pass
+
+    def do_job(self, job, *args, **kwargs):
+        if callable(job):
+            job(*args, **kwargs)
+            return
+        job.run(*args, **kwargs)
+
+
+class DatabaseProcessWorker(ProcessWorker):
+    """A worker Process that performs jobs with its own database
+    engine and session.
+
+    An engine can't be shared between processes, so nothing to do
+    with the database is created until the process has started.
+    """
+
+    @classmethod
+    def factory(cls, worker_pool, url):
+        return cls(worker_pool.jobs, worker_pool.errors, url)
+
+    def __init__(self, jobs, errors, url):
+        super(DatabaseProcessWorker, self).__init__(jobs, errors)
+        self.url = url
+        self.engine = None
+        self._db = None
+
+    def setup(self):
+        from sqlalchemy.orm import Session
+
+        from ..model import SessionManager
+
+        self.engine = SessionManager.engine(self.url)
+        self._db = Session(bind=self.engine)
+
+    def teardown(self):
+        if self._db is not None:
+            self._db.close()
+        if self.engine is not None:
+            self.engine.dispose()
+
+    def do_job(self, job):
+        super(DatabaseProcessWorker, self).do_job(job, self._db)
+
+
+class ProcessPool(Pool):
+    """A pool of worker Processes and a job queue to keep them busy.
+
+    This has the same API as Pool, but the jobs can run on every CPU
+    core at once.
+    """
+
+    # How long shutdown() waits for a worker to finish its last job
+    # before terminating it.
+    SHUTDOWN_TIMEOUT = 30
+
+    def __init__(self, size, worker_factory=None, queue_size=0):
+        """Constructor.
+
+        :param size: The number of worker Processes.
+        :param worker_factory: A callable that creates a ProcessWorker
+            for this pool.
+        :param queue_size: If this is positive, put() will block once
+            this many jobs are waiting to be run.
+        """
+        self.jobs = multiprocessing.JoinableQueue(maxsize=queue_size)
+
+        # Workers can't call inc_error() in this process, so they
+        # count their errors here instead.
+        self.errors = multiprocessing.Value("i", 0)
+
+        self.size = size
+        self.workers = list()
+        self.job_total = 0
+
+        self.worker_factory = worker_factory or ProcessWorker.factory
+        for i in range(self.size):
+            w = self.create_worker()
+            self.workers.append(w)
+            w.start()
+
+    @property
+    def error_count(self):
+        return self.errors.value
+
+    def inc_error(self):
+        with self.errors.get_lock():
+            self.errors.value += 1
+
+    def __exit__(self, type, value, traceback):
+        try:
+            return super(ProcessPool, self).__exit__(type, value, traceback)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout=None):
+        """Stop the worker Processes once they've finished the jobs
+        already in the queue.
+
+        :param timeout: Terminate any worker that hasn't stopped after
+            this many seconds. Defaults to SHUTDOWN_TIMEOUT.
+        """
+        if timeout is None:
+            timeout = self.SHUTDOWN_TIMEOUT
+        live = [w for w in self.workers if w.is_alive()]
+        for w in live:
+            self.jobs.put(None)
+        for w in live:
+            w.join(timeout)
+            if w.is_alive():
+                self.log.warning("Terminating unresponsive worker %s", w.name)
+                w.terminate()
+                w.join()
+
+
+class DatabaseProcessPool(ProcessPool):
+    """A pool of DatabaseProcessWorkers and a job queue to keep them busy.
+
+    Database objects can't be sent to another process, so jobs should
+    identify the objects they work on by primary key. See
+    DatabaseBatchJob.
+    """
+
+    def __init__(self, size, url=None, worker_factory=None, queue_size=0):
+        """Constructor.
+
+        :param url: The URL of the database. Each worker Process
+            creates its own engine for this URL. Defaults to the
+            site's database.
+        """
+        if url is None:
+            from ..config import Configuration
+
+            url = Configuration.database_url()
+        self.url = url
+        self.worker_factory = worker_factory or DatabaseProcessWorker.factory
+        super(DatabaseProcessPool, self).__init__(
+            size, worker_factory=self.worker_factory, queue_size=queue_size
+        )
+
+    def create_worker(self):
+        return self.worker_factory(self, self.url)
+
+    def put_batches(self, job_class, ids, batch_size, **kwargs):
+        """Split a list of primary keys into batches and queue up a
+        job for each batch.
+
+        :param job_class: A subclass of DatabaseBatchJob.
+        :param ids: A list of primary keys.
+        :param kwargs: Passed into the constructor of `job_class`.
+        """
+        for job in job_class.batches(ids, batch_size, **kwargs):
+            self.put(job)
+
+
 class Job(object):
     """Abstract parent class for a bit o' work that can be run in a Thread.
     For use with Worker.
@@ -182,3 +402,32 @@ class DatabaseJob(Job):
 
     def do_run(self):
         raise NotImplementedError()
+
+
+class DatabaseBatchJob(DatabaseJob):
+    """A DatabaseJob that works on a batch of database objects.
+
+    The objects are identified by primary key, so the job can be sent
+    to a worker Process that has its own database session.
+    """
+
+    # The model class of the objects in a batch.
+    model = None
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    @classmethod
+    def batches(cls, ids, batch_size, **kwargs):
+        """Split a list of primary keys into jobs of `batch_size`."""
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            yield cls(ids[start : start + batch_size], **kwargs)
+
+    def do_run(self, _db):
+        items = _db.query(self.model).filter(self.model.id.in_(self.ids)).all()
+        self.process_batch(_db, items)
+
+    def process_batch(self, _db, items):
+        """Do the work on a batch of database objects."""
+        raise NotImplementedError()